@@ -1,13 +1,15 @@
+import asyncio
+import json
 import os
 import time
-from concurrent.futures import Future
-from concurrent.futures.thread import ThreadPoolExecutor
-from math import ceil
-from typing import TypedDict
+from typing import TypedDict, Optional, Callable, Any, AsyncIterator
 
-import requests
 from requests import Response
 
+from metrics import METRICS
+from payload_decoder import ItemPricesTuple, ItemListingsTuple, decode_prices, decode_listings
+from request_engine import RequestEngine
+
 
 class ItemJson(TypedDict):
     """typed dict to represent a simplified api response to a /items request"""
@@ -15,6 +17,7 @@ class ItemJson(TypedDict):
     id: int
     name: str
     vendor_value: int
+    flags: list[str]
 
 
 class BuysSellsItemPricesJson(TypedDict):
@@ -47,7 +50,7 @@ class ItemListingsJson(TypedDict):
 
 
 class ApiHandler(object):
-    """handler for interacting with the gw2 api. executes bulk request in threaded fashion"""
+    """handler for interacting with the gw2 api. executes bulk requests concurrently through a RequestEngine"""
 
     # some base constants
     BASE_URL: str = "https://api.guildwars2.com/v2/"
@@ -56,95 +59,135 @@ class ApiHandler(object):
     DEFAULT_ARGS: dict[str, str] = {"lang": "en"}
     REFRESH_TIME: int = 120  # refresh all api data every x seconds (must be initiated externally)
     MAX_RETRY_COUNT: int = 10
-
-    def _request_thread(self, path: str, args: dict[str, str]) -> requests.models.Response:
-        """a basic thread to execute a single request to the api. is used by _bulk_request"""
-
+    MAX_RETRY_TIME: float = 20.0  # seconds a failing request is retried for before its ids are left for the next tick
+    MAX_CONCURRENCY: int = 16  # max number of requests in flight at the same time
+    REQUESTS_PER_MINUTE: int = 600  # rate limit of the api
+    LISTING_CUTOFF: int = 10  # number of price levels per side kept from a /listings response, see <_cut_listing>
+    INVALID_ID_TTL: float = 3600.0  # seconds an id the api reported as invalid isn't requested again
+    ALL_INVALID_TEXT: str = "all ids provided are invalid"  # body text of the 404 for a request without any valid id
+
+    def __init__(self, base_url: str = None, engine: RequestEngine = None):
+        # base_url and engine can be replaced to run against a local stand-in for the api
+        self.base_url: str = self.BASE_URL if base_url is None else base_url
+        self.engine: RequestEngine = RequestEngine(max_concurrency=self.MAX_CONCURRENCY,
+                                                   requests_per_minute=self.REQUESTS_PER_MINUTE,
+                                                   max_retry_count=self.MAX_RETRY_COUNT,
+                                                   max_retry_time=self.MAX_RETRY_TIME) if engine is None else engine
+        # path -> ids the api reported as invalid for that path -> monotonic time until which they aren't requested.
+        # items drop off the trading post for a while at times, so an id is only blocked for INVALID_ID_TTL
+        self.invalid_ids: dict[str, dict[int, float]] = {}
+
+    def _bulk_request(self, path: str, arg_list: list[dict]) -> list[Optional[Response]]:
+        # see <_bulk_request_by_id_list>
         # merge default args with provided args. provided args will overwrite default ones if different
         # values are specified for the same keys
-        args: dict = self.DEFAULT_ARGS | args
-        return requests.get(path, params=args)
-
-    def _bulk_request(self, path: str, arg_list: list[dict]) -> list[requests.models.Response]:
-        # see <_bulk_request_by_id_list>
-        # TODO: make status code handling more robust
-        assert len(arg_list) <= self.MAX_PAGE_SIZE
-
-        response_list: list[Response] = []
-
-        with ThreadPoolExecutor() as executor:
-            # number of retries before we fall back onto Null
-            max_try_count: int = self.MAX_RETRY_COUNT
-
-            # spawn threads for individual requests
-            future_list: list[Future] = [executor.submit(self._request_thread, path, args) for args in arg_list]
-
-            # join on each thread in order and append the responses to the return list
-            for j in range(len(future_list)):
-                success: bool = False
-                future = future_list[j]
-                response: Response = future.result()
-                try_count: int = 0
-                while not success and try_count < max_try_count:
-                    if try_count > 0:
-                        # previous response has been deemed invalid
-                        print("sending request again...")
-                        response = executor.submit(self._request_thread, path, arg_list[j]).result()
-
-                    if response.status_code in [500, 504, 429]:
-                        # Timeout errors for the most part
-                        print(f"got status code {response.status_code}. Will try to repeat the request")
-                        if response.status_code == 429:
-                            # Too Many Requests. Wait 30s before retrying, should be enough for 600/min rate-limiting.
-                            time.sleep(30)
-                        else:
-                            # give the server a bit of time to get things in order
-                            time.sleep(5)
-
-                    elif response.status_code == 206:
-                        # sometimes returned if invalid ids were provided. sometimes for other stuff, not sure
-                        response_warning_split: list[str] = response.headers["warning"].split()
-                        print(response_warning_split)
-                        print(f"got status code 206, request was partial success. Got headers:\n {response.headers}\n"
-                              f"warning: {response.headers['warning']}\n"
-                              "list of invalid id's:", [int(response_warning_split[i + 1][:-1]) for i in
-                                                        range(len(response_warning_split))
-                                                        if response_warning_split[i] == "id"])
-
-                    elif response.status_code != 200:
-                        # catch-all
-                        print(f"got code {response.status_code} for request with\n "
-                              f"url:\n"
-                              f"{response.request.url}\n"
-                              f"headers:\n"
-                              f"{response.headers}")
-                    else:
-                        # status code 200
-                        success = True
-
-                    if try_count == max_try_count - 1:
-                        print("couldn't get a proper response. returning None and hoping that nothing breaks")
-                        response_list.append([None] * len(arg_list[j]["id"].split(",")))
-                    try_count += 1
-
-                response_list.append(response)
-
+        response_list: list[Optional[Response]] = self.engine.run_all(path, [self.DEFAULT_ARGS | args
+                                                                             for args in arg_list])
+        for response in response_list:
+            self._report(response)
         return response_list
 
-    def _bulk_request_by_id_list(self, path: str, id_list: list[int]) -> list[Response]:
-        """This will execute bulk requests in threaded fashion by submitting <_request_thread>s to a ThreadPoolExecutor.
-        The id list is split into chunks of <=200 ids each, which are then passed as arguments to an individual request.
-
-        The responses in the returned list are in the same order as the respective arguments provided by the iterator.
-        If requests fail, they are handled using a mixture of console outputs, retries and giving up. If a valid
-        response can not be obtained, Null will be returned in its place"""
-
-        # create a list of arguments to be passed to _bulk_request
-        args_iterator: list[dict] = [
-            {"ids": str(id_list[i * self.MAX_PAGE_SIZE:min((i + 1) * self.MAX_PAGE_SIZE, len(id_list))])[1:-1]}
-            for i in range(ceil(len(id_list) / self.MAX_PAGE_SIZE))]
+    @staticmethod
+    def _report(response: Optional[Response]) -> None:
+        if response is not None and response.status_code == 206:
+            # sometimes returned if invalid ids were provided. the response then only contains the valid ones
+            print(f"got status code 206, request was partial success. warning: {response.headers.get('warning')}")
+        elif response is not None and response.status_code != 200:
+            # catch-all
+            print(f"got code {response.status_code} for request with\n "
+                  f"url:\n"
+                  f"{response.request.url}\n"
+                  f"headers:\n"
+                  f"{response.headers}")
+
+    def _chunk_id_list(self, id_list: list[int]) -> list[list[int]]:
+        """splits <id_list> into chunks of at most MAX_PAGE_SIZE ids, one chunk per request"""
+
+        return [id_list[i:i + self.MAX_PAGE_SIZE] for i in range(0, len(id_list), self.MAX_PAGE_SIZE)]
 
-        return self._bulk_request(path, args_iterator)
+    @staticmethod
+    def _id_args(id_chunk: list[int]) -> dict[str, str]:
+        return {"ids": ",".join(map(str, id_chunk))}
+
+    def _align_to_ids(self, path: str, id_chunk: list[int], response: Optional[Response],
+                      decode: Callable[[bytes], list], id_of: Callable[[Any], int]) -> list[Optional[Any]]:
+        """returns the decoded objects of <response> in the order of <id_chunk>, with None in place of every id the api
+        didn't return an object for (invalid ids in a 206 response, or the whole chunk if the request failed). the
+        invalid ids, and all of <id_chunk> if the api answered that none of them is valid, are added to the blocklist
+        of <path>"""
+
+        if response is not None and response.status_code == 404 and self.ALL_INVALID_TEXT in response.text:
+            self._block(path, id_chunk)
+            return [None] * len(id_chunk)
+        if response is None or response.status_code not in (200, 206):
+            return [None] * len(id_chunk)
+        by_id: dict[int, Any] = {id_of(obj): obj for obj in decode(response.content)}
+        if response.status_code == 206:
+            self._block(path, [item_id for item_id in id_chunk if item_id not in by_id])
+        return [by_id.get(item_id) for item_id in id_chunk]
+
+    def _block(self, path: str, id_list: list[int]) -> None:
+        blocked_until: float = time.monotonic() + self.INVALID_ID_TTL
+        self.invalid_ids.setdefault(path, {}).update((item_id, blocked_until) for item_id in id_list)
+        METRICS.inc("api_invalid_ids", len(id_list))
+
+    def forget_invalid_ids(self, id_list: list[int]) -> None:
+        """lifts the block of every id of <id_list>, e.g. the ids that are listed on the trading post again"""
+
+        for invalid in self.invalid_ids.values():
+            for item_id in id_list:
+                invalid.pop(item_id, None)
+
+    def _split_invalid(self, path: str, id_list: list[int]) -> tuple[list[int], list[int]]:
+        """splits <id_list> into the ids to request and the ones known to be invalid for <path>. blocks that ran out
+        are dropped first"""
+
+        invalid: dict[int, float] = self.invalid_ids.get(path, {})
+        time_now: float = time.monotonic()
+        for item_id in [item_id for item_id, blocked_until in invalid.items() if blocked_until <= time_now]:
+            del invalid[item_id]
+        if len(invalid) == 0:
+            return id_list, []
+        return [item_id for item_id in id_list if item_id not in invalid], \
+            [item_id for item_id in id_list if item_id in invalid]
+
+    def _bulk_request_by_id_list(self, path: str, id_list: list[int], decode: Callable[[bytes], list] = json.loads,
+                                 id_of: Callable[[Any], int] = lambda obj: obj["id"]) -> list[Optional[Any]]:
+        """This will execute bulk requests concurrently through the RequestEngine of the handler.
+        The id list is split into chunks of <=200 ids each, which are then passed as arguments to an individual request.
+        The body of each response is turned into a list of objects by <decode>, <id_of> has to return the id of such an
+        object. By default the plain json objects are returned.
+
+        The returned objects are in the same order as the provided ids. If requests fail, they are retried by the
+        engine. If a valid response can not be obtained, None will be returned in place of each of its objects. Ids the
+        api reported as invalid within the last INVALID_ID_TTL seconds aren't requested again and are None as well"""
+
+        valid_ids, invalid_ids = self._split_invalid(path, id_list)
+        id_chunks: list[list[int]] = self._chunk_id_list(valid_ids)
+        response_list: list[Optional[Response]] = self._bulk_request(path, [self._id_args(id_chunk)
+                                                                            for id_chunk in id_chunks])
+        objects: list[Optional[Any]] = [obj for id_chunk, response in zip(id_chunks, response_list)
+                                        for obj in self._align_to_ids(path, id_chunk, response, decode, id_of)]
+        if len(invalid_ids) == 0:
+            return objects
+        by_id: dict[int, Any] = dict(zip(valid_ids, objects))
+        return [by_id.get(item_id) for item_id in id_list]
+
+    async def _iter_chunks_by_id_list(self, path: str, id_list: list[int], decode: Callable[[bytes], list],
+                                      id_of: Callable[[Any], int], semaphore: asyncio.Semaphore = None) \
+            -> AsyncIterator[tuple[list[int], list[Optional[Any]]]]:
+        """streaming version of <_bulk_request_by_id_list>. yields (id chunk, objects of the chunk) tuples in the
+        order the requests complete, so the objects of a chunk can be used while the others are still in flight. ids
+        known to be invalid come first, in a chunk of their own without any request"""
+
+        valid_ids, invalid_ids = self._split_invalid(path, id_list)
+        if len(invalid_ids) > 0:
+            yield invalid_ids, [None] * len(invalid_ids)
+        id_chunks: list[list[int]] = self._chunk_id_list(valid_ids)
+        async for index, response in self.engine.iter_completed(
+                path, [self.DEFAULT_ARGS | self._id_args(id_chunk) for id_chunk in id_chunks], semaphore):
+            self._report(response)
+            yield id_chunks[index], self._align_to_ids(path, id_chunks[index], response, decode, id_of)
 
     @staticmethod
     def _cut_listing(listing: ItemListingsJson) -> ItemListingsJson:
@@ -152,45 +195,84 @@ class ApiHandler(object):
         computational effort which would for the most part be false positives anyway (namely relists/cancels instead of
         actual buys or sells)"""
 
-        listing_cutoff: int = 10
-
         return {
             "id": listing['id'],
-            "buys": listing['buys'][:listing_cutoff],
-            "sells": listing['sells'][:listing_cutoff]
+            "buys": listing['buys'][:ApiHandler.LISTING_CUTOFF],
+            "sells": listing['sells'][:ApiHandler.LISTING_CUTOFF]
         }
 
     @staticmethod
     def _cut_item(api_item) -> ItemJson:
-        """This method creates a new ItemJson from a full /items response of the api, since we only need id and name and
-        don't care about the rest"""
+        """This method creates a new ItemJson from a full /items response of the api, since we only need id, name,
+        vendor value and flags and don't care about the rest"""
 
         return {
             "id": api_item["id"],
             "name": api_item["name"],
-            "vendor_value": api_item["vendor_value"] if "NoSell" not in api_item["flags"] else 0
+            "vendor_value": api_item["vendor_value"] if "NoSell" not in api_item["flags"] else 0,
+            "flags": api_item["flags"]
         }
 
+    def get_id_list(self, endpoint: str, validators: dict[str, str] = None) \
+            -> tuple[Optional[list[int]], dict[str, str]]:
+        """This method requests the list of all ids of an endpoint like "items" or "commerce/listings". If <validators>
+        from a previous call are provided, the request is made conditional on the list having changed since then.
+        Returns the id list, or None if it didn't change (or couldn't be obtained), together with the validators (ETag
+        and Last-Modified headers) to use for the next call"""
+
+        validators = {} if validators is None else validators
+        headers: dict[str, str] = {}
+        if "etag" in validators:
+            headers["If-None-Match"] = validators["etag"]
+        if "last_modified" in validators:
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        response: Optional[Response] = self.engine.run_all(self.base_url + endpoint, [{}], headers)[0]
+        if response is None or response.status_code != 200:
+            # 304 Not Modified, or no usable response at all. either way the previous list is the best we've got
+            return None, validators
+        new_validators: dict[str, str] = {}
+        if "etag" in response.headers:
+            new_validators["etag"] = response.headers["etag"]
+        if "last-modified" in response.headers:
+            new_validators["last_modified"] = response.headers["last-modified"]
+        return response.json(), new_validators
+
     def get_item_listings_by_id_list(self, id_list: list[int] = []) -> list[ItemListingsJson]:
         """This method can be used to request "commerce/listings?ids=<id_list>" for a list of provided id's. The
         returned list[ItemListingsJson] follows the ordering of the provided ids.
         If no list or an empty list is provided, an empty list is returned.
         Individual ItemListingsJsons in the list may be Null if their respective id was considered invalid by the api"""
 
-        path: str = self.BASE_URL + "commerce/listings"
+        path: str = self.base_url + "commerce/listings"
 
-        # get list of bulk responses, it into individual ItemListingsJsons
+        # get list of bulk responses, split into individual ItemListingsJsons
         return [(item_listings if item_listings is None else self._cut_listing(item_listings))
-                for response in self._bulk_request_by_id_list(path, id_list)
-                for item_listings in
-                (response if (type(response) == list and response.contains(None)) else response.json())]
-        # TODO check if this works (in prices and items too)
+                for item_listings in self._bulk_request_by_id_list(path, id_list)]
+
+    def get_item_listings_tuples_by_id_list(self, id_list: list[int] = []) -> list[Optional[ItemListingsTuple]]:
+        """Same as <get_item_listings_by_id_list>, but the responses are decoded straight into compact
+        ItemListingsTuples. Only the first LISTING_CUTOFF levels of each ladder are decoded, the rest of the response
+        is skipped"""
+
+        path: str = self.base_url + "commerce/listings"
+        return self._bulk_request_by_id_list(path, id_list,
+                                             lambda payload: decode_listings(payload, self.LISTING_CUTOFF),
+                                             lambda item_listings: item_listings.id)
+
+    def iter_item_listings_tuples(self, id_list: list[int], semaphore: asyncio.Semaphore = None) \
+            -> AsyncIterator[tuple[list[int], list[Optional[ItemListingsTuple]]]]:
+        """streaming version of <get_item_listings_tuples_by_id_list>, see <_iter_chunks_by_id_list>"""
+
+        return self._iter_chunks_by_id_list(self.base_url + "commerce/listings", id_list,
+                                            lambda payload: decode_listings(payload, self.LISTING_CUTOFF),
+                                            lambda item_listings: item_listings.id, semaphore)
 
     @staticmethod
     def _cut_prices(response_json) -> ItemPricesJson:
         """This method removes the item 'whitelisted' from an ItemPricesJson returned by the api, as we never use it"""
 
-        del response_json["whitelisted"]
+        response_json.pop("whitelisted", None)
         return response_json
 
     def get_item_prices_by_id_list(self, id_list: list[int] = []) -> list[ItemPricesJson]:
@@ -199,12 +281,24 @@ class ApiHandler(object):
         If no list or an empty list is provided, an empty list is returned.
         Individual ItemPricesJsons in the list may be Null if their respective id was considered invalid by the api"""
 
-        path: str = self.BASE_URL + "commerce/prices"
+        path: str = self.base_url + "commerce/prices"
+
+        # get list of bulk responses, split into individual ItemPricesJsons
+        return [(item_prices if item_prices is None else self._cut_prices(item_prices))
+                for item_prices in self._bulk_request_by_id_list(path, id_list)]
+
+    def get_item_prices_tuples_by_id_list(self, id_list: list[int] = []) -> list[Optional[ItemPricesTuple]]:
+        """Same as <get_item_prices_by_id_list>, but the responses are decoded straight into compact ItemPricesTuples"""
+
+        path: str = self.base_url + "commerce/prices"
+        return self._bulk_request_by_id_list(path, id_list, decode_prices, lambda item_prices: item_prices.id)
+
+    def iter_item_prices_tuples(self, id_list: list[int], semaphore: asyncio.Semaphore = None) \
+            -> AsyncIterator[tuple[list[int], list[Optional[ItemPricesTuple]]]]:
+        """streaming version of <get_item_prices_tuples_by_id_list>, see <_iter_chunks_by_id_list>"""
 
-        # get list of bulk responses, it into individual ItemPricesJsons
-        return [(item_prices if item_prices is None else self._cut_prices(item_prices)) for response in
-                self._bulk_request_by_id_list(path, id_list) for
-                item_prices in (response if (type(response) == list and response.contains(None)) else response.json())]
+        return self._iter_chunks_by_id_list(self.base_url + "commerce/prices", id_list, decode_prices,
+                                            lambda item_prices: item_prices.id, semaphore)
 
     def get_items_by_id_list(self, id_list: list[int] = []) -> list[ItemJson]:
         """This method can be used to request "commerce/items?ids=<id_list>" for a list of provided id's. The
@@ -212,9 +306,8 @@ class ApiHandler(object):
         If no list or an empty list is provided, an empty list is returned.
         Individual ItemJson in the list may be Null if their respective id was considered invalid by the api"""
 
-        path: str = self.BASE_URL + "items"
+        path: str = self.base_url + "items"
 
-        # get list of bulk responses, it into individual ItemJsons
-        return [(item if item is None else self._cut_item(item)) for response in
-                self._bulk_request_by_id_list(path, id_list) for
-                item in (response if (type(response) == list and response.contains(None)) else response.json())]
+        # get list of bulk responses, split into individual ItemJsons
+        return [(item if item is None else self._cut_item(item))
+                for item in self._bulk_request_by_id_list(path, id_list)]
@@ -0,0 +1,290 @@
+import argparse
+import json
+import math
+from typing import Iterator, Optional
+
+import numpy as np
+
+from api_handler import ApiHandler
+from catalogue import ItemCatalogue
+from db import TimeSeriesStore, state_from_snapshots
+from flip_engine import FlipBatch, evaluate_flips
+from market_state import MarketState
+
+# trade phases
+BUYING: int = 0
+SELLING: int = 1
+CLOSED: int = 2
+
+
+class TradeBook(object):
+    """every simulated trade of a backtest, one array element per trade. a trade places a BuyOrder at the buy_price of
+    its flip, lists everything it bought as a SellOrder at the expected_sell_price and is closed once everything is
+    sold, or once a phase runs out of time (see Backtest.patience). fills are simulated against the amounts the
+    observed ladders show as sold into buy orders / bought from sell listings: an order only fills while it is the
+    best in its book (at least as good as the best price of the previous tick), and then takes those amounts before
+    anyone else"""
+
+    FIELDS: dict[str, type] = {
+        "row": np.int64, "param": np.int64, "opened": np.float64, "buy_deadline": np.float64,
+        "sell_deadline": np.float64, "buy_price": np.int64, "sell_price": np.int64, "quantity": np.int64,
+        "predicted_profit": np.int64, "predicted_buy_time": np.float64, "predicted_sell_time": np.float64,
+        "bought": np.int64, "sold": np.int64, "bought_at": np.float64, "closed_at": np.float64,
+        "profit": np.float64, "phase": np.int8
+    }
+
+    def __init__(self):
+        for field, dtype in self.FIELDS.items():
+            setattr(self, field, np.zeros(0, dtype=dtype))
+
+    def __len__(self) -> int:
+        return len(self.row)
+
+    def open(self, **fields: np.ndarray) -> None:
+        """adds trades with the given fields, the remaining ones start at zero"""
+
+        n: int = len(fields["row"])
+        for field, dtype in self.FIELDS.items():
+            added: np.ndarray = np.asarray(fields[field], dtype=dtype) if field in fields else np.zeros(n, dtype=dtype)
+            setattr(self, field, np.concatenate([getattr(self, field), added]))
+
+    def compact(self) -> "TradeBook":
+        """splits off the closed trades into a new TradeBook"""
+
+        closed: np.ndarray = self.phase == CLOSED
+        done: TradeBook = TradeBook()
+        for field in self.FIELDS:
+            setattr(done, field, getattr(self, field)[closed])
+            setattr(self, field, getattr(self, field)[~closed])
+        return done
+
+    @staticmethod
+    def concatenate(books: list["TradeBook"]) -> "TradeBook":
+        result: TradeBook = TradeBook()
+        for field in TradeBook.FIELDS:
+            setattr(result, field, np.concatenate([getattr(result, field)] + [getattr(book, field) for book in books]))
+        return result
+
+
+def _sell_profit(amount: np.ndarray, listing_price: np.ndarray, buy_price: np.ndarray) -> np.ndarray:
+    # SellOrder.fill, with the 5% listing fee paid when the order was listed
+    tax_paid: np.ndarray = np.ceil(0.05 * listing_price)
+    return np.floor(amount * (0.9 * listing_price - tax_paid - buy_price))
+
+
+class Backtest(object):
+    """replays the snapshots of a TimeSeriesStore through a MarketState and evaluate_flips, opens simulated trades for
+    the best flips every <eval_every> seconds and compares what they realize with what the flips predicted.
+    every (trade_type, out_bid_p, budget) in <params> is evaluated in the same replay, and so is every stats period
+    in <stats_period> (trade_type indexes into it), so a whole parameter sweep costs a single pass over the data"""
+
+    def __init__(self, store: TimeSeriesStore, params: list[tuple[int, float, int]], stats_period: list[int] = None,
+                 trades_per_param: int = 50, eval_every: int = 3600, warmup: int = None, patience: float = 2.0,
+                 vendor_value: dict[int, int] = None):
+        self.store: TimeSeriesStore = store
+        self.params: list[tuple[int, float, int]] = params
+        self.stats_period: list[int] = MarketState.STATS_PERIOD if stats_period is None else stats_period
+        self.trades_per_param: int = trades_per_param  # trades opened per params at each evaluation
+        self.eval_every: int = eval_every  # seconds between two evaluations
+        # seconds of data to replay before the first evaluation, so the weighted stats have settled
+        self.warmup: int = max(self.stats_period) if warmup is None else warmup
+        # a phase of a trade is given up once it took <patience> times as long as predicted (at least one tick)
+        self.patience: float = patience
+        self.vendor_value: dict[int, int] = {} if vendor_value is None else vendor_value
+        self.state: Optional[MarketState] = None
+        self.trades: TradeBook = TradeBook()
+        self.closed: list[TradeBook] = []
+
+    def _ticks(self, start_tick: int = None, end_tick: int = None) -> Iterator[tuple[int, np.ndarray]]:
+        """yields (tick, records of the tick) in tick order"""
+
+        for records in self.store.iter_records(start_tick, end_tick):
+            ticks: np.ndarray = records["tick"]
+            starts: np.ndarray = np.flatnonzero(np.diff(ticks, prepend=ticks[0] - 1))
+            for start, stop in zip(starts.tolist(), [*starts[1:].tolist(), len(records)]):
+                yield int(ticks[start]), records[start:stop]
+
+    def _open_trades(self, flips: FlipBatch, time_now: float) -> None:
+        """opens a trade for each of the <trades_per_param> best flips of every params"""
+
+        for j in range(len(self.params)):
+            profit: np.ndarray = flips.expected_profit[:, j]
+            candidates: np.ndarray = np.flatnonzero((profit > 0) & (flips.quantity[:, j] > 0))
+            if len(candidates) > self.trades_per_param:
+                candidates = candidates[np.argpartition(profit[candidates], -self.trades_per_param)
+                                        [-self.trades_per_param:]]
+            buy_time: np.ndarray = flips.buy_time[candidates, j].astype(np.float64)
+            sell_time: np.ndarray = flips.sell_time[candidates, j].astype(np.float64)
+            self.trades.open(
+                row=flips.rows[candidates], param=np.full(len(candidates), j), opened=np.full(len(candidates), time_now),
+                buy_deadline=time_now + self.patience * np.maximum(buy_time, ApiHandler.REFRESH_TIME),
+                sell_deadline=np.full(len(candidates), np.inf),
+                buy_price=flips.buy_price[candidates, j], sell_price=flips.expected_sell_price[candidates, j],
+                quantity=flips.quantity[candidates, j], predicted_profit=profit[candidates],
+                predicted_buy_time=buy_time, predicted_sell_time=sell_time, bought_at=np.full(len(candidates), np.nan),
+                closed_at=np.full(len(candidates), np.nan))
+
+    def _fill(self, sold: np.ndarray, bought: np.ndarray, best_bid: np.ndarray, best_ask: np.ndarray,
+              time_now: float) -> None:
+        """advances every open trade by one tick. <sold>/<bought> are the amounts filled in the market per row since
+        the previous tick, <best_bid>/<best_ask> the best prices per row at the previous tick"""
+
+        trades: TradeBook = self.trades
+        buying: np.ndarray = np.flatnonzero(trades.phase == BUYING)
+        rows: np.ndarray = trades.row[buying]
+        on_top: np.ndarray = trades.buy_price[buying] >= best_bid[rows]
+        fill: np.ndarray = np.where(on_top, np.minimum(trades.quantity[buying] - trades.bought[buying], sold[rows]), 0)
+        trades.bought[buying] += fill
+        # every trade takes the whole market volume for itself, trades on the same item don't compete
+        done: np.ndarray = (trades.bought[buying] == trades.quantity[buying]) | (time_now >= trades.buy_deadline[buying])
+        done_index: np.ndarray = buying[done]
+        trades.bought_at[done_index] = time_now
+        trades.phase[done_index] = np.where(trades.bought[done_index] > 0, SELLING, CLOSED)
+        trades.closed_at[done_index[trades.bought[done_index] == 0]] = time_now
+        trades.sell_deadline[done_index] = time_now + self.patience * np.maximum(
+            trades.predicted_sell_time[done_index], ApiHandler.REFRESH_TIME)
+
+        # trades that only just started selling have been listed from this tick on, so they fill from the next one
+        selling: np.ndarray = np.setdiff1d(np.flatnonzero(trades.phase == SELLING), done_index, assume_unique=True)
+        rows = trades.row[selling]
+        on_top = trades.sell_price[selling] <= best_ask[rows]
+        fill = np.where(on_top, np.minimum(trades.bought[selling] - trades.sold[selling], bought[rows]), 0)
+        trades.sold[selling] += fill
+        trades.profit[selling] += _sell_profit(fill, trades.sell_price[selling], trades.buy_price[selling])
+        done = trades.sold[selling] == trades.bought[selling]
+        timed_out: np.ndarray = ~done & (time_now >= trades.sell_deadline[selling])
+        # whatever couldn't be sold in time is sold into the best buy order instead
+        liquidated: np.ndarray = selling[timed_out]
+        trades.profit[liquidated] += _sell_profit(trades.bought[liquidated] - trades.sold[liquidated],
+                                                  self.state.buy_price[trades.row[liquidated]],
+                                                  trades.buy_price[liquidated])
+        closing: np.ndarray = selling[done | timed_out]
+        trades.phase[closing] = CLOSED
+        trades.closed_at[closing] = time_now
+        self.closed.append(trades.compact())
+
+    def run(self, start_tick: int = None, end_tick: int = None) -> "BacktestReport":
+        """replays the ticks with start_tick <= tick < end_tick (everything by default). raises a ValueError if there
+        are none"""
+
+        ticks: Iterator[tuple[int, np.ndarray]] = self._ticks(start_tick, end_tick)
+        first: Optional[tuple[int, np.ndarray]] = next(ticks, None)
+        if first is None:
+            raise ValueError(f"no snapshots in {self.store.directory} with {start_tick} <= tick < {end_tick}")
+        first_tick, records = first
+        # the latest record of every item up to the first tick, no matter how long before <start_tick> it was. only the
+        # rows that changed are recorded after the first full snapshot, most items have no record after the start
+        self.state = state_from_snapshots(self.store.snapshot_at(first_tick), self.stats_period)
+        state: MarketState = self.state
+        state.vendor_value[:] = [self.vendor_value.get(item_id, 0) for item_id in state.ids.tolist()]
+        first_evaluation: float = first_tick + self.warmup
+        next_evaluation: float = first_evaluation
+
+        for tick, records in ticks:
+            # items that appeared after the start aren't tracked
+            rows: np.ndarray = np.fromiter((state.id_to_index.get(item_id, -1) for item_id in records["id"].tolist()),
+                                           dtype=np.int64, count=len(records))
+            records, rows = records[rows >= 0], rows[rows >= 0]
+            best_bid: np.ndarray = state.buy_price.copy()
+            best_ask: np.ndarray = state.sell_price.copy()
+            prices: np.ndarray = np.stack([records[field] for field in
+                                           ("id", "buy_quantity", "buy_price", "sell_quantity", "sell_price")], axis=1)
+            listings: tuple[np.ndarray, ...] = (records["buys"], records["buy_depth"], records["sells"],
+                                                records["sell_depth"])
+            sold_rows, bought_rows, _ = filled = state.filled_amounts(rows, *listings)
+            state.update_packed_prices(rows, prices, tick)
+            state.update_packed_listings(rows, *listings, tick, filled=filled)
+            # the snapshots only hold the items that changed, the others were refreshed without any change
+            unchanged: np.ndarray = np.setdiff1d(np.arange(len(state)), rows, assume_unique=True)
+            state.decay_prices(unchanged, tick)
+            state.decay_listings(unchanged, tick)
+
+            sold: np.ndarray = np.zeros(len(state), dtype=np.int64)
+            bought: np.ndarray = np.zeros(len(state), dtype=np.int64)
+            sold[rows], bought[rows] = sold_rows, bought_rows
+            self._fill(sold, bought, best_bid, best_ask, tick)
+            if tick >= next_evaluation:
+                self._open_trades(evaluate_flips(state, self.params), tick)
+                next_evaluation = tick + self.eval_every
+
+        # trades still open at the end of the data are left out, they never got the chance to finish
+        return BacktestReport(self.params, self.stats_period, TradeBook.concatenate(self.closed))
+
+
+class BacktestReport(object):
+    """realized vs predicted results of the closed trades of a backtest, per params"""
+
+    def __init__(self, params: list[tuple[int, float, int]], stats_period: list[int], trades: TradeBook):
+        self.params: list[tuple[int, float, int]] = params
+        self.stats_period: list[int] = stats_period
+        self.trades: TradeBook = trades
+
+    def summary(self) -> list[dict]:
+        result: list[dict] = []
+        trades: TradeBook = self.trades
+        for j, (trade_type, out_bid_p, budget) in enumerate(self.params):
+            mask: np.ndarray = trades.param == j
+            filled: np.ndarray = mask & (trades.bought > 0)
+            result.append({
+                "trade_type": trade_type,
+                "stats_period": self.stats_period[trade_type],
+                "out_bid_p": out_bid_p,
+                "budget": budget,
+                "trades": int(mask.sum()),
+                "filled_trades": int(filled.sum()),
+                "predicted_profit": int(trades.predicted_profit[mask].sum()),
+                "realized_profit": int(trades.profit[mask].sum()),
+                "fill_rate": float(trades.bought[mask].sum() / max(1, trades.quantity[mask].sum())),
+                "sell_through": float(trades.sold[filled].sum() / max(1, trades.bought[filled].sum())),
+                "predicted_buy_time": _mean(trades.predicted_buy_time[filled]),
+                "realized_buy_time": _mean((trades.bought_at - trades.opened)[filled]),
+                "predicted_sell_time": _mean(trades.predicted_sell_time[filled]),
+                "realized_sell_time": _mean((trades.closed_at - trades.bought_at)[filled])
+            })
+        return result
+
+    def __str__(self) -> str:
+        lines: list[str] = [f"{'type':>4} {'period':>6} {'out_bid_p':>9} {'budget':>9} {'trades':>6} {'filled':>6} "
+                            f"{'predicted':>12} {'realized':>12} {'fill':>5} {'sold':>5} {'buy time':>15} "
+                            f"{'sell time':>15}"]
+        for row in self.summary():
+            lines.append(f"{row['trade_type']:>4} {row['stats_period']:>6} {row['out_bid_p']:>9} {row['budget']:>9} "
+                         f"{row['trades']:>6} {row['filled_trades']:>6} {row['predicted_profit']:>12} "
+                         f"{row['realized_profit']:>12} {row['fill_rate']:>5.0%} {row['sell_through']:>5.0%} "
+                         f"{row['predicted_buy_time']:>7.0f}/{row['realized_buy_time']:<7.0f} "
+                         f"{row['predicted_sell_time']:>7.0f}/{row['realized_sell_time']:<7.0f}")
+        return "\n".join(lines)
+
+
+def _mean(values: np.ndarray) -> float:
+    return float(values.mean()) if len(values) > 0 else math.nan
+
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="backtest the flip predictions against recorded snapshots")
+    parser.add_argument("--snapshots", default="snapshots", help="directory of the TimeSeriesStore")
+    parser.add_argument("--stats-period", type=int, nargs="+", default=MarketState.STATS_PERIOD)
+    parser.add_argument("--out-bid-p", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--budget", type=int, nargs="+", default=[2_000_000])
+    parser.add_argument("--trades", type=int, default=50, help="trades opened per params and evaluation")
+    parser.add_argument("--eval-every", type=int, default=3600, help="seconds between evaluations")
+    parser.add_argument("--start", type=int, help="first tick (posix time) to replay")
+    parser.add_argument("--end", type=int, help="tick (posix time) to stop at")
+    parser.add_argument("--json", help="write the summary to this file as well")
+    args = parser.parse_args()
+
+    vendor_value: dict[int, int] = {item_id: item_json["vendor_value"]
+                                    for item_id, item_json in ItemCatalogue.load().items.items()}
+    params: list[tuple[int, float, int]] = [(i, out_bid_p, budget) for i in range(len(args.stats_period))
+                                            for out_bid_p in args.out_bid_p for budget in args.budget]
+    report: BacktestReport = Backtest(TimeSeriesStore(args.snapshots), params, args.stats_period, args.trades,
+                                      args.eval_every, vendor_value=vendor_value).run(args.start, args.end)
+    print(report)
+    if args.json is not None:
+        with open(args.json, "w") as file:
+            json.dump(report.summary(), file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
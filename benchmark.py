@@ -0,0 +1,383 @@
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Any, Optional
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import requests
+from requests.adapters import BaseAdapter
+
+from api_handler import ApiHandler
+from change_detection import DeltaRefresher
+from checkpoint import write_checkpoint, load_checkpoint
+from flip_engine import evaluate_flips
+from item import Item
+from leaderboard import FlipLeaderboard
+from market_state import MarketState
+from pipeline import RefreshPipeline
+from request_engine import RequestEngine
+from sharding import ShardPool
+
+# upper bounds for the best time of each stage in seconds. exceeding one of them with --check fails the run
+REGRESSION_THRESHOLDS: dict[str, float] = {
+    "fetch prices": 3.0,
+    "fetch listings": 6.0,
+    "pipelined tick": 10.0,
+    "update": 0.5,
+    "score": 0.2,
+    "leaderboard update": 0.05,
+    "sharded refresh": 1.0,
+    "checkpoint save": 1.0,
+    "checkpoint load": 1.0,
+    "json save": 10.0,
+    "json load": 10.0,
+}
+
+FLIP_PARAMS: list[tuple[int, float, int]] = [(i, 0.5, 2_000_000) for i in range(5)]
+
+
+class Fixtures(object):
+    """/commerce/prices and /commerce/listings payloads of every item for two consecutive ticks. either synthetic or
+    recorded from the live api with --record"""
+
+    def __init__(self, items: list[dict], ticks: list[tuple[dict[int, dict], dict[int, dict]]]):
+        self.items: list[dict] = items  # /items payloads
+        self.ticks: list[tuple[dict[int, dict], dict[int, dict]]] = ticks  # (prices by id, listings by id) per tick
+        # status codes and encoded bodies by (path, ids, tick), so serving the fixtures doesn't show up in the fetch
+        # timings
+        self._bodies: dict[tuple[str, tuple[int, ...], int], tuple[int, bytes]] = {}
+
+    @property
+    def ids(self) -> list[int]:
+        return [item["id"] for item in self.items]
+
+    @classmethod
+    def synthetic(cls, n_items: int, change_rate: float = 0.1, seed: int = 0) -> "Fixtures":
+        """random but plausible market data. ladder depths are spread like the ones of the real api, from empty up to
+        hundreds of levels for busy items"""
+
+        rng: random.Random = random.Random(seed)
+        items: list[dict] = []
+        prices: dict[int, dict] = {}
+        listings: dict[int, dict] = {}
+        for item_id in range(1, n_items + 1):
+            buy_price: int = rng.randint(1, 10_000)
+            sell_price: int = buy_price + rng.randint(1, buy_price // 2 + 1)
+            depth: int = rng.choice((0, 1, 3, 10, 30, 100, 300))
+            items.append({"id": item_id, "name": f"Item {item_id}", "vendor_value": rng.randint(0, 100), "flags": []})
+            listings[item_id] = {
+                "id": item_id,
+                "buys": [{"listings": rng.randint(1, 5), "unit_price": buy_price - k, "quantity": rng.randint(1, 250)}
+                         for k in range(min(depth, buy_price))],
+                "sells": [{"listings": rng.randint(1, 5), "unit_price": sell_price + k,
+                           "quantity": rng.randint(1, 250)} for k in range(depth)]
+            }
+            prices[item_id] = {
+                "id": item_id,
+                "whitelisted": False,
+                "buys": {"quantity": sum(level["quantity"] for level in listings[item_id]["buys"]),
+                         "unit_price": buy_price if depth > 0 else 0},
+                "sells": {"quantity": sum(level["quantity"] for level in listings[item_id]["sells"]),
+                          "unit_price": sell_price if depth > 0 else 0}
+            }
+
+        # second tick: some of the items had their best buy order filled
+        next_prices: dict[int, dict] = dict(prices)
+        next_listings: dict[int, dict] = dict(listings)
+        for item_id in rng.sample(range(1, n_items + 1), int(n_items * change_rate)):
+            if len(listings[item_id]["buys"]) == 0:
+                continue
+            next_listings[item_id] = listings[item_id] | {"buys": listings[item_id]["buys"][1:]}
+            next_prices[item_id] = prices[item_id] | {"buys": {
+                "quantity": prices[item_id]["buys"]["quantity"] - listings[item_id]["buys"][0]["quantity"],
+                "unit_price": listings[item_id]["buys"][1]["unit_price"] if len(listings[item_id]["buys"]) > 1 else 0
+            }}
+        return cls(items, [(prices, listings), (next_prices, next_listings)])
+
+    @classmethod
+    def record(cls, api: ApiHandler, n_items: int) -> "Fixtures":
+        """records two ticks of the live api, REFRESH_TIME apart"""
+
+        id_list: list[int] = sorted(set(api.get_id_list("commerce/listings")[0]) & set(api.get_id_list("items")[0]))
+        id_list = id_list[:n_items]
+        items: list[dict] = [item for item in api.get_items_by_id_list(id_list) if item is not None]
+        ticks: list[tuple[dict[int, dict], dict[int, dict]]] = []
+        for tick in range(2):
+            if tick > 0:
+                time.sleep(ApiHandler.REFRESH_TIME)
+            ticks.append(tuple({obj["id"]: obj for obj in api._bulk_request_by_id_list(api.base_url + path, id_list)
+                                if obj is not None} for path in ("commerce/prices", "commerce/listings")))
+        return cls(items, ticks)
+
+    @classmethod
+    def load(cls, path: str) -> "Fixtures":
+        with open(path, "r") as file:
+            data: dict = json.load(file)
+        return cls(data["items"], [tuple({obj["id"]: obj for obj in payloads} for payloads in tick)
+                                   for tick in data["ticks"]])
+
+    def save(self, path: str) -> None:
+        with open(path, "w") as file:
+            json.dump({"items": self.items, "ticks": [[list(prices.values()), list(listings.values())]
+                                                      for prices, listings in self.ticks]}, file)
+
+    def respond(self, path: str, ids: list[int], tick: int) -> bytes:
+        """the body the api would answer a request for <ids> on <path> with"""
+
+        return self.response(path, ids, tick)[1]
+
+    def response(self, path: str, ids: list[int], tick: int) -> tuple[int, bytes]:
+        """status code and body the api would answer a request for <ids> on <path> with: 206 if some of the ids
+        aren't in the fixtures, 404 if none of them are"""
+
+        key: tuple[str, tuple[int, ...], int] = (path, tuple(ids), tick)
+        if key not in self._bodies:
+            payloads: dict[int, dict] = self.ticks[tick][0 if path.endswith("prices") else 1]
+            objects: list[dict] = [payloads[item_id] for item_id in ids if item_id in payloads]
+            status: int = 200 if len(objects) == len(ids) else 206 if len(objects) > 0 else 404
+            # indented like the bodies of the live api, so decoding costs what it costs against the api
+            self._bodies[key] = status, json.dumps(objects if status != 404 else {"text": ApiHandler.ALL_INVALID_TEXT},
+                                                   indent=2).encode("utf-8")
+        return self._bodies[key]
+
+
+class FixtureAdapter(BaseAdapter):
+    """requests transport answering from Fixtures instead of the network"""
+
+    def __init__(self, fixtures: Fixtures):
+        super().__init__()
+        self.fixtures: Fixtures = fixtures
+        self.tick: int = 0
+
+    def send(self, request, **kwargs) -> requests.Response:
+        url = urlparse(request.url)
+        ids: list[int] = [int(item_id) for item_id in parse_qs(url.query)["ids"][0].split(",")]
+        response: requests.Response = requests.Response()
+        response.status_code, response._content = self.fixtures.response(url.path, ids, self.tick)
+        response.headers["content-type"] = "application/json"
+        response.request = request
+        response.url = request.url
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+def start_fixture_server(fixtures: Fixtures, faults: list[tuple[int, dict[str, str]]] = None) \
+        -> tuple[ThreadingHTTPServer, Callable[[int], None]]:
+    """serves <fixtures> on a local http server. returns the server and a function to switch the served tick.
+    <faults> are (status code, headers) the next requests are answered with instead, in order, e.g. a 429 with a
+    Retry-After header. the list can be appended to while the server is running"""
+
+    served_tick: list[int] = [0]
+    faults = [] if faults is None else faults
+
+    class FixtureRequestHandler(BaseHTTPRequestHandler):
+        protocol_version: str = "HTTP/1.1"
+
+        def log_message(self, *args) -> None:
+            pass
+
+        def do_GET(self) -> None:
+            if len(faults) > 0:
+                status, headers = faults.pop(0)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            url = urlparse(self.path)
+            ids: list[int] = [int(item_id) for item_id in parse_qs(url.query)["ids"][0].split(",")]
+            status, body = fixtures.response(url.path, ids, served_tick[0])
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server: ThreadingHTTPServer = ThreadingHTTPServer(("127.0.0.1", 0), FixtureRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, lambda tick: served_tick.__setitem__(0, tick)
+
+
+class StageResult(object):
+    def __init__(self, name: str, times: list[float], allocated_blocks: int, peak_memory: int):
+        self.name: str = name
+        self.best: float = min(times)
+        self.mean: float = sum(times) / len(times)
+        self.allocated_blocks: int = allocated_blocks  # blocks still allocated after the last run
+        self.peak_memory: int = peak_memory  # peak traced memory during the last run in bytes
+
+    def __str__(self) -> str:
+        threshold: Optional[float] = REGRESSION_THRESHOLDS.get(self.name)
+        return (f"{self.name:<20} best {self.best * 1000:9.1f} ms  mean {self.mean * 1000:9.1f} ms  "
+                f"peak {self.peak_memory / 2 ** 20:8.1f} MiB  blocks {self.allocated_blocks:>9}  "
+                f"{'' if threshold is None else ('OK' if self.best <= threshold else 'REGRESSION')}")
+
+
+def run_stage(name: str, function: Callable[[], Any], repeat: int, setup: Callable[[], None] = None) \
+        -> tuple[StageResult, Any]:
+    """times <function> <repeat> times (calling <setup> untimed before each run), then runs it once more under
+    tracemalloc to measure allocations and peak memory. returns the result of the last run as well"""
+
+    times: list[float] = []
+    result: Any = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        gc.collect()
+        start: float = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    gc.collect()
+    tracemalloc.start()
+    blocks_before: int = len(tracemalloc.take_snapshot().traces)
+    result = function()
+    allocated_blocks: int = len(tracemalloc.take_snapshot().traces) - blocks_before
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return StageResult(name, times, allocated_blocks, peak_memory), result
+
+
+def run_benchmark(fixtures: Fixtures, repeat: int, use_server: bool, shards: int = 1) -> list[StageResult]:
+    if use_server:
+        server, set_tick = start_fixture_server(fixtures)
+        base_url: str = f"http://127.0.0.1:{server.server_port}/"
+        session: requests.Session = requests.Session()
+    else:
+        adapter: FixtureAdapter = FixtureAdapter(fixtures)
+        set_tick = lambda tick: setattr(adapter, "tick", tick)
+        base_url = "http://fixtures/"
+        session = requests.Session()
+    # no rate limiting, we want to measure our side of things
+    engine: RequestEngine = RequestEngine(requests_per_minute=10 ** 9, session=session)
+    if not use_server:
+        session.mount(base_url, adapter)
+    api: ApiHandler = ApiHandler(base_url=base_url, engine=engine)
+    id_list: list[int] = fixtures.ids
+    results: list[StageResult] = []
+
+    set_tick(0)
+    initial_prices = api.get_item_prices_tuples_by_id_list(id_list)
+    initial_listings = api.get_item_listings_tuples_by_id_list(id_list)
+    set_tick(1)
+    api.get_item_prices_tuples_by_id_list(id_list)
+    api.get_item_listings_tuples_by_id_list(id_list)
+    result, prices_list = run_stage("fetch prices", lambda: api.get_item_prices_tuples_by_id_list(id_list), repeat)
+    results.append(result)
+    result, listings_list = run_stage("fetch listings", lambda: api.get_item_listings_tuples_by_id_list(id_list),
+                                      repeat)
+    results.append(result)
+
+    # every run of the update starts from the state of the first tick
+    state_holder: list = [None, None]
+
+    def reset_state() -> None:
+        state_holder[0] = MarketState.from_api(fixtures.items, initial_prices, initial_listings)
+        state_holder[0].prices_timestamp -= ApiHandler.REFRESH_TIME
+        state_holder[0].listings_timestamp -= ApiHandler.REFRESH_TIME
+        state_holder[1] = DeltaRefresher(state_holder[0])
+
+    def update() -> Any:
+        refresher: DeltaRefresher = state_holder[1]
+        return refresher.refresh_prices(prices_list), refresher.refresh_listings(listings_list)
+
+    def pipelined_tick() -> np.ndarray:
+        refresher: DeltaRefresher = state_holder[1]
+        return RefreshPipeline(api, refresher.refresh_prices, refresher.refresh_listings).run_tick(id_list)
+
+    # fetch and update overlapped, to be compared with the sum of the three stages above
+    result, _ = run_stage("pipelined tick", pipelined_tick, repeat, reset_state)
+    results.append(result)
+
+    result, (changed_prices, changed_listings) = run_stage("update", update, repeat, reset_state)
+    results.append(result)
+    state: MarketState = state_holder[0]
+
+    result, _ = run_stage("score", lambda: evaluate_flips(state, FLIP_PARAMS).top_k(500), repeat)
+    results.append(result)
+    leaderboard: FlipLeaderboard = FlipLeaderboard(state, FLIP_PARAMS)
+    leaderboard.ranking()
+    result, _ = run_stage("leaderboard update", lambda: (leaderboard.update(changed_prices), leaderboard.ranking()),
+                          repeat)
+    results.append(result)
+
+    if shards > 1:
+        # the shards alternate between the two ticks, so every timed refresh has the same changes to process
+        pool: ShardPool = ShardPool(state.copy(), FLIP_PARAMS, shards)
+        result, _ = run_stage("sharded refresh", lambda: pool.refresh(prices_list, listings_list), repeat,
+                              lambda: pool.refresh(initial_prices, initial_listings))
+        results.append(result)
+        pool.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_path: str = os.path.join(directory, "checkpoint.npz")
+        result, _ = run_stage("checkpoint save", lambda: write_checkpoint(state, checkpoint_path), repeat)
+        results.append(result)
+        result, _ = run_stage("checkpoint load", lambda: load_checkpoint(checkpoint_path), repeat)
+        results.append(result)
+
+        json_path: str = os.path.join(directory, "item_data.json")
+
+        def save_json() -> None:
+            with open(json_path, "w") as file:
+                json.dump([item.to_json() for item in Item.all_from_state(state)], file)
+
+        def load_json() -> MarketState:
+            with open(json_path, "r") as file:
+                return MarketState.from_json_list(json.load(file))
+
+        result, _ = run_stage("json save", save_json, repeat)
+        results.append(result)
+        result, _ = run_stage("json load", load_json, repeat)
+        results.append(result)
+
+    engine.close()
+    return results
+
+
+def main():
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="offline benchmark of the refresh and scoring pipeline")
+    parser.add_argument("--items", type=int, default=27_000, help="number of items (synthetic fixtures only)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs per stage")
+    parser.add_argument("--fixtures", help="json file with recorded fixtures to replay instead of synthetic ones")
+    parser.add_argument("--record", help="record two ticks of the live api into this file and exit")
+    parser.add_argument("--server", action="store_true",
+                        help="serve the fixtures from a local http server instead of an injected transport")
+    parser.add_argument("--shards", type=int, default=1, help="also time the refresh on this many worker processes")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if a stage exceeds its threshold")
+    args = parser.parse_args()
+
+    if args.record is not None:
+        Fixtures.record(ApiHandler(), args.items).save(args.record)
+        return
+
+    fixtures: Fixtures = Fixtures.synthetic(args.items) if args.fixtures is None else Fixtures.load(args.fixtures)
+    print(f"benchmarking {len(fixtures.items)} items, best of {args.repeat}")
+    results: list[StageResult] = run_benchmark(fixtures, args.repeat, args.server, args.shards)
+    for result in results:
+        print(result)
+
+    regressions: list[str] = [result.name for result in results
+                              if result.best > REGRESSION_THRESHOLDS.get(result.name, float("inf"))]
+    if args.check and len(regressions) > 0:
+        print(f"regressions in: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import json
+import os
+from typing import Optional
+
+from api_handler import ApiHandler, ItemJson
+
+
+class ItemCatalogue(object):
+    """persistent cache of the metadata (id, name, vendor_value, flags) of every item that can be traded on the trading
+    post. the id lists of /items and /commerce/listings are revalidated with the ETag/Last-Modified headers of the
+    previous response, so an unchanged catalogue costs two requests answered with 304, and only the metadata of ids
+    that weren't seen before is requested"""
+
+    ID_LIST_ENDPOINTS: tuple[str, ...] = ("items", "commerce/listings")
+
+    def __init__(self, path: str = "item_catalogue.json"):
+        self.path: str = path
+        self.items: dict[int, ItemJson] = {}
+        self.id_lists: dict[str, list[int]] = {endpoint: [] for endpoint in self.ID_LIST_ENDPOINTS}
+        self.validators: dict[str, dict[str, str]] = {endpoint: {} for endpoint in self.ID_LIST_ENDPOINTS}
+
+    @classmethod
+    def load(cls, path: str = "item_catalogue.json") -> "ItemCatalogue":
+        """loads the catalogue stored at <path>, or creates an empty one if there is none yet"""
+
+        catalogue: ItemCatalogue = cls(path)
+        if not os.path.exists(path):
+            return catalogue
+        with open(path, "r") as file:
+            data: dict = json.load(file)
+        catalogue.items = {item_json["id"]: item_json for item_json in data["items"]}
+        catalogue.id_lists = data["id_lists"]
+        catalogue.validators = data["validators"]
+        return catalogue
+
+    def save(self) -> None:
+        temp_path: str = self.path + ".tmp"
+        with open(temp_path, "w") as file:
+            json.dump({
+                "items": list(self.items.values()),
+                "id_lists": self.id_lists,
+                "validators": self.validators
+            }, file)
+        os.replace(temp_path, self.path)
+
+    def tradeable_ids(self) -> list[int]:
+        """ids of all items that have both metadata and a trading post listing, sorted"""
+
+        return sorted(set(self.id_lists["commerce/listings"]) & set(self.id_lists["items"]))
+
+    def refresh(self, api: ApiHandler) -> list[int]:
+        """revalidates the id lists, fetches the metadata of new ids and saves the catalogue if anything changed.
+        returns the ids that were added"""
+
+        changed: bool = False
+        for endpoint in self.ID_LIST_ENDPOINTS:
+            id_list: Optional[list[int]]
+            id_list, self.validators[endpoint] = api.get_id_list(endpoint, self.validators[endpoint])
+            if id_list is not None:
+                self.id_lists[endpoint] = id_list
+                changed = True
+        # whatever is listed (again) is worth requesting, even if the api reported it as invalid before
+        api.forget_invalid_ids(self.id_lists["commerce/listings"])
+
+        new_ids: list[int] = [item_id for item_id in self.tradeable_ids() if item_id not in self.items]
+        if len(new_ids) > 0:
+            print(f"fetching metadata of {len(new_ids)} new items")
+            for item_json in api.get_items_by_id_list(new_ids):
+                if item_json is not None:
+                    self.items[item_json["id"]] = item_json
+                    changed = True
+
+        if changed:
+            self.save()
+        return new_ids
+
+    def get(self, id_list: list[int]) -> list[Optional[ItemJson]]:
+        """metadata of the items in <id_list>, None for the ones not in the catalogue"""
+
+        return [self.items.get(item_id) for item_id in id_list]
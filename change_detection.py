@@ -0,0 +1,110 @@
+import time
+from typing import Optional
+
+import numpy as np
+
+from market_state import MarketState
+from payload_decoder import ItemPricesTuple, ItemListingsTuple
+
+
+def payload_key(payload: tuple) -> int:
+    """hash over a compact prices or listings payload. both are nested tuples of ints, so hashing them happens
+    entirely in c"""
+
+    return hash(payload)
+
+
+class RefreshMetrics(object):
+    """counts of how many items actually changed in the latest refresh and in total"""
+
+    def __init__(self):
+        self.ticks: int = 0
+        self.prices_received: int = 0  # in the latest tick
+        self.prices_changed: int = 0  # in the latest tick
+        self.listings_received: int = 0  # in the latest tick
+        self.listings_changed: int = 0  # in the latest tick
+        self.total_received: int = 0
+        self.total_changed: int = 0
+
+    def new_tick(self) -> None:
+        """starts the counts of a new tick. a tick can be recorded in several batches"""
+
+        self.ticks += 1
+        self.prices_received = self.prices_changed = self.listings_received = self.listings_changed = 0
+
+    def record(self, received: int, changed: int, listings: bool) -> None:
+        if listings:
+            self.listings_received += received
+            self.listings_changed += changed
+        else:
+            self.prices_received += received
+            self.prices_changed += changed
+        self.total_received += received
+        self.total_changed += changed
+
+    def __str__(self) -> str:
+        return (f"prices changed: {self.prices_changed}/{self.prices_received}, "
+                f"listings changed: {self.listings_changed}/{self.listings_received}, "
+                f"overall change rate: {self.total_changed / max(1, self.total_received):.1%}")
+
+
+class DeltaRefresher(object):
+    """change detection stage between ApiHandler and MarketState. remembers a hash of the last prices and listings
+    payload of every row and only passes payloads that actually changed on to the full update of the MarketState. the
+    rows with unchanged payloads take the closed-form decay of their weighted stats instead, which leads to the exact
+    same result without walking the ladders"""
+
+    def __init__(self, state: MarketState):
+        self.state: MarketState = state
+        self.metrics: RefreshMetrics = RefreshMetrics()
+        self.prices_keys: np.ndarray = np.fromiter(map(payload_key, state.prices_list()), dtype=np.int64,
+                                                   count=len(state))
+        self.listings_keys: np.ndarray = np.fromiter(map(payload_key, state.listings_list()), dtype=np.int64,
+                                                     count=len(state))
+
+    def resync(self, rows: np.ndarray) -> None:
+        """recomputes the stored keys of <rows> from the state, after the state was changed other than through this
+        refresher"""
+
+        self.prices_keys[rows] = np.fromiter(map(payload_key, self.state.prices_list(rows)), dtype=np.int64,
+                                             count=len(rows))
+        self.listings_keys[rows] = np.fromiter(map(payload_key, self.state.listings_list(rows)), dtype=np.int64,
+                                               count=len(rows))
+
+    def begin_tick(self) -> None:
+        """to be called before the first refresh of every tick, the refreshes of a tick may come in several batches"""
+
+        self.metrics.new_tick()
+
+    def _split(self, payload_list: list[Optional[tuple]], keys: np.ndarray) -> tuple[list[tuple], np.ndarray]:
+        """splits <payload_list> into the payloads that changed and the rows of the ones that didn't. the stored keys
+        of the changed rows are updated as well"""
+
+        present: list[tuple] = [data for data in payload_list if data is not None]
+        rows: np.ndarray = np.fromiter((self.state.id_to_index[data.id] for data in present), dtype=np.int64,
+                                       count=len(present))
+        new_keys: np.ndarray = np.fromiter(map(payload_key, present), dtype=np.int64, count=len(present))
+        changed: np.ndarray = new_keys != keys[rows]
+        keys[rows[changed]] = new_keys[changed]
+        return [data for data, is_changed in zip(present, changed.tolist()) if is_changed], rows[~changed]
+
+    def refresh_prices(self, prices_list: list[Optional[ItemPricesTuple]], time_now: float = None) -> np.ndarray:
+        """see MarketState.update_prices. returns the indexes of the rows whose prices changed"""
+
+        time_now = time.time() if time_now is None else time_now
+        changed_list, unchanged_rows = self._split(prices_list, self.prices_keys)
+        changed_rows: np.ndarray = self.state.update_prices(changed_list, time_now)
+        self.state.decay_prices(unchanged_rows, time_now)
+        self.metrics.record(len(changed_list) + len(unchanged_rows), len(changed_list), listings=False)
+        return changed_rows
+
+    def refresh_listings(self, listings_list: list[Optional[ItemListingsTuple]],
+                         time_now: float = None) -> np.ndarray:
+        """see MarketState.update_listings. returns the indexes of the rows whose listings changed"""
+
+        time_now = time.time() if time_now is None else time_now
+        changed_list, unchanged_rows = self._split(listings_list, self.listings_keys)
+        changed_rows: np.ndarray = self.state.update_listings(changed_list, time_now)
+        self.state.decay_listings(unchanged_rows, time_now)
+        self.metrics.record(len(changed_list) + len(unchanged_rows), len(changed_list), listings=True)
+        return changed_rows
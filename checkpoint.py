@@ -0,0 +1,93 @@
+import os
+from concurrent.futures import Future
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+
+from db import pack_snapshots, state_from_snapshots
+from market_state import MarketState
+
+
+def write_checkpoint(state: MarketState, path: str) -> None:
+    """writes <state> to <path> as an uncompressed .npz archive. the archive is written to a temporary file first and
+    then renamed over <path>, so a crash while writing can never leave a broken checkpoint behind. the directory is
+    synced after the rename, so the new checkpoint survives a crash right after it as well"""
+
+    # prices and listings are stored as snapshot records, everything else as the arrays of the state
+    arrays: dict[str, np.ndarray] = {
+        "records": pack_snapshots(state, np.arange(len(state)), 0),
+        "stats_period": state.stats_period,
+        "names": np.array(state.names, dtype=str),
+        "vendor_value": state.vendor_value,
+        "bid_size": state.bid_size,
+        "offer_size": state.offer_size,
+        "prices_timestamp": state.prices_timestamp,
+        "listings_timestamp": state.listings_timestamp,
+        "last_sold": state.last_sold,
+        "last_bought": state.last_bought
+    } | {field: getattr(state, field) for field in MarketState.STATS_FIELDS}
+
+    temp_path: str = path + ".tmp"
+    with open(temp_path, "wb") as file:
+        np.savez(file, **arrays)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    directory: int = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def load_checkpoint(path: str) -> MarketState:
+    """restores a MarketState written by <write_checkpoint>"""
+
+    with np.load(path) as archive:
+        records: np.ndarray = archive["records"]
+        state: MarketState = state_from_snapshots(records, archive["stats_period"])
+        state.names = archive["names"].tolist()
+        for name in ("vendor_value", "bid_size", "offer_size", "prices_timestamp", "listings_timestamp",
+                     *MarketState.STATS_FIELDS):
+            getattr(state, name)[:] = archive[name]
+        # checkpoints written before the latest filled amounts were saved restore them as zero
+        for name in ("last_sold", "last_bought"):
+            if name in archive.files:
+                getattr(state, name)[:] = archive[name]
+    return state
+
+
+class Checkpointer(object):
+    """writes checkpoints of a MarketState in the background. <save_async> only takes a copy of the state in the
+    calling thread, packing and writing it happens on a dedicated thread so the refresh loop doesn't have to wait for
+    the disk. if the previous checkpoint is still being written, the new one is skipped instead of piling up"""
+
+    def __init__(self, path: str = "state_checkpoint.npz"):
+        self.path: str = path
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="checkpoint")
+        self.pending: Optional[Future] = None
+
+    def save_async(self, state: MarketState) -> bool:
+        """starts writing a checkpoint of <state>. returns False if it was skipped because the previous one isn't
+        done yet"""
+
+        if self.pending is not None and not self.pending.done():
+            return False
+        self.pending = self.executor.submit(write_checkpoint, state.copy(), self.path)
+        return True
+
+    def save(self, state: MarketState) -> None:
+        """writes a checkpoint of <state> and waits for it to be written"""
+
+        self.wait()
+        write_checkpoint(state, self.path)
+
+    def wait(self) -> None:
+        """waits for the pending checkpoint to be written, raising any exception that happened while writing it"""
+
+        if self.pending is not None:
+            self.pending.result()
+
+    def load(self) -> MarketState:
+        return load_checkpoint(self.path)
@@ -1,8 +1,16 @@
-import json
-from typing import List
+import datetime
+import os
+from typing import Iterator, Optional
+
+import numpy as np
+
+from market_state import MarketState, unpack_ladders
+from payload_decoder import ItemPricesTuple, ItemListingsTuple
 
 
 class Jsonizable(object):
+    __slots__: tuple[str, ...] = ()  # so that slotted subclasses don't get a __dict__ after all
+
     def to_json(self) -> dict:
         raise NotImplementedError(f"Cannot serialize {self}, method 'to_json' is not defined")
 
@@ -10,3 +18,153 @@ class Jsonizable(object):
     def from_json(cls, *args, **kwargs):
         raise NotImplementedError(f"Cannot serialize {cls}, @classmethod 'from_json' is not defined")
 
+
+LADDER_DEPTH: int = MarketState.LADDER_DEPTH
+
+# fixed-width record of a single item at a single tick. ladders are stored as (unit_price, quantity, listings) triples,
+# padded with zeros behind the first <buy_depth>/<sell_depth> levels
+SNAPSHOT_DTYPE: np.dtype = np.dtype([
+    ("tick", "<i8"),  # posix time of the refresh the record belongs to
+    ("id", "<i4"),
+    ("buy_price", "<i4"),
+    ("buy_quantity", "<i4"),
+    ("sell_price", "<i4"),
+    ("sell_quantity", "<i4"),
+    ("buy_depth", "<i2"),
+    ("sell_depth", "<i2"),
+    ("buys", "<i4", (LADDER_DEPTH, 3)),  # descending by unit_price
+    ("sells", "<i4", (LADDER_DEPTH, 3)),  # ascending by unit_price
+])
+
+
+def pack_snapshots(state: MarketState, rows: np.ndarray, tick: int) -> np.ndarray:
+    """packs the latest prices and listings of <rows> of <state> into an array of SNAPSHOT_DTYPE records"""
+
+    records: np.ndarray = np.zeros(len(rows), dtype=SNAPSHOT_DTYPE)
+    records["tick"] = tick
+    records["id"] = state.ids[rows]
+    records["buy_price"] = state.buy_price[rows]
+    records["buy_quantity"] = state.demand[rows]
+    records["sell_price"] = state.sell_price[rows]
+    records["sell_quantity"] = state.supply[rows]
+    records["buy_depth"] = state.buy_depth[rows]
+    records["sell_depth"] = state.sell_depth[rows]
+    records["buys"] = state.buy_ladder[rows]
+    records["sells"] = state.sell_ladder[rows]
+    return records
+
+
+def unpack_snapshots(records: np.ndarray) -> tuple[list[ItemPricesTuple], list[ItemListingsTuple]]:
+    """inverse of <pack_snapshots>, rebuilds the api data of every record"""
+
+    prices_list: list[ItemPricesTuple] = list(map(ItemPricesTuple._make, zip(
+        *(records[field].tolist() for field in ("id", "buy_quantity", "buy_price", "sell_quantity", "sell_price")))))
+    listings_list: list[ItemListingsTuple] = list(map(ItemListingsTuple._make, zip(
+        records["id"].tolist(),
+        unpack_ladders(records["buys"], records["buy_depth"]),
+        unpack_ladders(records["sells"], records["sell_depth"]))))
+    return prices_list, listings_list
+
+
+def state_from_snapshots(records: np.ndarray, stats_period: list[int] = None) -> MarketState:
+    """creates a MarketState with the prices and listings of <records>, one row per record. all stats start at zero
+    and the data of each row counts as received at the tick of its record"""
+
+    state: MarketState = MarketState(records["id"], stats_period)
+    state.buy_price[:] = records["buy_price"]
+    state.sell_price[:] = records["sell_price"]
+    state.demand[:] = records["buy_quantity"]
+    state.supply[:] = records["sell_quantity"]
+    state.buy_ladder[:] = records["buys"]
+    state.sell_ladder[:] = records["sells"]
+    state.buy_depth[:] = records["buy_depth"]
+    state.sell_depth[:] = records["sell_depth"]
+    state.prices_timestamp[:] = records["tick"]
+    state.listings_timestamp[:] = records["tick"]
+    return state
+
+
+class TimeSeriesStore(object):
+    """append-only on-disk store for price and listings snapshots. records are SNAPSHOT_DTYPE and are written to one
+    segment file per (utc) day, in the order of their ticks. segments are read back as memory-mapped record arrays, so
+    weeks of snapshots can be scanned without loading them into memory first.
+    only the items that changed in a tick have to be appended, the state of an item at any tick is its latest record at
+    or before that tick (see <snapshot_at>)"""
+
+    MAGIC: bytes = b"GW2SNAP1"
+    HEADER_SIZE: int = 16  # magic + record size as little endian int64
+
+    def __init__(self, directory: str):
+        self.directory: str = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _segment_path(self, day: datetime.date) -> str:
+        return os.path.join(self.directory, f"{day.isoformat()}.bin")
+
+    def segments(self) -> list[str]:
+        """paths of all segment files, oldest first"""
+
+        return [os.path.join(self.directory, name) for name in sorted(os.listdir(self.directory))
+                if name.endswith(".bin")]
+
+    def append(self, records: np.ndarray) -> None:
+        """appends <records> to the segment of their tick. all records of a single call have to belong to the same
+        tick"""
+
+        if len(records) == 0:
+            return
+        day: datetime.date = datetime.datetime.fromtimestamp(int(records["tick"][0]), datetime.timezone.utc).date()
+        path: str = self._segment_path(day)
+        with open(path, "ab") as file:
+            if file.tell() == 0:
+                file.write(self.MAGIC + np.int64(SNAPSHOT_DTYPE.itemsize).tobytes())
+            file.write(np.ascontiguousarray(records, dtype=SNAPSHOT_DTYPE).tobytes())
+
+    def append_state(self, state: MarketState, rows: Optional[np.ndarray] = None, tick: int = None) -> None:
+        """appends the current data of <rows> (all rows if not provided) of <state>"""
+
+        rows = np.arange(len(state)) if rows is None else rows
+        tick = int(datetime.datetime.now().timestamp()) if tick is None else tick
+        self.append(pack_snapshots(state, rows, tick))
+
+    def read_segment(self, path: str) -> np.ndarray:
+        """memory-maps a segment file as a read-only array of SNAPSHOT_DTYPE records"""
+
+        with open(path, "rb") as file:
+            header: bytes = file.read(self.HEADER_SIZE)
+        assert header[:8] == self.MAGIC, f"{path} is not a snapshot segment"
+        assert np.frombuffer(header[8:], dtype="<i8")[0] == SNAPSHOT_DTYPE.itemsize, \
+            f"{path} was written with a different record layout"
+        record_count: int = (os.path.getsize(path) - self.HEADER_SIZE) // SNAPSHOT_DTYPE.itemsize
+        if record_count == 0:
+            return np.zeros(0, dtype=SNAPSHOT_DTYPE)
+        return np.memmap(path, dtype=SNAPSHOT_DTYPE, mode="r", offset=self.HEADER_SIZE, shape=(record_count,))
+
+    def iter_records(self, start_tick: int = None, end_tick: int = None) -> Iterator[np.ndarray]:
+        """yields memory-mapped slices of the records with start_tick <= tick < end_tick, segment by segment"""
+
+        for path in self.segments():
+            records: np.ndarray = self.read_segment(path)
+            if len(records) == 0:
+                continue
+            # records are appended in tick order, so the tick column is sorted within a segment
+            ticks: np.ndarray = records["tick"]
+            start: int = 0 if start_tick is None else int(np.searchsorted(ticks, start_tick, side="left"))
+            end: int = len(records) if end_tick is None else int(np.searchsorted(ticks, end_tick, side="left"))
+            if start < end:
+                yield records[start:end]
+
+    def records(self, start_tick: int = None, end_tick: int = None) -> np.ndarray:
+        """all records with start_tick <= tick < end_tick in a single (in memory) array"""
+
+        return np.concatenate([np.zeros(0, dtype=SNAPSHOT_DTYPE), *self.iter_records(start_tick, end_tick)])
+
+    def snapshot_at(self, tick: int, start_tick: int = None) -> np.ndarray:
+        """the latest record at or before <tick> of every item that has one (after <start_tick> if provided), sorted
+        by item id"""
+
+        records: np.ndarray = self.records(start_tick, tick + 1)
+        # the last occurrence of every id is its latest record
+        reversed_ids: np.ndarray = records["id"][::-1]
+        _, last_index = np.unique(reversed_ids, return_index=True)
+        return records[len(records) - 1 - last_index]
@@ -0,0 +1,123 @@
+from typing import Optional
+
+import numpy as np
+
+from api_handler import ApiHandler
+from item import Flip, SharedTradingStats
+from market_state import MarketState
+
+
+class FlipBatch(object):
+    """the flips calculated for a set of rows of a MarketState and a grid of (trade_type, out_bid_p, budget) params.
+    every field is an array of shape (n_rows, n_params) and has the same meaning as the attribute of the same name in
+    Flip"""
+
+    FIELDS: tuple[str, ...] = ("target_trade_duration", "quantity", "buy_price", "expected_sell_price",
+                               "expected_profit", "expected_pph", "buy_time", "sell_time")
+
+    def __init__(self, ids: np.ndarray, rows: np.ndarray, params: list[tuple[int, float, int]], **fields: np.ndarray):
+        self.ids: np.ndarray = ids  # api id of the item of each row
+        self.rows: np.ndarray = rows  # row in the MarketState of each row
+        self.params: list[tuple[int, float, int]] = params
+        self.target_trade_duration: np.ndarray = fields["target_trade_duration"]
+        self.quantity: np.ndarray = fields["quantity"]
+        self.buy_price: np.ndarray = fields["buy_price"]
+        self.expected_sell_price: np.ndarray = fields["expected_sell_price"]
+        self.expected_profit: np.ndarray = fields["expected_profit"]
+        self.expected_pph: np.ndarray = fields["expected_pph"]
+        self.buy_time: np.ndarray = fields["buy_time"]
+        self.sell_time: np.ndarray = fields["sell_time"]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def flip(self, i: int, j: int) -> Flip:
+        """the Flip of the i-th row for the j-th params"""
+
+        return Flip(int(self.ids[i]), int(self.target_trade_duration[i, j]), int(self.quantity[i, j]),
+                    int(self.buy_price[i, j]), int(self.expected_sell_price[i, j]), int(self.expected_profit[i, j]),
+                    int(self.buy_time[i, j]), int(self.sell_time[i, j]))
+
+    def flips(self, i: int) -> tuple[Flip]:
+        """the Flips of the i-th row for every params, same as Item.get_flips"""
+
+        return tuple(self.flip(i, j) for j in range(len(self.params)))
+
+    def best(self, key: str = "expected_profit") -> tuple[np.ndarray, np.ndarray]:
+        """returns the index of the best params for each row according to <key> and the respective values"""
+
+        values: np.ndarray = getattr(self, key)
+        best_params: np.ndarray = np.argmax(values, axis=1)
+        return best_params, values[np.arange(len(values)), best_params]
+
+    def top_k(self, k: int, key: str = "expected_profit", per_item: bool = True) -> tuple[np.ndarray, np.ndarray]:
+        """returns (rows, params) index arrays of the <k> best flips according to <key>, best first. if <per_item> is
+        set only the best flip of each item is considered. uses a partial selection, so only the k selected flips are
+        actually sorted"""
+
+        if per_item:
+            best_params, values = self.best(key)
+        else:
+            values = getattr(self, key).ravel()
+        k = min(k, len(values))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        selected: np.ndarray = np.argpartition(values, len(values) - k)[len(values) - k:]
+        selected = selected[np.argsort(values[selected], kind="stable")[::-1]]
+        if per_item:
+            return selected, best_params[selected]
+        return np.unravel_index(selected, getattr(self, key).shape)
+
+
+def evaluate_flips(state: MarketState, params: list[tuple[int, float, int]],
+                   rows: Optional[np.ndarray] = None) -> FlipBatch:
+    """vectorized equivalent of calling Item._get_flip with every element of <params> for every item in <rows> (all
+    items of <state> if not provided)"""
+
+    rows = np.arange(len(state)) if rows is None else np.asarray(rows, dtype=np.int64)
+    trade_type: np.ndarray = np.array([param[0] for param in params], dtype=np.int64)
+    out_bid_p: np.ndarray = np.array([param[1] for param in params], dtype=np.float64)[None, :]
+    budget: np.ndarray = np.array([param[2] for param in params], dtype=np.float64)[None, :]
+
+    # per item stats as (n_rows, 1) columns, per period stats as (n_rows, n_params) with one column per params
+    min_price: np.ndarray = np.ceil(state.vendor_value[rows] / 0.85)[:, None]
+    buy_price: np.ndarray = state.buy_price[rows][:, None]
+    sell_price: np.ndarray = state.sell_price[rows][:, None]
+    buy_price_delta: np.ndarray = state.buy_price_delta[rows][:, trade_type]
+    sell_price_delta: np.ndarray = state.sell_price_delta[rows][:, trade_type]
+    buys: np.ndarray = state.buys[rows][:, trade_type]
+    sells: np.ndarray = state.sells[rows][:, trade_type]
+    target_trade_duration: np.ndarray = np.trunc(state.stats_period[trade_type] / (3 * ApiHandler.REFRESH_TIME))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        time_until_outbid_p_reached: np.ndarray = np.where(buy_price_delta <= 0, target_trade_duration,
+                                                           out_bid_p / buy_price_delta)
+        time_until_undercut_p_reached: np.ndarray = np.where(sell_price_delta >= 0, target_trade_duration,
+                                                             out_bid_p / -sell_price_delta)
+        buy_time: np.ndarray = np.minimum(time_until_outbid_p_reached,
+                                          np.where(sells == 0, 0, target_trade_duration * sells / (buys + sells)))
+    sell_time: np.ndarray = np.minimum(time_until_undercut_p_reached, target_trade_duration - buy_time)
+    expected_sell_change: np.ndarray = sell_price_delta * buy_time
+    buys_fillable: np.ndarray = buys * buy_time
+    sells_fillable: np.ndarray = sells * sell_time
+    price_to_buy_at: np.ndarray = np.broadcast_to(np.maximum(min_price, buy_price + 1), buy_time.shape)
+    expected_sell_price: np.ndarray = np.maximum(min_price, sell_price + np.round(expected_sell_change) - 1)
+    amount_to_buy: np.ndarray = np.minimum(
+        np.trunc(np.minimum(np.minimum(buys_fillable, sells_fillable), SharedTradingStats.MAX_LISTINGS * 250)),
+        np.trunc(budget / (price_to_buy_at + 0.05 * expected_sell_price)))
+    expected_profit: np.ndarray = amount_to_buy * np.trunc(expected_sell_price * 0.85 - price_to_buy_at)
+
+    trade_duration: np.ndarray = np.round((buy_time + sell_time) * ApiHandler.REFRESH_TIME)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected_pph: np.ndarray = np.where(trade_duration == 0, 0,
+                                            np.round(expected_profit * 3600 / trade_duration))
+
+    return FlipBatch(state.ids[rows], rows, params,
+                     target_trade_duration=trade_duration.astype(np.int64),
+                     quantity=amount_to_buy.astype(np.int64),
+                     buy_price=price_to_buy_at.astype(np.int64),
+                     expected_sell_price=expected_sell_price.astype(np.int64),
+                     expected_profit=expected_profit.astype(np.int64),
+                     expected_pph=expected_pph.astype(np.int64),
+                     buy_time=np.round(buy_time * ApiHandler.REFRESH_TIME).astype(np.int64),
+                     sell_time=np.round(sell_time * ApiHandler.REFRESH_TIME).astype(np.int64))
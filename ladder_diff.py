@@ -0,0 +1,78 @@
+from typing import NamedTuple
+
+import numpy as np
+
+BUYS: int = 1  # buy order ladders are sorted by descending unit_price
+SELLS: int = -1  # sell listing ladders by ascending unit_price
+
+
+class LadderDiff(NamedTuple):
+    """the quantity that disappeared between two refreshes of a batch of ladders, one element per ladder"""
+
+    removed: np.ndarray  # everything the merge walk sees as gone, fills as well as cancels
+    filled: np.ndarray  # the part of <removed> that is most likely filled orders
+    cancelled: np.ndarray  # the rest, most likely cancelled or relisted orders
+
+
+def diff_ladders(old_ladders: np.ndarray, old_depths: np.ndarray, new_ladders: np.ndarray, new_depths: np.ndarray,
+                 side: int) -> LadderDiff:
+    """compares packed old and new ladders (see market_state.pack_ladders) of the same side, <side> being BUYS or
+    SELLS, all of them in one vectorized pass.
+
+    <removed> is exactly what the classic two-pointer merge walk over the two ladders adds up: walking both ladders
+    from their best price on, every old level that is gone counts with its whole quantity and every old level that is
+    still there with the amount its quantity dropped by. the walk stops at the first level that didn't change at all,
+    and at the end of the new ladder.
+    trades always take the best price first, so only the levels up to and including the first one that survived can
+    have been filled. whatever disappeared behind a surviving level must have been cancelled. if the levels that
+    vanished from the top of the ladder reappear at a better price with the same quantity and number of listings, they
+    were relisted rather than filled, so they count as cancelled as well"""
+
+    n, depth, _ = old_ladders.shape
+    level_index: np.ndarray = np.arange(depth)
+    old_used: np.ndarray = level_index[None, :] < old_depths[:, None]
+    new_used: np.ndarray = level_index[None, :] < new_depths[:, None]
+    # sort keys in which both sides are descending, i.e. the walk goes from the highest key to the lowest
+    old_key: np.ndarray = side * old_ladders[..., 0].astype(np.int64)
+    new_key: np.ndarray = side * new_ladders[..., 0].astype(np.int64)
+    old_quantity: np.ndarray = old_ladders[..., 1].astype(np.int64)
+    old_listings: np.ndarray = old_ladders[..., 2].astype(np.int64)
+
+    # level j of the old ladder is still there if the new ladder has a level at the same price, prices are unique
+    # within a ladder so there is at most one
+    same: np.ndarray = (old_key[:, :, None] == new_key[:, None, :]) & old_used[:, :, None] & new_used[:, None, :]
+    matched: np.ndarray = same.any(axis=2)
+    match_index: np.ndarray = same.argmax(axis=2)
+    new_quantity: np.ndarray = np.take_along_axis(new_ladders[..., 1], match_index, axis=1).astype(np.int64)
+    new_listings: np.ndarray = np.take_along_axis(new_ladders[..., 2], match_index, axis=1).astype(np.int64)
+
+    # the walk stops at the first unchanged level and can't get past the lowest key of the new ladder
+    unchanged: np.ndarray = matched & (new_quantity == old_quantity) & (new_listings == old_listings)
+    stop: np.ndarray = np.where(unchanged.any(axis=1), unchanged.argmax(axis=1), depth)
+    lowest_new_key: np.ndarray = np.where(new_depths > 0,
+                                          new_key[np.arange(n), np.maximum(new_depths.astype(np.int64) - 1, 0)],
+                                          np.iinfo(np.int64).max)
+    reached: np.ndarray = old_used & (level_index[None, :] < stop[:, None]) & (old_key >= lowest_new_key[:, None])
+    removed_per_level: np.ndarray = np.where(reached, np.where(matched, np.maximum(0, old_quantity - new_quantity),
+                                                               old_quantity), 0)
+    removed: np.ndarray = removed_per_level.sum(axis=1)
+
+    # levels up to the first surviving one can have been filled, the ones behind it can't
+    survived: np.ndarray = reached & matched
+    first_survivor: np.ndarray = np.where(survived.any(axis=1), survived.argmax(axis=1), depth)
+    fillable: np.ndarray = level_index[None, :] <= first_survivor[:, None]
+    filled: np.ndarray = np.where(fillable, removed_per_level, 0).sum(axis=1)
+
+    # relists: the levels that vanished from the top come back at a better price, same quantity and listings
+    vanished: np.ndarray = reached & (level_index[None, :] < first_survivor[:, None])
+    vanished_quantity: np.ndarray = np.where(vanished, old_quantity, 0).sum(axis=1)
+    vanished_listings: np.ndarray = np.where(vanished, old_listings, 0).sum(axis=1)
+    old_best_key: np.ndarray = np.where(old_depths > 0, old_key[:, 0], np.iinfo(np.int64).max)
+    ahead: np.ndarray = new_used & (new_key > old_best_key[:, None])
+    ahead_quantity: np.ndarray = np.where(ahead, new_ladders[..., 1], 0).sum(axis=1, dtype=np.int64)
+    ahead_listings: np.ndarray = np.where(ahead, new_ladders[..., 2], 0).sum(axis=1, dtype=np.int64)
+    relisted: np.ndarray = (vanished_quantity > 0) & (vanished_quantity == ahead_quantity) \
+        & (vanished_listings == ahead_listings)
+    filled = np.where(relisted, filled - vanished_quantity, filled)
+
+    return LadderDiff(removed, filled, removed - filled)
@@ -0,0 +1,73 @@
+from typing import Optional
+
+import numpy as np
+
+from flip_engine import FlipBatch, evaluate_flips
+from item import Flip
+from market_state import MarketState
+
+
+class FlipLeaderboard(object):
+    """in-memory ranking of the best flip of every item of a MarketState. keeps the flips of every item for every
+    params, but only re-scores the items passed to <update>, i.e. the ones whose prices or listings changed in the
+    latest refresh. the weighted stats of unchanged items only decay between refreshes, so their flips drift slowly and
+    are brought up to date by the occasional full <rescore>.
+    the top-k ranking for each key is cached and only recalculated if an update could actually have changed it"""
+
+    RANKING_KEYS: tuple[str, ...] = ("expected_profit", "expected_pph")
+
+    def __init__(self, state: MarketState, params: list[tuple[int, float, int]], k: int = 500):
+        self.state: MarketState = state
+        self.params: list[tuple[int, float, int]] = params
+        self.k: int = k
+        self.flip_batch: FlipBatch = evaluate_flips(state, params)
+        self._rankings: dict[str, Optional[tuple[np.ndarray, np.ndarray]]] = {key: None for key in self.RANKING_KEYS}
+
+    def rescore(self, rows: Optional[np.ndarray] = None) -> None:
+        """re-scores the items in <rows>, or all items if not provided"""
+
+        if rows is None:
+            self.flip_batch = evaluate_flips(self.state, self.params)
+            self._rankings = {key: None for key in self.RANKING_KEYS}
+            return
+
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        if len(rows) == 0:
+            return
+        rescored: FlipBatch = evaluate_flips(self.state, self.params, rows)
+        for field in FlipBatch.FIELDS:
+            getattr(self.flip_batch, field)[rows] = getattr(rescored, field)
+
+        for key, ranking in self._rankings.items():
+            if ranking is None:
+                continue
+            # the cached ranking stays valid if none of the ranked items changed and none of the re-scored items made
+            # it past the last ranked one
+            ranked_rows, ranked_params = ranking
+            values: np.ndarray = getattr(self.flip_batch, key)
+            threshold: float = values[ranked_rows[-1], ranked_params[-1]] if len(ranked_rows) == self.k else -np.inf
+            if np.isin(rows, ranked_rows).any() or values[rows].max() > threshold:
+                self._rankings[key] = None
+
+    def update(self, changed_rows: np.ndarray) -> None:
+        """to be called after each refresh of the MarketState with the rows whose prices or listings changed"""
+
+        self.rescore(changed_rows)
+
+    def ranking(self, key: str = "expected_profit") -> tuple[np.ndarray, np.ndarray]:
+        """returns (rows, params) index arrays of the best flip of the top-k items according to <key>, best first"""
+
+        if self._rankings[key] is None:
+            self._rankings[key] = self.flip_batch.top_k(self.k, key)
+        return self._rankings[key]
+
+    def top(self, k: int = None, key: str = "expected_profit") -> list[Flip]:
+        """returns the best flip of each of the top <k> items according to <key>, best first"""
+
+        rows, params = self.ranking(key)
+        return [self.flip_batch.flip(row, param) for row, param in zip(rows[:k].tolist(), params[:k].tolist())]
+
+    def flips(self, row: int) -> tuple[Flip]:
+        """returns the flips of the item in <row> for every params"""
+
+        return self.flip_batch.flips(row)
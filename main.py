@@ -1,16 +1,43 @@
 import atexit
 import datetime
 import json
+import os
 import time
-from operator import itemgetter
-from typing import List, TypedDict, Iterable
+from typing import List, TypedDict, Iterable, Sequence, Optional
 
 import jsonpickle
-import requests
+import numpy as np
 
 import api_handler
 from api_handler import ApiHandler, ItemPricesJson, ItemJson, ItemListingsJson
+from catalogue import ItemCatalogue
+from change_detection import DeltaRefresher
+from checkpoint import Checkpointer, load_checkpoint
+from db import TimeSeriesStore
 from item import Item, Flip, TradingStats
+from leaderboard import FlipLeaderboard
+from market_state import MarketState
+from metrics import METRICS
+from optimizer import FlipPlan, optimize
+from pipeline import RefreshPipeline, TickScheduler
+from query import ItemIndex
+from rollups import Rollups
+from tiers import TieredUniverse
+from scheduler import RefreshScheduler
+from sharding import ShardPool
+
+
+CHECKPOINT_PATH: str = "state_checkpoint.npz"
+# periods in seconds the weighted stats are kept for, as a comma separated list. only applies to a fresh state, a loaded
+# one keeps the periods it was saved with
+STATS_PERIOD: list[int] = [int(period) for period in
+                           os.getenv("stats_period", ",".join(map(str, MarketState.STATS_PERIOD))).split(",")]
+SHARD_COUNT: int = int(os.getenv("shards", "1"))  # number of worker processes to score on, 1 scores in this process
+TOTAL_BUDGET: int = int(os.getenv("budget", "2000000"))  # coins shared by all flips of the plan
+LISTING_SLOTS: int = int(os.getenv("listing_slots", "100"))  # listings all flips of the plan may use together
+METRICS_PORT: int = int(os.getenv("metrics_port", "0"))  # serve the metrics on localhost:<port>, 0 to only log them
+TIERED: bool = os.getenv("tiered", "0") != "0"  # only poll the listings of items passing the screens of TieredUniverse
+ROLLUPS: bool = os.getenv("rollups", "0") != "0"  # keep OHLC and volume bars of every item, see Rollups.RESOLUTIONS
 
 
 class FlipListItem(TypedDict):
@@ -29,18 +56,23 @@ def save_items(item_list: list[Item]):
     write_json("item_data.txt", jsonpickle.encode(item_list))
 
 
-def get_and_save_flips(item_list: list[Item]):
-    flip_tuple_list: Iterable[tuple[Item, tuple[Flip]]] = (
-        (item, item.get_flips([(i, 0.5, 2_000_000) for i in range(5)])) for item in item_list)
+def get_and_save_flips(leaderboard: FlipLeaderboard | ShardPool):
+    rows, best_params = leaderboard.ranking("expected_profit")
     flip_list: list[FlipListItem] = [{
-        "id": item.id,
-        "name": item.name,
-        "max_profit_flip": max(flip for flip in flip_tuple),
-        "flip_tuple": flip_tuple
-    } for item, flip_tuple in flip_tuple_list]
-    # TODO
-    flip_list = sorted(flip_list, key=itemgetter("max_profit_flip"), reverse=True)
-    write_json("flip_data.txt", jsonpickle.encode(flip_list[:500]))
+        "id": int(leaderboard.flip_batch.ids[row]),
+        "name": leaderboard.state.names[leaderboard.flip_batch.rows[row]],
+        "max_profit_flip": leaderboard.flip_batch.flip(row, best),
+        "flip_tuple": leaderboard.flips(row)
+    } for row, best in zip(rows.tolist(), best_params.tolist())]
+    write_json("flip_data.txt", jsonpickle.encode(flip_list))
+    save_plan(leaderboard)
+
+
+def save_plan(leaderboard: FlipLeaderboard | ShardPool):
+    # the flips to actually do, with the budget and the listing slots shared between them
+    plan: FlipPlan = optimize(leaderboard.flip_batch, TOTAL_BUDGET, LISTING_SLOTS)
+    print(f"plan: {plan}")
+    write_json("flip_plan.txt", jsonpickle.encode([plan.flip(i) for i in range(len(plan))]))
 
 
 def save_json(item_list: list[Item]):
@@ -48,67 +80,201 @@ def save_json(item_list: list[Item]):
         json.dump(item_list, file, default=lambda o: o.to_json(), sort_keys=False)
 
 
-def load_item_list() -> list[Item]:
-    with open("item_data_2.txt", "r+") as file:
-        item_list: list[Item] = [Item.from_json(data) for data in json.load(file)]
-    return item_list
+def flip_params(state: MarketState) -> list[tuple[int, float, int]]:
+    # one flip per stats period of the state
+    return [(i, 0.5, 2_000_000) for i in range(len(state.stats_period))]
+
+
+def load_market_state() -> MarketState:
+    try:
+        return load_checkpoint(CHECKPOINT_PATH)
+    except FileNotFoundError:
+        # fall back onto the json dump written by older versions
+        with open("item_data_2.txt", "r+") as file:
+            return MarketState.from_json_list(json.load(file))
+
+
+def load_item_list() -> Sequence[Item]:
+    return Item.all_from_state(load_market_state())
+
+
+def best_flip_values(leaderboard: FlipLeaderboard | ShardPool) -> np.ndarray:
+    # expected profit of the best flip of every row, 0 for rows the leaderboard doesn't hold flips of
+    values: np.ndarray = np.zeros(len(leaderboard.state))
+    values[leaderboard.flip_batch.rows] = leaderboard.flip_batch.best("expected_profit")[1]
+    return values
 
 
-def save_state(item_list: list[Item]):
+def save_state(leaderboard: FlipLeaderboard | ShardPool):
     print("saving...")
-    save_json(item_list)
-    get_and_save_flips(item_list)
+    with METRICS.time("stage_seconds", stage="save"):
+        # bring the flips of items which didn't change since the last full re-score up to date as well
+        leaderboard.rescore()
+        get_and_save_flips(leaderboard)
+    METRICS.log()
     print("done")
 
 
-def exit_stuff(item_list: list[Item]):
+def exit_stuff(checkpointer: Checkpointer, leaderboard: FlipLeaderboard | ShardPool):
     print("exiting, gimme a sec...")
-    save_state(item_list)
+    checkpointer.save(leaderboard.state)
+    save_state(leaderboard)
     print(f"{datetime.datetime.now()}: saved items, saved flips, exiting for real now")
 
 
+def add_new_items(api: ApiHandler, catalogue: ItemCatalogue, state: MarketState) -> MarketState:
+    """revalidates the catalogue and returns <state> extended by the tradeable items it doesn't track yet, or <state>
+    itself if there are none"""
+
+    catalogue.refresh(api)
+    new_ids: list[int] = [item_id for item_id in catalogue.tradeable_ids() if item_id not in state.id_to_index]
+    if len(new_ids) == 0:
+        return state
+    print(f"tracking {len(new_ids)} new items")
+    return state.extended(catalogue.get(new_ids), api.get_item_prices_tuples_by_id_list(new_ids),
+                          api.get_item_listings_tuples_by_id_list(new_ids))
+
+
+def track(api: ApiHandler, state: MarketState) \
+        -> tuple[Optional[DeltaRefresher], FlipLeaderboard | ShardPool, RefreshPipeline, RefreshScheduler, ItemIndex]:
+    """sets up everything that keeps data per row of <state>, it has to be set up again when the state gets new rows.
+    the rollups and the tiers follow the state with their <extend> instead, so they keep what they gathered.
+    there is no DeltaRefresher when scoring on shards, every shard compares the staged data with its rows itself"""
+
+    refresher: Optional[DeltaRefresher] = None
+    leaderboard: FlipLeaderboard | ShardPool = FlipLeaderboard(state, flip_params(state)) if SHARD_COUNT <= 1 \
+        else ShardPool(state, flip_params(state), SHARD_COUNT)
+    pipeline: RefreshPipeline
+    if isinstance(leaderboard, ShardPool):
+        # chunks are only staged as they arrive, the shards update once all of them are in
+        pipeline = RefreshPipeline(api, lambda prices, _: leaderboard.stage_prices(prices),
+                                   lambda listings, _: leaderboard.stage_listings(listings))
+    else:
+        refresher = DeltaRefresher(state)
+        pipeline = RefreshPipeline(api, refresher.refresh_prices, refresher.refresh_listings)
+    refresh_scheduler: RefreshScheduler = RefreshScheduler(state)
+    refresh_scheduler.reprioritize(best_flip_values(leaderboard))
+    return refresher, leaderboard, pipeline, refresh_scheduler, ItemIndex(state)
+
+
 def main():
     api: ApiHandler = ApiHandler()
-    id_list: list[int]
-    item_list: list[Item]
-    prices_list: list[ItemPricesJson]
-    listings_list: list[ItemListingsJson]
+    state: MarketState
     print("looking for data files...")
+    catalogue: ItemCatalogue = ItemCatalogue.load()
     try:
-        item_list = load_item_list()
-        id_list = [item.id for item in item_list]
+        state = load_market_state()
         print("loaded previous item history from file")
+        if state.stats_period.tolist() != STATS_PERIOD:
+            print(f"keeping the stats periods {state.stats_period.tolist()} of the loaded state")
     except FileNotFoundError:
         print("no previous data found, starting from scratch")
-        id_list = list(set(requests.get("https://api.guildwars2.com/v2/commerce/listings").json())
-                       & set(requests.get("https://api.guildwars2.com/v2/items").json()))
-
-        item_json_list: list[ItemJson] = api.get_items_by_id_list(id_list)
-        prices_list = api.get_item_prices_by_id_list(id_list)
-        listings_list = api.get_item_listings_by_id_list(id_list)
-        item_list: list[Item] = [Item(*args) for args in zip(item_json_list, prices_list, listings_list)]
-        time.sleep(120)
-    atexit.register(exit_stuff, item_list)
-    id_to_index_map: dict[int:int] = {id_list[i]: i for i in range(len(id_list))}
+        state = MarketState([], STATS_PERIOD)
+    # items listed on the trading post since the state was saved are tracked from now on
+    state = add_new_items(api, catalogue, state)
+    snapshot_store: TimeSeriesStore = TimeSeriesStore("snapshots")
+    snapshot_store.append_state(state)
+    refresher, leaderboard, pipeline, refresh_scheduler, item_index = track(api, state)
+    universe: Optional[TieredUniverse] = TieredUniverse(state) if TIERED else None
+    checkpointer: Checkpointer = Checkpointer(CHECKPOINT_PATH)
+    # the leaderboard is replaced whenever new items are added, exit with whichever is current by then
+    atexit.register(lambda: exit_stuff(checkpointer, leaderboard))
+    # the flips of the loaded (or freshly fetched) state are available right away
+    get_and_save_flips(leaderboard)
+    scheduler: TickScheduler = TickScheduler(refresh_scheduler.tick_time)
+    rollups: Optional[Rollups] = Rollups(state) if ROLLUPS else None
+    if METRICS_PORT != 0:
+        METRICS.serve(METRICS_PORT)
     print("starting")
     i: int = 0
     while True:
-        start_time = datetime.datetime.now()
-        print(start_time)
-        prices_list = api.get_item_prices_by_id_list(id_list)
-        listings_list = api.get_item_listings_by_id_list(id_list)
-        assert len(item_list) == len(prices_list) == len(listings_list)
-        for tuple in zip(item_list, prices_list, listings_list):
-            tuple[0].update_prices(tuple[1])
-            tuple[0].update_listings(tuple[2])
-        # if i == 0:
-        #     save_state(item_list)
-        while (datetime.datetime.now() - start_time).seconds < 120:
-            time.sleep(5)
-        i %= 30
+        lateness: float = scheduler.start_tick()
+        tick_start: float = time.perf_counter()
+        METRICS.observe("tick_lag_seconds", lateness)
+        # the one clock reading of the tick, everything it refreshes is weighed and scheduled with it
+        tick_time: float = time.time()
+        start_time = datetime.datetime.fromtimestamp(tick_time)
+        print(start_time if lateness < 1 else f"{start_time} ({lateness:.0f}s behind schedule)")
+        due_rows: np.ndarray = refresh_scheduler.due(tick_time)
+        if refresher is not None:
+            refresher.begin_tick()
+        refresh_start: float = time.perf_counter()
+        listing_rows: np.ndarray = due_rows if universe is None else universe.listing_rows(due_rows)
+        changed_rows: np.ndarray = pipeline.run_tick(state.ids[due_rows].tolist(), tick_time,
+                                                     state.ids[listing_rows].tolist())
+        # the sinks update the state while the requests are in flight, whatever else the refresh took was fetching
+        METRICS.observe("stage_seconds", time.perf_counter() - refresh_start - pipeline.sink_seconds, stage="fetch")
+        METRICS.observe("stage_seconds", pipeline.sink_seconds, stage="update")
+        # rows whose requests failed stay due, so they are retried first thing next tick
+        failed: np.ndarray = np.isin(state.ids[due_rows], list(pipeline.failed_ids))
+        polled_rows: np.ndarray = due_rows[~failed]
+        # rows whose prices and listings were both received
+        listed_rows: np.ndarray = listing_rows[np.isin(listing_rows, polled_rows)]
+        refresh_scheduler.polled(polled_rows, tick_time)
+        METRICS.set("tick_failed_items", int(failed.sum()))
+        if pipeline.received != len(due_rows) + len(listing_rows):
+            # every requested id should come back, as data or as None. a mismatch is worth a look, not a crash
+            print(f"warning: got {pipeline.received} prices and listings for {len(due_rows) + len(listing_rows)} "
+                  f"requested ids")
+            METRICS.inc("tick_received_mismatches")
+        with METRICS.time("stage_seconds", stage="score"):
+            if isinstance(leaderboard, ShardPool):
+                changed_rows = leaderboard.flush(tick_time)
+                print(f"polled: {len(due_rows)}/{len(state)}, changed: {len(changed_rows)}")
+            else:
+                leaderboard.update(changed_rows)
+                print(f"polled: {len(due_rows)}/{len(state)}, {refresher.metrics}")
+        # the plan follows the candidates of every tick, the full flip data is only saved hourly
+        with METRICS.time("stage_seconds", stage="plan"):
+            save_plan(leaderboard)
+        if universe is not None:
+            # before anything reads the listings stats, the ones of the rows whose listings weren't polled decay here
+            with METRICS.time("stage_seconds", stage="tiers"):
+                promoted: np.ndarray = universe.update(polled_rows, listed_rows, tick_time)
+                if refresher is not None:
+                    refresher.resync(promoted)
+            print(universe)
+            METRICS.set("tick_listed_items", len(listing_rows))
+        with METRICS.time("stage_seconds", stage="index"):
+            # a row in failed_ids may still have had its prices (or its listings) written, so every due row is updated
+            item_index.update(due_rows)
+        if rollups is not None:
+            with METRICS.time("stage_seconds", stage="rollup"):
+                rollups.fold(polled_rows, tick_time)
+        METRICS.set("tick_polled_items", len(due_rows))
+        METRICS.set("tick_changed_items", len(changed_rows))
+        METRICS.inc("changed_items", len(changed_rows))
+        with METRICS.time("stage_seconds", stage="reprioritize"):
+            refresh_scheduler.reprioritize(best_flip_values(leaderboard))
+        with METRICS.time("stage_seconds", stage="snapshot"):
+            # the ladders of the other rows weren't refreshed (or were cleared on promotion), the backtest would infer
+            # fills from them that never happened
+            snapshot_store.append_state(state, np.intersect1d(changed_rows, listed_rows), int(tick_time))
+        with METRICS.time("stage_seconds", stage="checkpoint"):
+            checkpointer.save_async(state)
+        # save and look for new items about once an hour
+        i %= 3600 // refresh_scheduler.tick_time
         if i == 0:
-            save_state(item_list)
+            with METRICS.time("stage_seconds", stage="catalogue"):
+                extended_state: MarketState = add_new_items(api, catalogue, state)
+            if extended_state is not state:
+                if isinstance(leaderboard, ShardPool):
+                    leaderboard.close()
+                old_length: int = len(state)
+                state = extended_state
+                refresher, leaderboard, pipeline, refresh_scheduler, item_index = track(api, state)
+                if rollups is not None:
+                    rollups.extend(state)
+                if universe is not None:
+                    universe.extend(state)
+                snapshot_store.append_state(state, np.arange(old_length, len(state)), int(tick_time))
+            save_state(leaderboard)
         i += 1
+        tick_seconds: float = time.perf_counter() - tick_start
+        METRICS.observe("tick_seconds", tick_seconds)
+        # share of the tick interval the work took, above 1 the loop falls behind
+        METRICS.set("tick_utilization", tick_seconds / refresh_scheduler.tick_time)
+        scheduler.wait()
 
 
 # def main():
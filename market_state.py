@@ -0,0 +1,381 @@
+import datetime
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+
+from api_handler import ApiHandler, ItemJson
+from ladder_diff import BUYS, SELLS, LadderDiff, diff_ladders
+from payload_decoder import ItemPricesTuple, ItemListingsTuple, ListingLevel
+
+
+def _average_listing_size(ladders: np.ndarray) -> np.ndarray:
+    """average number of items per listing across the price levels of each of the packed <ladders> (..., depth, 3).
+    padding levels are all zeros and don't count towards either sum"""
+
+    quantity_sum: np.ndarray = ladders[..., 1].sum(axis=-1, dtype=np.int64)
+    listings_sum: np.ndarray = ladders[..., 2].sum(axis=-1, dtype=np.int64)
+    return np.where(listings_sum == 0, 0, quantity_sum / np.maximum(listings_sum, 1))
+
+
+def pack_ladders(ladders: Sequence[tuple[ListingLevel, ...]], depth: int) -> tuple[np.ndarray, np.ndarray]:
+    """packs the first <depth> levels of each of <ladders> into an int32 array of shape (len(ladders), depth, 3),
+    padded with zeros. returns it together with the number of levels actually used in each row"""
+
+    depths: np.ndarray = np.fromiter((min(len(ladder), depth) for ladder in ladders), dtype=np.int16,
+                                     count=len(ladders))
+    packed: np.ndarray = np.zeros((len(ladders), depth, 3), dtype=np.int32)
+    levels: list[ListingLevel] = [level for ladder in ladders for level in ladder[:depth]]
+    if len(levels) > 0:
+        # the mask is true for exactly the used levels, in the same row-major order as <levels>
+        packed[np.arange(depth)[None, :] < depths[:, None]] = levels
+    return packed, depths
+
+
+def unpack_ladders(packed: np.ndarray, depths: np.ndarray) -> list[tuple[ListingLevel, ...]]:
+    """inverse of <pack_ladders>"""
+
+    # only convert the levels that are actually used, padding makes up most of the array for thin markets
+    used: np.ndarray = np.arange(packed.shape[1])[None, :] < depths[:, None]
+    levels: list[ListingLevel] = list(map(tuple, packed[used].tolist()))
+    offsets: list[int] = np.concatenate([[0], np.cumsum(depths, dtype=np.int64)]).tolist()
+    return [tuple(levels[offsets[k]:offsets[k + 1]]) for k in range(len(depths))]
+
+
+class MarketState(object):
+    """columnar store for the trading state of every tracked item. instead of one TradingStats object per item and
+    period, every stat is a single array of shape (n_items, n_periods) and every shared stat an array of shape
+    (n_items,), so a refresh updates all items and periods in one vectorized pass. rows are addressed by index, see
+    <id_to_index>. Item, SharedTradingStats and TradingStats are thin views onto a row of this store"""
+
+    STATS_PERIOD: list[int] = [5400, 10800, 21600, 43200, 64800]  # 86400  # relevant time period for TradingStats in
+    # seconds
+    STATS_FIELDS: tuple[str, ...] = ("buy_price_delta", "sell_price_delta", "buys", "sells", "demand_delta",
+                                     "supply_delta")
+    LADDER_DEPTH: int = ApiHandler.LISTING_CUTOFF  # price levels per side kept of the listings of an item
+    # decay the weighted stats by exp(-dt/period) instead of by the linear min(1, dt/period) of older versions
+    CONTINUOUS_DECAY: bool = True
+    EXCLUDE_CANCELS: bool = True  # only count what looks like filled orders as sold/bought, not cancels and relists
+    # any stats described as "weighted" are stats which consist of a sum of the recorded values where the older
+    # components of the sum are weighted less and less as newer updates are added. these weighted values are not
+    # exact numbers for each stat, but instead scores designed to take both the track record and recent development
+    # of the stat into account to represent the trend of the stat. These scores will asymptotically tend towards the
+    # latest <stat>/<refresh_time>, a derivative of sorts that takes into account history as well
+
+    def __init__(self, ids: Sequence[int], stats_period: Sequence[int] = None):
+        n: int = len(ids)
+        self.ids: np.ndarray = np.asarray(ids, dtype=np.int64)  # api id of the item in each row
+        self.id_to_index: dict[int, int] = {item_id: i for i, item_id in enumerate(self.ids.tolist())}
+        self.stats_period: np.ndarray = np.asarray(self.STATS_PERIOD if stats_period is None else stats_period,
+                                                   dtype=np.float64)
+
+        self.names: list[str] = [""] * n  # in game name of the item
+        self.vendor_value: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.buy_price: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.sell_price: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.demand: np.ndarray = np.zeros(n, dtype=np.int64)  # total demand (sum of buy orders) of the item
+        self.supply: np.ndarray = np.zeros(n, dtype=np.int64)  # total supply (sum of sell listings) of the item
+        self.bid_size: np.ndarray = np.zeros(n, dtype=np.float64)  # average number of items per buy order across
+        # the bids with the highest n prices, where n is the cutoff specified in ApiHandler._cut_listing
+        self.offer_size: np.ndarray = np.zeros(n, dtype=np.float64)  # average number of items per sell listing
+        # across the offers with the lowest n prices
+        self.prices_timestamp: np.ndarray = np.zeros(n, dtype=np.float64)  # posix time of the latest prices data
+        self.listings_timestamp: np.ndarray = np.zeros(n, dtype=np.float64)  # posix time of the latest listings data
+        # listings api data from last refresh, packed as (unit_price, quantity, listings) per price level. only the
+        # first buy_depth/sell_depth levels of a row are used, the rest is zero padding
+        self.buy_ladder: np.ndarray = np.zeros((n, self.LADDER_DEPTH, 3), dtype=np.int32)  # descending by unit_price
+        self.sell_ladder: np.ndarray = np.zeros((n, self.LADDER_DEPTH, 3), dtype=np.int32)  # ascending by unit_price
+        self.buy_depth: np.ndarray = np.zeros(n, dtype=np.int16)
+        self.sell_depth: np.ndarray = np.zeros(n, dtype=np.int16)
+        # amounts sold into buy orders and bought from sell listings between the last two listings updates of a row,
+        # see <filled_amounts>
+        self.last_sold: np.ndarray = np.zeros(n, dtype=np.int64)
+        self.last_bought: np.ndarray = np.zeros(n, dtype=np.int64)
+
+        # weighted stats, one column per stats period
+        shape: tuple[int, int] = (n, len(self.stats_period))
+        self.buy_price_delta: np.ndarray = np.zeros(shape, dtype=np.float64)
+        self.sell_price_delta: np.ndarray = np.zeros(shape, dtype=np.float64)
+        self.buys: np.ndarray = np.zeros(shape, dtype=np.float64)  # weighted stat of filled buy orders
+        self.sells: np.ndarray = np.zeros(shape, dtype=np.float64)  # weighted stat of filled sell listings
+        self.demand_delta: np.ndarray = np.zeros(shape, dtype=np.float64)  # weighted stat of demand trend
+        self.supply_delta: np.ndarray = np.zeros(shape, dtype=np.float64)  # weighted stat of supply trend
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_api(cls, item_json_list: list[ItemJson], prices_list: list[ItemPricesTuple],
+                 listings_list: list[ItemListingsTuple], stats_period: Sequence[int] = None) -> "MarketState":
+        """creates a new state from fresh api data (see ApiHandler.get_item_prices_tuples_by_id_list and
+        get_item_listings_tuples_by_id_list). the three lists have to follow the same ordering of ids, items for which
+        any of the three is missing (None) are left out"""
+
+        rows: list[tuple[ItemJson, ItemPricesTuple, ItemListingsTuple]] = [
+            row for row in zip(item_json_list, prices_list, listings_list) if None not in row]
+        state: MarketState = cls([item_json["id"] for item_json, _, _ in rows], stats_period)
+        time_now: float = time.time()
+        for i, (item_json, item_prices, item_listings) in enumerate(rows):
+            state._set_row(i, item_json, item_prices, item_listings, time_now, time_now)
+        return state
+
+    def extended(self, item_json_list: list[ItemJson], prices_list: list[ItemPricesTuple],
+                 listings_list: list[ItemListingsTuple]) -> "MarketState":
+        """copy of the state with rows for new items appended behind the existing ones, from fresh api data as in
+        <from_api>. the existing rows keep their index"""
+
+        new: MarketState = MarketState.from_api(item_json_list, prices_list, listings_list, self.stats_period)
+        state: MarketState = MarketState(np.concatenate([self.ids, new.ids]), self.stats_period)
+        for name, value in self.__dict__.items():
+            if isinstance(value, np.ndarray) and name not in ("ids", "stats_period"):
+                getattr(state, name)[:len(self)] = value
+                getattr(state, name)[len(self):] = getattr(new, name)
+        state.names = self.names + new.names
+        return state
+
+    @classmethod
+    def from_json_list(cls, data_list: list[dict]) -> "MarketState":
+        """creates a state from a list of Item.to_json dicts"""
+
+        stats_period: Optional[list[int]] = None if len(data_list) == 0 else \
+            [ts["stats_period"] for ts in data_list[0]["trading_stats"]]
+        state: MarketState = cls([data["item_json"]["id"] for data in data_list], stats_period)
+        for i, data in enumerate(data_list):
+            sts: dict = data["shared_trading_stats"]
+            state._set_row(i, data["item_json"] | {"vendor_value": sts["vendor_value"]},
+                           ItemPricesTuple.from_json(sts["prices_json"]),
+                           ItemListingsTuple.from_json(sts["listings_json"]),
+                           datetime.datetime.fromisoformat(sts["prices_timestamp"]).timestamp(),
+                           datetime.datetime.fromisoformat(sts["listings_timestamp"]).timestamp())
+            for j, ts in enumerate(data["trading_stats"]):
+                for field in cls.STATS_FIELDS:
+                    getattr(state, field)[i, j] = ts[field]
+        return state
+
+    def copy(self) -> "MarketState":
+        """copy of the state that isn't affected by later updates of this one"""
+
+        state: MarketState = MarketState.__new__(MarketState)
+        for name, value in self.__dict__.items():
+            state.__dict__[name] = value.copy()
+        return state
+
+    def _set_row(self, i: int, item_json: ItemJson, item_prices: ItemPricesTuple, item_listings: ItemListingsTuple,
+                 prices_timestamp: float, listings_timestamp: float) -> None:
+        self.names[i] = item_json["name"]
+        self.vendor_value[i] = item_json["vendor_value"]
+        self.buy_price[i] = item_prices.buy_price
+        self.sell_price[i] = item_prices.sell_price
+        self.demand[i] = item_prices.buy_quantity
+        self.supply[i] = item_prices.sell_quantity
+        (self.buy_ladder[i:i + 1], self.buy_depth[i:i + 1]) = pack_ladders([item_listings.buys], self.LADDER_DEPTH)
+        (self.sell_ladder[i:i + 1], self.sell_depth[i:i + 1]) = pack_ladders([item_listings.sells], self.LADDER_DEPTH)
+        self.bid_size[i] = _average_listing_size(self.buy_ladder[i])
+        self.offer_size[i] = _average_listing_size(self.sell_ladder[i])
+        self.prices_timestamp[i] = prices_timestamp
+        self.listings_timestamp[i] = listings_timestamp
+
+    def view(self, start: int, stop: int) -> "MarketState":
+        """state of the rows start:stop that shares its arrays with this one, so updates to either are visible in
+        both"""
+
+        state: MarketState = MarketState.__new__(MarketState)
+        for name, value in self.__dict__.items():
+            if name != "id_to_index":
+                state.__dict__[name] = value[start:stop]
+        state.stats_period = self.stats_period
+        state.id_to_index = {item_id: i for i, item_id in enumerate(state.ids.tolist())}
+        return state
+
+    def prices_list(self, rows: np.ndarray = None) -> list[ItemPricesTuple]:
+        """prices api data from the last refresh of <rows> (all rows if not provided)"""
+
+        rows = np.arange(len(self)) if rows is None else rows
+        return list(map(ItemPricesTuple._make, zip(*(column[rows].tolist() for column in (
+            self.ids, self.demand, self.buy_price, self.supply, self.sell_price)))))
+
+    def prices_of(self, row: int) -> ItemPricesTuple:
+        """prices api data from the last refresh of a single row"""
+
+        return ItemPricesTuple(int(self.ids[row]), int(self.demand[row]), int(self.buy_price[row]),
+                               int(self.supply[row]), int(self.sell_price[row]))
+
+    def listings_of(self, row: int) -> ItemListingsTuple:
+        """listings api data from the last refresh of a single row, cut to LADDER_DEPTH levels"""
+
+        return ItemListingsTuple(int(self.ids[row]),
+                                 tuple(map(tuple, self.buy_ladder[row, :self.buy_depth[row]].tolist())),
+                                 tuple(map(tuple, self.sell_ladder[row, :self.sell_depth[row]].tolist())))
+
+    def listings_list(self, rows: np.ndarray = None) -> list[ItemListingsTuple]:
+        """listings api data from the last refresh of <rows> (all rows if not provided), cut to LADDER_DEPTH levels"""
+
+        rows = np.arange(len(self)) if rows is None else rows
+        return list(map(ItemListingsTuple._make, zip(self.ids[rows].tolist(),
+                                                     unpack_ladders(self.buy_ladder[rows], self.buy_depth[rows]),
+                                                     unpack_ladders(self.sell_ladder[rows], self.sell_depth[rows]))))
+
+    def _weights(self, rows: np.ndarray, timestamps: np.ndarray, time_now: float) -> tuple[np.ndarray, np.ndarray]:
+        """calculates the weight (n_rows, n_periods) to be used to update the weighted scores and the gain (n_rows,
+        n_periods) observed changes are added with, i.e. the weight times the factor normalizing a change to a change
+        per REFRESH_TIME. <timestamps> holds the time of the last update of every row, <time_now> is the time of this
+        one"""
+
+        if not self.CONTINUOUS_DECAY:
+            # clamp to a second so that two updates in quick succession can't divide by zero
+            time_since_update: np.ndarray = np.maximum(time_now - timestamps[rows], 1.0)[:, None]
+            weight: np.ndarray = np.minimum(1, time_since_update / self.stats_period[None, :])
+            return weight, weight * (ApiHandler.REFRESH_TIME / time_since_update)
+
+        # the old score decays by exp(-dt/period), so splitting an interval into several updates decays it the same as
+        # a single update would. weight / dt tends to 1 / period for updates in quick succession, no clamp needed
+        periods_passed: np.ndarray = np.maximum(time_now - timestamps[rows], 0.0)[:, None] / self.stats_period[None, :]
+        weight = -np.expm1(-periods_passed)
+        gain: np.ndarray = np.divide(weight, periods_passed, out=np.ones_like(weight), where=periods_passed > 0) \
+            * (ApiHandler.REFRESH_TIME / self.stats_period[None, :])
+        return weight, gain
+
+    def _rows_of(self, data_list: list) -> tuple[list, np.ndarray]:
+        """filters out missing (None) api data and returns the remaining data together with their row indexes"""
+
+        present: list = [data for data in data_list if data is not None]
+        return present, np.fromiter((self.id_to_index[data.id] for data in present), dtype=np.int64,
+                                    count=len(present))
+
+    def update_prices(self, prices_list: list[Optional[ItemPricesTuple]], time_now: float = None) -> np.ndarray:
+        """updates all trading-relevant stats of the items given fresh prices data from the api. <prices_list> may
+        contain any subset of the tracked items, in any order. returns the indexes of the rows whose prices changed"""
+
+        prices_list, rows = self._rows_of(prices_list)
+        # columns of (id, buy_quantity, buy_price, sell_quantity, sell_price)
+        prices: np.ndarray = np.array(prices_list, dtype=np.int64).reshape(len(rows), len(ItemPricesTuple._fields))
+        return self.update_packed_prices(rows, prices, time_now)
+
+    def update_packed_prices(self, rows: np.ndarray, prices: np.ndarray, time_now: float = None) -> np.ndarray:
+        """same as <update_prices>, with the prices data of <rows> already packed into an array with the columns of
+        ItemPricesTuple"""
+
+        time_now = time.time() if time_now is None else time_now
+        new_demand: np.ndarray = prices[:, 1]
+        new_supply: np.ndarray = prices[:, 3]
+        new_buy_price: np.ndarray = prices[:, 2]
+        new_sell_price: np.ndarray = prices[:, 4]
+
+        # trading stats need to be updated even if nothing has changed about the item (as the lack of activity is
+        # information in and of itself)
+        weight, gain = self._weights(rows, self.prices_timestamp, time_now)
+        for field, new, old in (("demand_delta", new_demand, self.demand),
+                                ("supply_delta", new_supply, self.supply),
+                                ("buy_price_delta", new_buy_price, self.buy_price),
+                                ("sell_price_delta", new_sell_price, self.sell_price)):
+            stat: np.ndarray = getattr(self, field)
+            stat[rows] = (1 - weight) * stat[rows] + gain * (new - old[rows])[:, None]
+
+        changed: np.ndarray = (new_demand != self.demand[rows]) | (new_supply != self.supply[rows]) \
+            | (new_buy_price != self.buy_price[rows]) | (new_sell_price != self.sell_price[rows])
+        self.demand[rows] = new_demand
+        self.supply[rows] = new_supply
+        self.buy_price[rows] = new_buy_price
+        self.sell_price[rows] = new_sell_price
+        self.prices_timestamp[rows] = time_now
+        return rows[changed]
+
+    def decay_prices(self, rows: np.ndarray, time_now: float = None) -> None:
+        """closed-form update for <rows> whose prices didn't change since the last refresh. with every observed change
+        being 0, the update in <update_prices> reduces to decaying the price stats by (1 - weight)"""
+
+        time_now = time.time() if time_now is None else time_now
+        weight, _ = self._weights(rows, self.prices_timestamp, time_now)
+        for field in ("demand_delta", "supply_delta", "buy_price_delta", "sell_price_delta"):
+            getattr(self, field)[rows] *= 1 - weight
+        self.prices_timestamp[rows] = time_now
+
+    def update_listings(self, listings_list: list[Optional[ItemListingsTuple]],
+                        time_now: float = None) -> np.ndarray:
+        """updates all trading-relevant stats of the items given fresh listings data from the api. <listings_list> may
+        contain any subset of the tracked items, in any order. returns the indexes of the rows whose listings changed"""
+
+        listings_list, rows = self._rows_of(listings_list)
+        new_buy_ladder, new_buy_depth = pack_ladders([item_listings.buys for item_listings in listings_list],
+                                                     self.LADDER_DEPTH)
+        new_sell_ladder, new_sell_depth = pack_ladders([item_listings.sells for item_listings in listings_list],
+                                                       self.LADDER_DEPTH)
+        return self.update_packed_listings(rows, new_buy_ladder, new_buy_depth, new_sell_ladder, new_sell_depth,
+                                           time_now)
+
+    def filled_amounts(self, rows: np.ndarray, new_buy_ladder: np.ndarray, new_buy_depth: np.ndarray,
+                       new_sell_ladder: np.ndarray, new_sell_depth: np.ndarray) \
+            -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """compares the packed new ladders of <rows> with the current ones and returns the amount sold into buy orders
+        and bought from sell listings of each row in between, and whether its ladders changed at all. see
+        ladder_diff.diff_ladders, the amounts are what it considers filled if EXCLUDE_CANCELS is set and everything that
+        disappeared otherwise"""
+
+        changed: np.ndarray = (new_buy_depth != self.buy_depth[rows]) | (new_sell_depth != self.sell_depth[rows]) \
+            | (new_buy_ladder != self.buy_ladder[rows]).any(axis=(1, 2)) \
+            | (new_sell_ladder != self.sell_ladder[rows]).any(axis=(1, 2))
+
+        # identical ladders can't have had anything filled, so only the changed ones have to be compared. the filled
+        # amounts don't depend on the stats period, so the ladders only have to be compared once per item
+        sold: np.ndarray = np.zeros(len(rows), dtype=np.int64)
+        bought: np.ndarray = np.zeros(len(rows), dtype=np.int64)
+        changed_index: np.ndarray = np.flatnonzero(changed)
+        changed_rows: np.ndarray = rows[changed_index]
+        buys: LadderDiff = diff_ladders(self.buy_ladder[changed_rows], self.buy_depth[changed_rows],
+                                        new_buy_ladder[changed_index], new_buy_depth[changed_index], BUYS)
+        sells: LadderDiff = diff_ladders(self.sell_ladder[changed_rows], self.sell_depth[changed_rows],
+                                         new_sell_ladder[changed_index], new_sell_depth[changed_index], SELLS)
+        sold[changed_index] = buys.filled if self.EXCLUDE_CANCELS else buys.removed
+        bought[changed_index] = sells.filled if self.EXCLUDE_CANCELS else sells.removed
+        return sold, bought, changed
+
+    def update_packed_listings(self, rows: np.ndarray, new_buy_ladder: np.ndarray, new_buy_depth: np.ndarray,
+                               new_sell_ladder: np.ndarray, new_sell_depth: np.ndarray, time_now: float = None,
+                               filled: tuple[np.ndarray, np.ndarray, np.ndarray] = None) -> np.ndarray:
+        """same as <update_listings>, with the listings data of <rows> already packed (see <pack_ladders>). the result
+        of <filled_amounts> for the same data can be passed in as <filled> if the caller needed it as well"""
+
+        time_now = time.time() if time_now is None else time_now
+        sold, bought, changed = self.filled_amounts(rows, new_buy_ladder, new_buy_depth, new_sell_ladder,
+                                                    new_sell_depth) if filled is None else filled
+
+        self.buy_ladder[rows] = new_buy_ladder
+        self.sell_ladder[rows] = new_sell_ladder
+        self.buy_depth[rows] = new_buy_depth
+        self.sell_depth[rows] = new_sell_depth
+        self.bid_size[rows] = _average_listing_size(new_buy_ladder)
+        self.offer_size[rows] = _average_listing_size(new_sell_ladder)
+        self.last_sold[rows] = sold
+        self.last_bought[rows] = bought
+
+        # update the relevant stats using the calculated sums with appropriate weight. buys counts the filled buy orders
+        # (what was sold into them), sells the filled sell listings (what was bought from them)
+        weight, gain = self._weights(rows, self.listings_timestamp, time_now)
+        self.buys[rows] = (1 - weight) * self.buys[rows] + gain * sold[:, None]
+        self.sells[rows] = (1 - weight) * self.sells[rows] + gain * bought[:, None]
+
+        self.listings_timestamp[rows] = time_now
+        return rows[changed]
+
+    def decay_listings(self, rows: np.ndarray, time_now: float = None) -> None:
+        """closed-form update for <rows> whose listings didn't change since the last refresh. nothing can have been
+        filled, so the update in <update_listings> reduces to decaying the listings stats by (1 - weight)"""
+
+        time_now = time.time() if time_now is None else time_now
+        weight, _ = self._weights(rows, self.listings_timestamp, time_now)
+        self.buys[rows] *= 1 - weight
+        self.sells[rows] *= 1 - weight
+        self.last_sold[rows] = 0
+        self.last_bought[rows] = 0
+        self.listings_timestamp[rows] = time_now
+
+    def clear_listings(self, rows: np.ndarray) -> None:
+        """drops the ladders of <rows>, e.g. because they weren't kept up to date. the next listings update of a row
+        then takes its ladders as they are, instead of inferring fills from the difference to the outdated ones"""
+
+        self.buy_ladder[rows] = 0
+        self.sell_ladder[rows] = 0
+        self.buy_depth[rows] = 0
+        self.sell_depth[rows] = 0
+        self.bid_size[rows] = 0
+        self.offer_size[rows] = 0
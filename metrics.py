@@ -0,0 +1,167 @@
+import bisect
+import contextlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, Optional
+
+Labels = tuple[tuple[str, str], ...]  # (name, value) pairs
+
+# upper bounds in seconds of the latency buckets, roughly 2.5x apart from 1ms to 5min
+LATENCY_BUCKETS: tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                                      25.0, 60.0, 120.0, 300.0)
+
+
+class Histogram(object):
+    """counts of observed values per bucket, plus their sum. buckets are given by their upper bounds, values above the
+    last one go into an overflow bucket"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: tuple[float, ...] = LATENCY_BUCKETS):
+        self.bounds: tuple[float, ...] = bounds
+        self.counts: list[int] = [0] * (len(bounds) + 1)
+        self.sum: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """upper bound of the bucket the <q> quantile falls into"""
+
+        rank: float = q * self.count
+        seen: int = 0
+        for bound, count in zip(self.bounds + (float("inf"),), self.counts):
+            seen += count
+            if seen >= rank and seen > 0:
+                return bound
+        return 0.0
+
+
+class Metrics(object):
+    """registry of the counters, gauges and histograms of the bot. every series is identified by a name and a set of
+    labels. recording a value is a dict lookup and an addition, so it can be done on every request and every stage of
+    every tick without costing anything noticeable. only creating a new series takes a lock, so the registry can be
+    read from the thread of <serve> while the bot keeps recording"""
+
+    def __init__(self):
+        self.counters: dict[tuple[str, Labels], float] = {}
+        self.gauges: dict[tuple[str, Labels], float] = {}
+        self.histograms: dict[tuple[str, Labels], Histogram] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def _key(name: str, labels: dict[str, str]) -> tuple[str, Labels]:
+        # not sorted to keep recording cheap, the labels of a series have to be passed in the same order every time
+        return name, tuple(labels.items())
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        key: tuple[str, Labels] = self._key(name, labels)
+        if key not in self.counters:
+            with self.lock:
+                self.counters.setdefault(key, 0)
+        self.counters[key] += value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        key: tuple[str, Labels] = self._key(name, labels)
+        if key not in self.gauges:
+            with self.lock:
+                self.gauges.setdefault(key, 0)
+        self.gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        key: tuple[str, Labels] = self._key(name, labels)
+        histogram: Optional[Histogram] = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        histogram.observe(value)
+
+    @contextlib.contextmanager
+    def time(self, name: str, **labels: str) -> Iterator[None]:
+        """observes the seconds the body of the with statement took in histogram <name>"""
+
+        start: float = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def _series(self) -> tuple[list, list, list]:
+        with self.lock:
+            return list(self.counters.items()), list(self.gauges.items()), list(self.histograms.items())
+
+    def to_json(self) -> dict:
+        """the current value of every series, histograms as count, sum and rough quantiles"""
+
+        counters, gauges, histograms = self._series()
+        return {
+            "counters": [{"name": name, **dict(labels), "value": value} for (name, labels), value in counters],
+            "gauges": [{"name": name, **dict(labels), "value": value} for (name, labels), value in gauges],
+            "histograms": [{"name": name, **dict(labels), "count": histogram.count, "sum": round(histogram.sum, 6),
+                            "p50": histogram.quantile(0.5), "p99": histogram.quantile(0.99)}
+                           for (name, labels), histogram in histograms]
+        }
+
+    def to_prometheus(self) -> str:
+        """the current value of every series in the prometheus text format"""
+
+        def series(name: str, labels: Labels, extra: Labels = ()) -> str:
+            pairs: Labels = labels + extra
+            return name if len(pairs) == 0 else name + "{" + ",".join(f'{label}="{value}"'
+                                                                      for label, value in pairs) + "}"
+
+        counters, gauges, histograms = self._series()
+        lines: list[str] = []
+        for (name, labels), value in counters:
+            lines.append(f"{series(name + '_total', labels)} {value}")
+        for (name, labels), value in gauges:
+            lines.append(f"{series(name, labels)} {value}")
+        for (name, labels), histogram in histograms:
+            cumulative: int = 0
+            for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                cumulative += count
+                le: str = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{series(name + '_bucket', labels, (('le', le),))} {cumulative}")
+            lines.append(f"{series(name + '_sum', labels)} {histogram.sum}")
+            lines.append(f"{series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def log(self) -> None:
+        """prints the current values as a single line of json, for a periodic structured log"""
+
+        print(json.dumps({"time": time.time(), **self.to_json()}))
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """serves <to_prometheus> under /metrics and <to_json> under /metrics.json on a daemon thread"""
+
+        metrics: Metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body, content_type = metrics.to_prometheus().encode(), "text/plain; version=0.0.4"
+                elif self.path == "/metrics.json":
+                    body, content_type = json.dumps(metrics.to_json()).encode(), "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server: ThreadingHTTPServer = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+METRICS: Metrics = Metrics()  # the registry everything records into
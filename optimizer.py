@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+
+from flip_engine import FlipBatch
+from item import Flip, SharedTradingStats
+
+LISTING_SIZE: int = 250  # items per listing
+
+
+class FlipPlan(object):
+    """a set of flips chosen by <optimize>, at most one per item. every field is an array with one element per chosen
+    flip, <rows> and <params> index into the FlipBatch the flips were chosen from"""
+
+    def __init__(self, flips: FlipBatch, rows: np.ndarray, params: np.ndarray, quantity: np.ndarray,
+                 upper_bound: float):
+        self.flips: FlipBatch = flips
+        self.rows: np.ndarray = rows
+        self.params: np.ndarray = params
+        self.quantity: np.ndarray = quantity  # may be less than the quantity of the flip, if the budget ran out
+        # capital and pph scale with the quantity, so they are the ones of the flip times the share of it taken
+        share: np.ndarray = quantity / np.maximum(1, flips.quantity[rows, params])
+        self.capital: np.ndarray = quantity * _unit_capital(flips)[rows, params]
+        self.expected_pph: np.ndarray = share * flips.expected_pph[rows, params]
+        self.expected_profit: np.ndarray = share * flips.expected_profit[rows, params]
+        self.listings: np.ndarray = -(-quantity // LISTING_SIZE)
+        # total pph of the fractional relaxation, nothing can do better than this
+        self.upper_bound: float = upper_bound
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def flip(self, i: int) -> Flip:
+        """the <i>th chosen flip, with its quantity and profits scaled down to the planned quantity"""
+
+        row, param = int(self.rows[i]), int(self.params[i])
+        flips: FlipBatch = self.flips
+        return Flip(int(flips.ids[row]), int(flips.target_trade_duration[row, param]), int(self.quantity[i]),
+                    int(flips.buy_price[row, param]), int(flips.expected_sell_price[row, param]),
+                    int(self.expected_profit[i]), int(flips.buy_time[row, param]), int(flips.sell_time[row, param]))
+
+    def __str__(self) -> str:
+        return f"{len(self)} flips, {int(self.capital.sum())} capital, {int(self.listings.sum())} listings, " \
+               f"{int(self.expected_pph.sum())} pph (at most {int(self.upper_bound)})"
+
+
+def _unit_capital(flips: FlipBatch) -> np.ndarray:
+    # what a single unit of a flip ties up, the same way Item._get_flip divides its budget
+    return flips.buy_price + 0.05 * flips.expected_sell_price
+
+
+def optimize(flips: FlipBatch, budget: int, listing_slots: int,
+             max_listings: int = SharedTradingStats.MAX_LISTINGS) -> FlipPlan:
+    """picks at most one flip per item of <flips> and a quantity for each, maximizing the total expected_pph while
+    the capital of all of them stays within <budget> and they need at most <listing_slots> listings together (and at
+    most <max_listings> each).
+    the expected pph of a flip grows linearly with its quantity, so this is a two-constraint knapsack with divisible
+    items. it is solved greedily by pph per unit of a combined cost of capital and listings, for a few different
+    weightings of the two, keeping the best result. the fractional relaxations of either constraint on its own bound
+    how far from optimal that can be"""
+
+    unit_capital: np.ndarray = _unit_capital(flips)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        unit_pph: np.ndarray = np.where(flips.quantity > 0, flips.expected_pph / flips.quantity, 0)
+    max_quantity: np.ndarray = np.minimum(flips.quantity, max_listings * LISTING_SIZE)
+    rows, params = np.nonzero((unit_pph > 0) & (max_quantity > 0) & (unit_capital > 0))
+    unit_pph, unit_capital = unit_pph[rows, params], unit_capital[rows, params]
+    max_quantity = max_quantity[rows, params]
+
+    # each constraint on its own is a relaxation of the problem, so the tighter of the two bounds holds
+    upper_bound: float = min(_fractional_bound(unit_pph, unit_capital, max_quantity, budget),
+                             _fractional_bound(unit_pph, np.full(len(rows), 1 / LISTING_SIZE), max_quantity,
+                                               listing_slots))
+
+    # a listing takes a whole slot no matter how many items are in it, so small flips pay for more of a slot per unit
+    unit_slots: np.ndarray = -(-max_quantity // LISTING_SIZE) / max_quantity
+    best: tuple[float, list[int], list[int]] = (-1.0, [], [])
+    for capital_weight in (1.0, 0.75, 0.5, 0.25, 0.0):
+        # cost of a unit as its share of the budget and its share of the listing slots
+        cost: np.ndarray = capital_weight * unit_capital / max(1, budget) \
+            + (1 - capital_weight) * unit_slots / max(1, listing_slots)
+        pph, chosen, quantities = _greedy(np.argsort(-unit_pph / cost, kind="stable"), rows, unit_pph, unit_capital,
+                                          max_quantity, budget, listing_slots)
+        if pph > best[0]:
+            best = (pph, chosen, quantities)
+    _, chosen, quantities = best
+    chosen_index: np.ndarray = np.array(chosen, dtype=np.int64)
+    return FlipPlan(flips, rows[chosen_index], params[chosen_index], np.array(quantities, dtype=np.int64),
+                    upper_bound)
+
+
+def _fractional_bound(unit_value: np.ndarray, unit_weight: np.ndarray, max_quantity: np.ndarray,
+                      capacity: float) -> float:
+    """best total value of a single constraint knapsack if the quantities don't have to be whole: best value per
+    weight first, the last one only partially"""
+
+    order: np.ndarray = np.argsort(-unit_value / unit_weight, kind="stable")
+    weight: np.ndarray = np.cumsum(unit_weight[order] * max_quantity[order])
+    full: int = int(np.searchsorted(weight, capacity, side="right"))
+    bound: float = float((unit_value[order] * max_quantity[order])[:full].sum())
+    if full < len(order):
+        spare: float = capacity - (weight[full - 1] if full > 0 else 0)
+        bound += spare / unit_weight[order[full]] * unit_value[order[full]]
+    return bound
+
+
+def _greedy(order: np.ndarray, rows: np.ndarray, unit_pph: np.ndarray, unit_capital: np.ndarray,
+            max_quantity: np.ndarray, budget: int, listing_slots: int) -> tuple[float, list[int], list[int]]:
+    """takes as much as fits of every candidate in <order>, skipping items that already have a flip"""
+
+    budget_left: float = budget
+    slots_left: int = listing_slots
+    taken_rows: set[int] = set()
+    pph: float = 0.0
+    chosen: list[int] = []
+    quantities: list[int] = []
+    for i, row, price, quantity, value in zip(order.tolist(), rows[order].tolist(), unit_capital[order].tolist(),
+                                              max_quantity[order].tolist(), unit_pph[order].tolist()):
+        if row in taken_rows:
+            continue
+        quantity = min(quantity, math.floor(budget_left / price), slots_left * LISTING_SIZE)
+        if quantity <= 0:
+            if slots_left == 0:
+                break
+            continue
+        taken_rows.add(row)
+        chosen.append(i)
+        quantities.append(quantity)
+        budget_left -= quantity * price
+        slots_left -= -(-quantity // LISTING_SIZE)
+        pph += quantity * value
+    return pph, chosen, quantities
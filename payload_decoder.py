@@ -0,0 +1,197 @@
+import functools
+import json
+import operator
+import re
+from typing import Callable, NamedTuple
+
+ListingLevel = tuple[int, int, int]  # (unit_price, quantity, listings) of a single price level of a ladder
+
+
+class ItemPricesTuple(NamedTuple):
+    """compact representation of an api response to a /prices request (see ItemPricesJson)"""
+
+    id: int
+    buy_quantity: int
+    buy_price: int
+    sell_quantity: int
+    sell_price: int
+
+    @classmethod
+    def from_json(cls, prices_json: dict) -> "ItemPricesTuple":
+        return cls(prices_json["id"], prices_json["buys"]["quantity"], prices_json["buys"]["unit_price"],
+                   prices_json["sells"]["quantity"], prices_json["sells"]["unit_price"])
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "buys": {"quantity": self.buy_quantity, "unit_price": self.buy_price},
+            "sells": {"quantity": self.sell_quantity, "unit_price": self.sell_price}
+        }
+
+
+class ItemListingsTuple(NamedTuple):
+    """compact representation of an api response to a /listings request (see ItemListingsJson)"""
+
+    id: int
+    buys: tuple[ListingLevel, ...]  # descending by unit_price
+    sells: tuple[ListingLevel, ...]  # ascending by unit_price
+
+    @classmethod
+    def from_json(cls, listings_json: dict, depth: int = None) -> "ItemListingsTuple":
+        return cls(listings_json["id"],
+                   tuple((level["unit_price"], level["quantity"], level["listings"])
+                         for level in listings_json["buys"][:depth]),
+                   tuple((level["unit_price"], level["quantity"], level["listings"])
+                         for level in listings_json["sells"][:depth]))
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "buys": [{"listings": listings, "unit_price": unit_price, "quantity": quantity}
+                     for unit_price, quantity, listings in self.buys],
+            "sells": [{"listings": listings, "unit_price": unit_price, "quantity": quantity}
+                      for unit_price, quantity, listings in self.sells]
+        }
+
+
+# the api sends indented json. prices and listings payloads hold nothing but keys, numbers and booleans, so all of the
+# whitespace can be dropped before decoding without touching any value
+_WHITESPACE: bytes = b" \t\r\n"
+_NUMBER: str = r"(\d+)"
+_FIRST_OBJECT_PATTERN: re.Pattern = re.compile(r"\{(?:[^{}]|\{[^{}]*\})*\}")  # objects nest one level at most
+_KEY_PATTERN: re.Pattern = re.compile(r'"(\w+)":')
+_NUMBER_PATTERN: re.Pattern = re.compile(_NUMBER)
+_LEVEL_FIELDS: tuple[str, ...] = ("unit_price", "quantity", "listings")
+
+
+class _UnexpectedPayload(Exception):
+    pass
+
+
+def _compact(payload: bytes) -> str:
+    return payload.translate(None, _WHITESPACE).decode("utf-8")
+
+
+@functools.lru_cache(maxsize=None)
+def _prices_pattern(keys: tuple[str, ...], buys_keys: tuple[str, ...], sells_keys: tuple[str, ...]) \
+        -> tuple[re.Pattern, Callable]:
+    """pattern matching a prices object with its keys in the given order, and a function putting the numbers it finds
+    into the order of ItemPricesTuple. the order of the keys is up to the api, it is the same for every object of a
+    payload though"""
+
+    groups: list[str] = []
+    parts: list[str] = []
+    for key in keys:
+        if key == "id":
+            parts.append('"id":' + _NUMBER)
+            groups.append("id")
+        elif key == "whitelisted":
+            parts.append('"whitelisted":(?:true|false)')
+        elif key in ("buys", "sells"):
+            inner_keys: tuple[str, ...] = buys_keys if key == "buys" else sells_keys
+            if sorted(inner_keys) != ["quantity", "unit_price"]:
+                raise _UnexpectedPayload()
+            parts.append(f'"{key}":\\{{' + ",".join(f'"{inner}":' + _NUMBER for inner in inner_keys) + "\\}")
+            groups += [f"{key[:-1]}_{inner}" for inner in inner_keys]
+        else:
+            raise _UnexpectedPayload()
+    fields: tuple[str, ...] = ("id", "buy_quantity", "buy_unit_price", "sell_quantity", "sell_unit_price")
+    if sorted(groups) != sorted(fields):
+        raise _UnexpectedPayload()
+    return re.compile(r"\{" + ",".join(parts) + r"\}"), operator.itemgetter(*(groups.index(field) for field in fields))
+
+
+def decode_prices(payload: bytes) -> list[ItemPricesTuple]:
+    """decodes a /commerce/prices response straight into ItemPricesTuples, without building the intermediate dicts.
+    the key order is taken from the first object, anything unexpected falls back onto a regular json decode"""
+
+    text: str = _compact(payload)
+    try:
+        first: re.Match = _FIRST_OBJECT_PATTERN.search(text)
+        if first is None:
+            return []
+        first_json: dict = json.loads(first[0])
+        pattern, reorder = _prices_pattern(tuple(first_json), *(tuple(first_json[side]) if isinstance(
+            first_json.get(side), dict) else () for side in ("buys", "sells")))
+        prices_list: list[ItemPricesTuple] = [ItemPricesTuple(*map(int, reorder(match)))
+                                              for match in pattern.findall(text)]
+        if len(prices_list) != text.count('"id":'):
+            raise _UnexpectedPayload()
+    except _UnexpectedPayload:
+        # not in the shape we expected, take the slow but safe route
+        return [ItemPricesTuple.from_json(prices_json) for prices_json in json.loads(text)]
+    return prices_list
+
+
+@functools.lru_cache(maxsize=None)
+def _level_pattern(keys: tuple[str, ...]) -> tuple[re.Pattern, Callable]:
+    """pattern matching a price level with its keys in the given order, and a function putting the numbers it finds
+    into the order of ListingLevel"""
+
+    if sorted(keys) != sorted(_LEVEL_FIELDS):
+        raise _UnexpectedPayload()
+    return re.compile(r"\{" + ",".join(f'"{key}":' + _NUMBER for key in keys) + r"\}"), \
+        operator.itemgetter(*(keys.index(field) for field in _LEVEL_FIELDS))
+
+
+def _decode_ladder(text: str, pos: int, depth: int, level: list) -> tuple[tuple[ListingLevel, ...], int]:
+    """decodes the first <depth> levels of the ladder starting at <pos> (right behind its opening bracket) and returns
+    them together with the position behind its closing bracket. the remaining levels are skipped without being
+    decoded, levels don't contain any brackets so the next ] closes the ladder. <level> holds the pattern and reorder
+    function of the levels of the payload, it is filled in from the first level found"""
+
+    levels: list[ListingLevel] = []
+    while len(levels) < depth and text.startswith("{", pos):
+        if len(level) == 0:
+            end: int = text.find("}", pos)
+            level += _level_pattern(tuple(_KEY_PATTERN.findall(text, pos, end)))
+        match: re.Match = level[0].match(text, pos)
+        if match is None:
+            raise _UnexpectedPayload()
+        levels.append(tuple(map(int, level[1](match.groups()))))
+        pos = match.end()
+        if text.startswith(",", pos):
+            pos += 1
+    end = text.find("]", pos)
+    if end < 0:
+        raise _UnexpectedPayload()
+    return tuple(levels), end + 1
+
+
+def decode_listings(payload: bytes, depth: int) -> list[ItemListingsTuple]:
+    """decodes a /commerce/listings response straight into ItemListingsTuples holding only the first <depth> levels of
+    each ladder. levels behind the cutoff are skipped over instead of being parsed, which for busy items is most of the
+    payload. the keys of an object may come in any order"""
+
+    text: str = _compact(payload)
+    listings_list: list[ItemListingsTuple] = []
+    level: list = []
+    try:
+        pos: int = text.find("{")
+        while pos >= 0:
+            item_id: int = -1
+            ladders: dict[str, tuple[ListingLevel, ...]] = {}
+            pos += 1
+            while not text.startswith("}", pos):
+                key: re.Match = _KEY_PATTERN.match(text, pos)
+                if key is None:
+                    raise _UnexpectedPayload()
+                pos = key.end()
+                if key[1] == "id":
+                    number: re.Match = _NUMBER_PATTERN.match(text, pos)
+                    if number is None:
+                        raise _UnexpectedPayload()
+                    item_id, pos = int(number[0]), number.end()
+                elif key[1] in ("buys", "sells") and text.startswith("[", pos):
+                    ladders[key[1]], pos = _decode_ladder(text, pos + 1, depth, level)
+                else:
+                    raise _UnexpectedPayload()
+                if text.startswith(",", pos):
+                    pos += 1
+            if item_id < 0 or len(ladders) != 2:
+                raise _UnexpectedPayload()
+            listings_list.append(ItemListingsTuple(item_id, ladders["buys"], ladders["sells"]))
+            pos = text.find("{", pos + 1)
+    except _UnexpectedPayload:
+        return [ItemListingsTuple.from_json(listings_json, depth) for listings_json in json.loads(text)]
+    return listings_list
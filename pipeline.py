@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Callable, Optional, AsyncIterator
+
+import numpy as np
+
+from api_handler import ApiHandler
+
+ChunkSink = Callable[[list, float], Optional[np.ndarray]]  # (api data of a chunk, time_now) -> changed rows
+
+
+class RefreshPipeline(object):
+    """producer/consumer refresh of a list of ids. the prices and the listings of every chunk of ids are requested at
+    the same time (sharing the concurrency limit of the engine) and every chunk is handed to its sink the moment its
+    response arrives, while the remaining requests are still in flight. an item is therefore updated with data that is
+    only as old as its own request, not as old as the slowest request of the whole refresh.
+    the sinks take the api data of a chunk and the time it arrived (or the time of the tick, see <run_tick>) and may
+    return the rows that changed, e.g. DeltaRefresher.refresh_prices and refresh_listings"""
+
+    def __init__(self, api: ApiHandler, on_prices: ChunkSink, on_listings: ChunkSink):
+        self.api: ApiHandler = api
+        self.on_prices: ChunkSink = on_prices
+        self.on_listings: ChunkSink = on_listings
+        self.received: int = 0  # objects received in the latest tick, missing ones (None) included
+        self.sink_seconds: float = 0.0  # spent in the sinks in the latest tick
+        # ids of the latest tick whose requests failed (as opposed to ids the api doesn't know), to be requeued
+        self.failed_ids: set[int] = set()
+        self.tick_time: Optional[float] = None  # time every chunk of the latest tick is stamped with, if any
+
+    async def _consume(self, chunks: AsyncIterator[tuple[list[int], list]], sink: ChunkSink,
+                       changed: list[np.ndarray]) -> None:
+        async for id_chunk, data_list in chunks:
+            self.failed_ids.update(item_id for item_id, data in zip(id_chunk, data_list) if data is None)
+            start: float = time.perf_counter()
+            rows: Optional[np.ndarray] = sink(data_list, time.time() if self.tick_time is None else self.tick_time)
+            self.sink_seconds += time.perf_counter() - start
+            self.received += len(data_list)
+            if rows is not None:
+                changed.append(rows)
+
+    async def _tick(self, id_list: list[int], listing_ids: list[int]) -> np.ndarray:
+        semaphore: asyncio.Semaphore = self.api.engine.semaphore()
+        changed: list[np.ndarray] = [np.empty(0, dtype=np.int64)]
+        await asyncio.gather(
+            self._consume(self.api.iter_item_prices_tuples(id_list, semaphore), self.on_prices, changed),
+            self._consume(self.api.iter_item_listings_tuples(listing_ids, semaphore), self.on_listings, changed))
+        return np.unique(np.concatenate(changed))
+
+    def run_tick(self, id_list: list[int], tick_time: float = None, listing_ids: list[int] = None) -> np.ndarray:
+        """refreshes the prices of every id of <id_list> and the listings of every id of <listing_ids> (by default the
+        same ids) and returns the rows that changed. if <tick_time> is given, every chunk is handed to its sink with it
+        instead of the time it arrived, so the whole tick is weighed with a single clock reading"""
+
+        self.tick_time = tick_time
+        self.received = 0
+        self.sink_seconds = 0.0
+        self.failed_ids = set()
+        changed_rows: np.ndarray = asyncio.run(self._tick(id_list, id_list if listing_ids is None else listing_ids))
+        for invalid_ids in self.api.invalid_ids.values():
+            self.failed_ids.difference_update(invalid_ids)
+        return changed_rows
+
+
+class TickScheduler(object):
+    """deadline driven schedule of the refresh loop. every tick is due <interval> seconds after the previous one,
+    <wait> sleeps until then in one go instead of polling. if a tick overran its deadline, the schedule moves on from
+    now instead of trying to catch up with a burst of ticks"""
+
+    def __init__(self, interval: float):
+        self.interval: float = interval
+        self.deadline: float = time.monotonic()  # monotonic time the next tick is due at
+
+    def start_tick(self) -> float:
+        """to be called at the start of each tick. returns how late the tick started in seconds"""
+
+        time_now: float = time.monotonic()
+        lateness: float = max(0.0, time_now - self.deadline)
+        # stay in phase unless a whole tick was missed
+        self.deadline = (self.deadline if lateness < self.interval else time_now) + self.interval
+        return lateness
+
+    def remaining(self) -> float:
+        """seconds left until the next tick is due"""
+
+        return max(0.0, self.deadline - time.monotonic())
+
+    def wait(self) -> None:
+        time.sleep(self.remaining())
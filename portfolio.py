@@ -0,0 +1,168 @@
+import datetime
+from math import ceil
+from typing import Iterator, Optional
+
+import numpy as np
+
+from item import Flip
+from market_state import MarketState
+from trading_post import LISTING_FEE, Fill
+from transactions import BuyOrder, SellOrder, Transaction
+
+OPEN_STATUSES: tuple[str, ...] = ("buying", "mixed", "selling")
+
+
+def _status(transaction: Transaction) -> str:
+    buying: bool = transaction.buy_order.quantity > 0
+    selling: bool = transaction.held > 0 or (transaction.sell_order is not None and transaction.sell_order.quantity > 0)
+    if buying:
+        return "mixed" if selling else "buying"
+    return "selling" if selling else "completed"
+
+
+def _capital_at_risk(transaction: Transaction) -> int:
+    """coins tied up in the buy order plus the cost of everything bought but not sold yet"""
+
+    unsold: int = transaction.held + (0 if transaction.sell_order is None else transaction.sell_order.quantity)
+    buy_price: int = transaction.buy_order.listing_price if transaction.sell_order is None \
+        else transaction.sell_order.buy_price
+    return transaction.buy_order.quantity * transaction.buy_order.listing_price + unsold * buy_price
+
+
+class Portfolio(object):
+    """bookkeeping of every open Transaction. transactions are indexed by item id, by status and by age (oldest first),
+    so the ones affected by a refresh can be found from the rows that changed instead of going through all of them.
+    the capital at risk (see <_capital_at_risk>) is kept up to date with every change, the rest of the <budget> is what
+    is left to pass to Item._get_flip / evaluate_flips for new flips.
+    the portfolio doesn't place or fill any orders itself. it is told about fills with <apply> (e.g. the ones returned
+    by TradingPost) and has to be <refresh>ed after an order of a transaction was changed in any other way"""
+
+    def __init__(self, state: MarketState, budget: int):
+        self.state: MarketState = state
+        self.budget: int = budget
+        self.capital_at_risk: int = 0
+        self.realized_profit: int = 0
+        self.completed: int = 0  # number of completed transactions, they are dropped from the indexes
+        self.by_age: dict[Transaction, None] = {}  # open transactions, oldest first
+        self.by_item: dict[int, set[Transaction]] = {}
+        self.by_status: dict[str, set[Transaction]] = {status: set() for status in OPEN_STATUSES}
+        self.by_order: dict[int, Transaction] = {}  # order id -> transaction of the order
+        self._order_ids: dict[Transaction, list[int]] = {}
+        self._risk: dict[Transaction, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.by_age)
+
+    @property
+    def budget_left(self) -> int:
+        return max(0, self.budget - self.capital_at_risk)
+
+    def can_afford(self, flip: Flip) -> bool:
+        """whether the budget left covers the buy order of <flip> and the listing fee of selling it at the expected
+        sell price"""
+
+        return flip.quantity * (flip.buy_price + ceil(LISTING_FEE * flip.expected_sell_price)) <= self.budget_left
+
+    def open(self, item_id: int, buy_order: BuyOrder, order_id: int = None) -> Transaction:
+        """starts tracking a new transaction. <order_id> is the id of the buy order, if fills are to be <apply>ed"""
+
+        transaction: Transaction = Transaction(item_id, buy_order)
+        self.by_age[transaction] = None
+        self.by_item.setdefault(item_id, set()).add(transaction)
+        self.by_status[transaction.status].add(transaction)
+        self._risk[transaction] = 0
+        self._order_ids[transaction] = []
+        self._register(transaction, order_id)
+        self.refresh(transaction)
+        return transaction
+
+    def _register(self, transaction: Transaction, order_id: Optional[int]) -> None:
+        if order_id is not None:
+            self.by_order[order_id] = transaction
+            self._order_ids[transaction].append(order_id)
+
+    def list_for_sale(self, transaction: Transaction, sell_order: SellOrder, order_id: int = None) -> None:
+        """records that (some of) the items held by <transaction> were listed with <sell_order>"""
+
+        assert sell_order.quantity <= transaction.held, "tried to list more than was bought"
+        assert transaction.sell_order is None or transaction.sell_order.quantity == 0, \
+            "transaction already has an open sell order"
+        transaction.held -= sell_order.quantity
+        transaction.sell_order = sell_order
+        self._register(transaction, order_id)
+        self.refresh(transaction)
+
+    def cancel_buy(self, transaction: Transaction) -> None:
+        """records that the buy order of <transaction> was cancelled, the unfilled rest of it is dropped"""
+
+        transaction.buy_order.quantity = 0
+        self.refresh(transaction)
+
+    def apply(self, fills: list[Fill]) -> None:
+        """records fills of orders that were registered with an order id"""
+
+        for fill in fills:
+            transaction: Optional[Transaction] = self.by_order.get(fill.order_id)
+            if transaction is None:
+                continue
+            if fill.side == "buys":
+                transaction.held += fill.amount
+            else:
+                transaction.profit += fill.profit
+                self.realized_profit += fill.profit
+            self.refresh(transaction)
+
+    def refresh(self, transaction: Transaction) -> None:
+        """brings the indexes and the capital at risk up to date with the orders of <transaction>"""
+
+        status: str = _status(transaction)
+        if status != transaction.status:
+            self.by_status[transaction.status].discard(transaction)
+            transaction.status = status
+            if status != "completed":
+                self.by_status[status].add(transaction)
+        risk: int = 0 if status == "completed" else _capital_at_risk(transaction)
+        self.capital_at_risk += risk - self._risk.get(transaction, 0)
+        if status == "completed":
+            self._close(transaction)
+        else:
+            self._risk[transaction] = risk
+
+    def _close(self, transaction: Transaction) -> None:
+        self.completed += 1
+        del self.by_age[transaction], self._risk[transaction]
+        item_transactions: set[Transaction] = self.by_item[transaction.item_id]
+        item_transactions.discard(transaction)
+        if len(item_transactions) == 0:
+            del self.by_item[transaction.item_id]
+        for order_id in self._order_ids.pop(transaction):
+            del self.by_order[order_id]
+
+    def older_than(self, age: datetime.timedelta, time_now: datetime.datetime = None) -> Iterator[Transaction]:
+        """open transactions started more than <age> ago, oldest first"""
+
+        time_now = datetime.datetime.now() if time_now is None else time_now
+        for transaction in self.by_age:
+            if time_now - transaction.start_time <= age:
+                break
+            yield transaction
+
+    def stale_orders(self, rows: np.ndarray) -> tuple[list[Transaction], list[Transaction]]:
+        """finds the transactions whose buy order was outbid or whose sell order was undercut, according to the
+        current prices of <state>. only the items of <rows> (e.g. the rows whose prices changed in the latest refresh)
+        are looked at. returns (outbid, undercut)"""
+
+        item_ids: set[int] = self.by_item.keys() & self.state.ids[rows].tolist()
+        outbid: list[Transaction] = []
+        undercut: list[Transaction] = []
+        for item_id in item_ids:
+            row: int = self.state.id_to_index[item_id]
+            buy_price: int = int(self.state.buy_price[row])
+            sell_price: int = int(self.state.sell_price[row])
+            for transaction in self.by_item[item_id]:
+                if transaction.buy_order.quantity > 0 and transaction.buy_order.listing_price < buy_price:
+                    outbid.append(transaction)
+                sell_order: Optional[SellOrder] = transaction.sell_order
+                if sell_order is not None and sell_order.quantity > 0 and 0 < sell_price < sell_order.listing_price:
+                    undercut.append(transaction)
+        return outbid, undercut
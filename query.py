@@ -0,0 +1,110 @@
+import bisect
+
+import numpy as np
+
+from market_state import MarketState
+
+Key = str | tuple[str, int]  # a field of MarketState, or a per-period field and its stats period column
+
+PRICE_FIELDS: tuple[str, ...] = ("buy_price", "sell_price", "spread", "supply", "demand")
+PERIOD_FIELDS: tuple[str, ...] = ("buys", "sells")
+
+
+class _SortedIndex(object):
+    """the rows of a state sorted by the value of a single field"""
+
+    def __init__(self, values: np.ndarray):
+        self.rows: np.ndarray = np.argsort(values, kind="stable")
+        self.values: np.ndarray = values[self.rows]
+        self._stale: np.ndarray = np.zeros(len(values), dtype=bool)
+
+    def update(self, rows: np.ndarray, values: np.ndarray) -> None:
+        """moves <rows> to the positions of their new <values>. the other rows stay sorted, so instead of sorting
+        everything again only the new values are sorted and merged in"""
+
+        self._stale[rows] = True
+        keep: np.ndarray = ~self._stale[self.rows]
+        self._stale[rows] = False
+        kept_values: np.ndarray = self.values[keep]
+        order: np.ndarray = np.argsort(values, kind="stable")
+        positions: np.ndarray = np.searchsorted(kept_values, values[order], side="right")
+        self.values = np.insert(kept_values, positions, values[order])
+        self.rows = np.insert(self.rows[keep], positions, rows[order])
+
+    def range(self, low=None, high=None) -> np.ndarray:
+        start: int = 0 if low is None else int(np.searchsorted(self.values, low, side="left"))
+        stop: int = len(self.values) if high is None else int(np.searchsorted(self.values, high, side="right"))
+        return self.rows[start:stop]
+
+
+class ItemIndex(object):
+    """secondary indexes over the items of a MarketState: every field of PRICE_FIELDS and every stats period of the
+    fields of PERIOD_FIELDS is kept sorted, so a range of values is found by binary search instead of by going through
+    every item. names are kept sorted as well, for prefix search.
+    <update> has to be called with the rows of every refresh (the rows that were polled, not only the ones that
+    changed, as the weighted stats of every polled row decay). results are arrays of rows of the state"""
+
+    def __init__(self, state: MarketState):
+        self.state: MarketState = state
+        self.indexes: dict[Key, _SortedIndex] = {key: _SortedIndex(self._values(key)) for key in self.keys()}
+        # (lowercased name, row) of every item, sorted by name
+        self.names: list[tuple[str, int]] = sorted((name.lower(), row) for row, name in enumerate(state.names))
+
+    def keys(self) -> list[Key]:
+        return [*PRICE_FIELDS,
+                *((field, col) for field in PERIOD_FIELDS for col in range(len(self.state.stats_period)))]
+
+    def _values(self, key: Key, rows: np.ndarray = None) -> np.ndarray:
+        rows = slice(None) if rows is None else rows
+        if key == "spread":
+            return self.state.sell_price[rows] - self.state.buy_price[rows]
+        if isinstance(key, tuple):
+            field, col = key
+            return getattr(self.state, field)[rows, col]
+        return getattr(self.state, key)[rows]
+
+    def update(self, rows: np.ndarray) -> None:
+        """brings the indexes up to date with the current values of <rows>"""
+
+        rows = np.unique(rows)
+        for key, index in self.indexes.items():
+            index.update(rows, self._values(key, rows))
+
+    def range(self, key: Key, low=None, high=None) -> np.ndarray:
+        """rows whose value of <key> is within [<low>, <high>], sorted by it. a bound of None is open"""
+
+        return self.indexes[key].range(low, high)
+
+    def where(self, col: int = None, **bounds: tuple) -> np.ndarray:
+        """rows that are within all of <bounds>, e.g. where(sell_price=(100, 2000), sells=(5, None), col=2). every
+        bound is a (low, high) pair as in <range>, the ones of PERIOD_FIELDS are looked at in the stats period column
+        <col>, which is required if there are any. only the most selective bound is looked up in its index, the others
+        are checked on the rows it returned"""
+
+        if len(bounds) == 0:
+            return np.arange(len(self.state))
+        if col is None and any(field in PERIOD_FIELDS for field in bounds):
+            raise ValueError(f"bounds on any of {PERIOD_FIELDS} need the stats period column <col>")
+        keys: list[Key] = [(field, col) if field in PERIOD_FIELDS else field for field in bounds]
+        candidates: list[np.ndarray] = [self.range(key, *bound) for key, bound in zip(keys, bounds.values())]
+        best: int = min(range(len(candidates)), key=lambda i: len(candidates[i]))
+        rows: np.ndarray = candidates[best]
+        for i, (key, (low, high)) in enumerate(zip(keys, bounds.values())):
+            if i == best:
+                continue
+            values: np.ndarray = self._values(key, rows)
+            keep: np.ndarray = np.ones(len(rows), dtype=bool)
+            if low is not None:
+                keep &= values >= low
+            if high is not None:
+                keep &= values <= high
+            rows = rows[keep]
+        return rows
+
+    def prefix(self, text: str) -> np.ndarray:
+        """rows of the items whose name starts with <text>, ignoring case, sorted by name"""
+
+        text = text.lower()
+        start: int = bisect.bisect_left(self.names, (text,))
+        stop: int = bisect.bisect_left(self.names, (text + "\U0010ffff",))
+        return np.array([row for _, row in self.names[start:stop]], dtype=np.int64)
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+
+class TokenBucket(object):
+    """token bucket used to pace requests to the api. tokens refill continuously at <rate> per second up to
+    <capacity>, every request has to take one token before it is sent. a full bucket allows bursts of up to <capacity>
+    requests, which is what lets a full refresh go through in a few seconds while still respecting the rate limit on
+    average"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate: float = rate  # tokens added per second
+        self.capacity: int = capacity  # maximum number of tokens the bucket can hold
+        self.tokens: float = capacity
+        self.last_refill: float = time.monotonic()
+        self.blocked_until: float = 0.0  # set by <penalize>, no tokens are handed out before this point in time
+
+    @classmethod
+    def per_minute(cls, requests_per_minute: int) -> "TokenBucket":
+        """creates a bucket sized to a "x requests per minute" rate limit like the one of the gw2 api"""
+
+        return cls(requests_per_minute / 60, requests_per_minute)
+
+    def _refill(self, time_now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (time_now - self.last_refill) * self.rate)
+        self.last_refill = time_now
+
+    def try_acquire(self) -> float:
+        """takes a token if one is available and returns 0. otherwise returns the number of seconds to wait before
+        trying again"""
+
+        time_now: float = time.monotonic()
+        if time_now < self.blocked_until:
+            return self.blocked_until - time_now
+        self._refill(time_now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self) -> None:
+        """waits until a token is available and takes it"""
+
+        wait_time: float = self.try_acquire()
+        while wait_time > 0:
+            await asyncio.sleep(wait_time)
+            wait_time = self.try_acquire()
+
+    def penalize(self, seconds: float) -> None:
+        """empties the bucket and stops handing out tokens for <seconds>. used when the api answers with 429, since
+        that means our idea of the remaining budget was off and everyone has to back off, not just a single request"""
+
+        time_now: float = time.monotonic()
+        self.tokens = 0.0
+        self.last_refill = time_now + seconds
+        self.blocked_until = max(self.blocked_until, time_now + seconds)
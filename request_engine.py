@@ -0,0 +1,143 @@
+import asyncio
+import time
+from concurrent.futures.thread import ThreadPoolExecutor
+from typing import AsyncIterator, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests import Response
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+from rate_limit import TokenBucket
+from retry import Backoff, CircuitBreaker
+
+
+class RequestEngine(object):
+    """asyncio based engine to execute many requests against the api at once. all requests go through a single
+    requests.Session, so connections are pooled and kept alive between requests and refreshes. the number of requests
+    in flight is limited by <max_concurrency> and every request has to take a token from a shared TokenBucket first.
+    the blocking io of requests is run on a dedicated thread pool of the same size as the connection pool"""
+
+    RETRY_STATUS_CODES: tuple[int, ...] = (429, 500, 502, 503, 504)
+    DEFAULT_429_BACKOFF: float = 10.0  # seconds to back off on a 429 if the api doesn't send a Retry-After header
+
+    def __init__(self, max_concurrency: int = 16, requests_per_minute: int = 600, max_retry_count: int = 10,
+                 timeout: float = 30.0, session: requests.Session = None, max_retry_time: float = 60.0):
+        self.max_concurrency: int = max_concurrency
+        self.max_retry_count: int = max_retry_count
+        self.max_retry_time: float = max_retry_time  # seconds a request may keep being retried for
+        self.backoff: Backoff = Backoff()
+        self.breaker: CircuitBreaker = CircuitBreaker()
+        self.timeout: float = timeout
+        self.bucket: TokenBucket = TokenBucket.per_minute(requests_per_minute)
+        self.session: requests.Session = requests.Session() if session is None else session
+        adapter: HTTPAdapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=max_concurrency,
+                                                               thread_name_prefix="api_request")
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+    async def _send(self, url: str, args: dict[str, str], semaphore: asyncio.Semaphore,
+                    headers: dict[str, str] = None) -> Response:
+        """sends a single request once the rate limit and the concurrency limit allow it"""
+
+        endpoint: str = urlsplit(url).path
+        queued: float = time.perf_counter()
+        await self.bucket.acquire()
+        async with semaphore:
+            sent: float = time.perf_counter()
+            METRICS.observe("api_wait_seconds", sent - queued, endpoint=endpoint)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    self.executor, lambda: self.session.get(url, params=args, headers=headers, timeout=self.timeout))
+            finally:
+                METRICS.observe("api_request_seconds", time.perf_counter() - sent, endpoint=endpoint)
+
+    async def fetch(self, url: str, args: dict[str, str], semaphore: asyncio.Semaphore,
+                    headers: dict[str, str] = None) -> Optional[Response]:
+        """requests <url> with <args>, retrying on timeouts, connection errors and the status codes in
+        RETRY_STATUS_CODES with jittered exponential backoff. a 429 empties the shared token bucket so every other
+        request backs off as well, instead of only this one. failures trip the shared circuit breaker, while it is open
+        requests fail right away. returns None if no usable response could be obtained within <max_retry_count> tries
+        and <max_retry_time> seconds, the caller can try again later instead of waiting any longer"""
+
+        endpoint: str = urlsplit(url).path
+        give_up_at: float = time.monotonic() + self.max_retry_time
+        for try_count in range(self.max_retry_count):
+            if not self.breaker.allow():
+                METRICS.inc("api_short_circuited", endpoint=endpoint)
+                return None
+            try:
+                response: Response = await self._send(url, args, semaphore, headers)
+            except requests.RequestException as e:
+                print(f"request to {url} failed with {type(e).__name__}. Will try to repeat the request")
+                METRICS.inc("api_errors", endpoint=endpoint, error=type(e).__name__)
+                self.breaker.record_failure()
+            else:
+                METRICS.inc("api_responses", endpoint=endpoint, status=str(response.status_code))
+                if response.status_code not in self.RETRY_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                print(f"got status code {response.status_code}. Will try to repeat the request")
+                if response.status_code == 429:
+                    # Too Many Requests. the whole engine has to slow down, not just this request. the api is fine
+                    # though, so this doesn't count against the circuit breaker
+                    self.breaker.record_neutral()
+                    retry_after: str = response.headers.get("retry-after", "")
+                    penalty: float = float(retry_after) if retry_after.isdigit() else self.DEFAULT_429_BACKOFF
+                    self.bucket.penalize(penalty)
+                    # the retry has to wait for the bucket to refill, which may take longer than there is time left
+                    if time.monotonic() + penalty > give_up_at:
+                        break
+                    METRICS.inc("api_retries", endpoint=endpoint)
+                    continue
+                self.breaker.record_failure()
+
+            # give the server a bit of time to get things in order
+            delay: float = self.backoff.delay(try_count)
+            if time.monotonic() + delay > give_up_at:
+                break
+            METRICS.inc("api_retries", endpoint=endpoint)
+            await asyncio.sleep(delay)
+
+        print(f"couldn't get a proper response from {url}, giving up on it for now")
+        METRICS.inc("api_failed_requests", endpoint=endpoint)
+        return None
+
+    async def fetch_all(self, url: str, arg_list: list[dict[str, str]],
+                        headers: dict[str, str] = None) -> list[Optional[Response]]:
+        """requests <url> once for every element of <arg_list> concurrently. the responses are returned in the order of
+        <arg_list>, a slow request only delays its own result as all requests are in flight at the same time"""
+
+        semaphore: asyncio.Semaphore = self.semaphore()
+        return list(await asyncio.gather(*(self.fetch(url, args, semaphore, headers) for args in arg_list)))
+
+    def semaphore(self) -> asyncio.Semaphore:
+        """a fresh concurrency limit for the running event loop. requests sharing it share the limit"""
+
+        return asyncio.Semaphore(self.max_concurrency)
+
+    async def iter_completed(self, url: str, arg_list: list[dict[str, str]], semaphore: asyncio.Semaphore = None) \
+            -> AsyncIterator[tuple[int, Optional[Response]]]:
+        """like <fetch_all>, but yields (index into arg_list, response) tuples as soon as the individual requests
+        complete. several iterations running at the same time can share a <semaphore> to stay within max_concurrency
+        together"""
+
+        semaphore = self.semaphore() if semaphore is None else semaphore
+
+        async def indexed_fetch(index: int, args: dict[str, str]) -> tuple[int, Optional[Response]]:
+            return index, await self.fetch(url, args, semaphore)
+
+        for future in asyncio.as_completed([indexed_fetch(i, args) for i, args in enumerate(arg_list)]):
+            yield await future
+
+    def run_all(self, url: str, arg_list: list[dict[str, str]],
+                headers: dict[str, str] = None) -> list[Optional[Response]]:
+        """blocking wrapper around <fetch_all> for callers that don't run an event loop themselves"""
+
+        return asyncio.run(self.fetch_all(url, arg_list, headers))
@@ -0,0 +1,60 @@
+import random
+import time
+
+
+class Backoff(object):
+    """exponential backoff with full jitter: the <attempt>th retry waits a random time between 0 and
+    base * 2^attempt, capped at <cap>. the jitter keeps requests that failed together from retrying together"""
+
+    def __init__(self, base: float = 0.5, cap: float = 30.0, rng: random.Random = None):
+        self.base: float = base
+        self.cap: float = cap
+        self.rng: random.Random = random.Random() if rng is None else rng
+
+    def delay(self, attempt: int) -> float:
+        return self.rng.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+class CircuitBreaker(object):
+    """stops sending requests to an api that keeps failing. after <failure_threshold> failures in a row the circuit
+    opens and every request fails right away for <reset_timeout> seconds. after that a single probe request is let
+    through (half open): if it succeeds the circuit closes again, if it fails it stays open for another
+    <reset_timeout>"""
+
+    def __init__(self, failure_threshold: int = 10, reset_timeout: float = 30.0):
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self.failures: int = 0  # in a row
+        self.opened_at: float = 0.0  # monotonic time the circuit (last) opened at
+        self.probing: bool = False  # a probe request is in flight
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.failure_threshold:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_timeout or self.probing else "half_open"
+
+    def allow(self) -> bool:
+        """whether a request may be sent now"""
+
+        state: str = self.state
+        if state == "half_open":
+            self.probing = True
+            return True
+        return state == "closed"
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.probing = False
+
+    def record_neutral(self) -> None:
+        """a response that says nothing about the health of the api (e.g. a 429). settles a probe in flight without
+        counting towards either side, so the next request probes again"""
+
+        self.probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
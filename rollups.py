@@ -0,0 +1,117 @@
+import numpy as np
+
+from market_state import MarketState
+
+OPEN, HIGH, LOW, CLOSE = range(4)
+
+# a single bar of a single item, as returned by Rollups.bars
+BAR_DTYPE: np.dtype = np.dtype([
+    ("start", "<i8"),  # posix time the bar starts at
+    ("buy_open", "<i4"),
+    ("buy_high", "<i4"),
+    ("buy_low", "<i4"),
+    ("buy_close", "<i4"),
+    ("sell_open", "<i4"),
+    ("sell_high", "<i4"),
+    ("sell_low", "<i4"),
+    ("sell_close", "<i4"),
+    ("sold", "<i4"),  # sold into buy orders during the bar, see MarketState.filled_amounts
+    ("bought", "<i4"),  # bought from sell listings during the bar
+])
+
+
+class _Ring(object):
+    """the bars of a single resolution, the latest <slots> of every row. bar number b (counting <resolution> long
+    bars from the epoch) lives in slot b % slots, so a new bar simply overwrites the one it replaces"""
+
+    def __init__(self, n: int, resolution: int, slots: int):
+        self.resolution: int = resolution  # seconds per bar
+        self.slots: int = slots
+        self.bar: np.ndarray = np.full((n, slots), -1, dtype=np.int32)  # bar number in each slot, -1 if empty
+        self.prices: np.ndarray = np.zeros((n, slots, 2, 4), dtype=np.int32)  # (buy, sell) x (open, high, low, close)
+        self.volume: np.ndarray = np.zeros((n, slots, 2), dtype=np.int32)  # (sold, bought)
+
+    def grow(self, n: int) -> None:
+        """adds empty rows up to <n> rows"""
+
+        added: int = n - len(self.bar)
+        self.bar = np.concatenate([self.bar, np.full((added, self.slots), -1, dtype=np.int32)])
+        self.prices = np.concatenate([self.prices, np.zeros((added,) + self.prices.shape[1:], dtype=np.int32)])
+        self.volume = np.concatenate([self.volume, np.zeros((added,) + self.volume.shape[1:], dtype=np.int32)])
+
+    def fold(self, rows: np.ndarray, time_now: float, prices: np.ndarray, volume: np.ndarray) -> None:
+        bar: int = int(time_now // self.resolution)
+        slot: int = bar % self.slots
+        # rows seen for the first time in this bar start it from the current prices, overwriting the old bar
+        fresh: np.ndarray = self.bar[rows, slot] != bar
+        fresh_rows: np.ndarray = rows[fresh]
+        self.bar[fresh_rows, slot] = bar
+        self.prices[fresh_rows, slot] = prices[fresh][:, :, None]
+        self.volume[fresh_rows, slot] = 0
+
+        bars: np.ndarray = self.prices[rows, slot]
+        bars[:, :, HIGH] = np.maximum(bars[:, :, HIGH], prices)
+        bars[:, :, LOW] = np.minimum(bars[:, :, LOW], prices)
+        bars[:, :, CLOSE] = prices
+        self.prices[rows, slot] = bars
+        self.volume[rows, slot] += volume
+
+
+class Rollups(object):
+    """OHLC bars of the buy and sell price and volume bars of the inferred fills of every item of a MarketState, at
+    several resolutions. every resolution keeps a fixed number of bars per item in a ring buffer, so memory stays
+    bounded and folding in a refresh costs the same no matter how much history there is.
+    <fold> is to be called with the rows of every refresh, after the state was updated (with the prices and the
+    listings). it reads the prices and the latest filled amounts straight from the state, so it works the same on a
+    state that is updated by a ShardPool. a row that wasn't refreshed during a bar has no bar for it"""
+
+    # seconds per bar -> bars kept per item: 3 hours of 2 minute bars, a day of 15 minute bars, a week of hourly bars
+    # and 3 months of daily bars. every bar takes 44 bytes per item
+    RESOLUTIONS: dict[int, int] = {120: 90, 900: 96, 3600: 168, 86400: 90}
+
+    def __init__(self, state: MarketState, resolutions: dict[int, int] = None):
+        self.state: MarketState = state
+        self.rings: dict[int, _Ring] = {resolution: _Ring(len(state), resolution, slots) for resolution, slots
+                                        in (self.RESOLUTIONS if resolutions is None else resolutions).items()}
+
+    def extend(self, state: MarketState) -> None:
+        """follows the state to <state>, a MarketState.extended version of it. the new rows start without any bars"""
+
+        self.state = state
+        for ring in self.rings.values():
+            ring.grow(len(state))
+
+    def fold(self, rows: np.ndarray, time_now: float) -> None:
+        """folds the current prices and the latest filled amounts of <rows> into the bars <time_now> falls into"""
+
+        prices: np.ndarray = np.stack((self.state.buy_price[rows], self.state.sell_price[rows]), axis=1) \
+            .astype(np.int32)
+        volume: np.ndarray = np.stack((self.state.last_sold[rows], self.state.last_bought[rows]), axis=1) \
+            .astype(np.int32)
+        for ring in self.rings.values():
+            ring.fold(rows, time_now, prices, volume)
+
+    def bars(self, item_id: int, resolution: int, start: float = None, end: float = None) -> np.ndarray:
+        """the bars of <item_id> at <resolution> (seconds per bar) that start within [<start>, <end>), oldest first, as
+        an array of BAR_DTYPE records"""
+
+        ring: _Ring = self.rings[resolution]
+        row: int = self.state.id_to_index[item_id]
+        bar: np.ndarray = ring.bar[row].astype(np.int64)
+        bar_start: np.ndarray = bar * ring.resolution
+        keep: np.ndarray = bar >= 0
+        if start is not None:
+            keep &= bar_start >= start
+        if end is not None:
+            keep &= bar_start < end
+        slots: np.ndarray = np.flatnonzero(keep)
+        slots = slots[np.argsort(bar[slots])]
+
+        records: np.ndarray = np.zeros(len(slots), dtype=BAR_DTYPE)
+        records["start"] = bar_start[slots]
+        for side, prefix in enumerate(("buy", "sell")):
+            for column, name in enumerate(("open", "high", "low", "close")):
+                records[f"{prefix}_{name}"] = ring.prices[row, slots, side, column]
+        records["sold"] = ring.volume[row, slots, 0]
+        records["bought"] = ring.volume[row, slots, 1]
+        return records
@@ -0,0 +1,90 @@
+import math
+import time
+
+import numpy as np
+
+from api_handler import ApiHandler
+from market_state import MarketState
+
+
+class RefreshScheduler(object):
+    """decides which items to poll in each tick. instead of refreshing every item every REFRESH_TIME, each item gets
+    its own refresh interval from a priority derived from its trading activity and the value of its best flip. the
+    intervals are scaled so that on average the same number of items is polled as with a full refresh every
+    REFRESH_TIME, i.e. the request volume doesn't change, it is just spent on the items that matter.
+    the weighted stats of MarketState already account for the time since the last update of each item, so items being
+    polled at different rates need no special treatment there"""
+
+    TICK_TIME: int = 30  # seconds between two ticks
+    MIN_INTERVAL: int = 30  # no item is polled more often than this
+    MAX_INTERVAL: int = 1800  # and none less often than this
+    BASE_PRIORITY: float = 1.0  # priority of an item without any activity or flip value
+
+    def __init__(self, state: MarketState, refresh_time: int = ApiHandler.REFRESH_TIME, tick_time: int = None):
+        self.state: MarketState = state
+        self.refresh_time: int = refresh_time  # the budget is the one of a full refresh every <refresh_time>
+        self.tick_time: int = self.TICK_TIME if tick_time is None else tick_time
+        self.priority: np.ndarray = np.full(len(state), self.BASE_PRIORITY)
+        self.interval: np.ndarray = np.full(len(state), float(refresh_time))  # refresh interval of each row
+        # posix time each row is due again, from the latest data we have of it
+        self.next_due: np.ndarray = np.minimum(state.prices_timestamp, state.listings_timestamp) + self.interval
+
+    @property
+    def budget(self) -> int:
+        """items polled per tick. rounded up to whole requests, a partially filled request costs as much as a full
+        one"""
+
+        items: int = math.ceil(len(self.state) * self.tick_time / self.refresh_time)
+        return min(len(self.state), math.ceil(items / ApiHandler.MAX_PAGE_SIZE) * ApiHandler.MAX_PAGE_SIZE)
+
+    def reprioritize(self, flip_value: np.ndarray) -> None:
+        """recalculates the priority and refresh interval of every item from its stats and the profit of its best flip
+        (<flip_value>, one per row). should be called after every tick"""
+
+        state: MarketState = self.state
+        # shortest stats period, it reacts the fastest to an item picking up or dying down
+        activity: np.ndarray = np.log1p(state.buys[:, 0] + state.sells[:, 0])
+        price: np.ndarray = np.maximum(1, state.buy_price + state.sell_price)
+        volatility: np.ndarray = np.log1p(100 * (np.abs(state.buy_price_delta[:, 0])
+                                                 + np.abs(state.sell_price_delta[:, 0])) / price)
+        value: np.ndarray = np.log1p(np.maximum(0, flip_value) / 10_000)
+        self.priority = self.BASE_PRIORITY + activity + volatility + value
+        if len(state) == 0:
+            # nothing to schedule, e.g. before the first catalogue refresh succeeded
+            return
+
+        # interval = scale / priority, clipped to [MIN_INTERVAL, MAX_INTERVAL]. the total poll rate sum(1 / interval)
+        # falls with the scale, so the scale matching the budget can be found by bisection (on a log scale)
+        target_rate: float = len(state) / self.refresh_time
+        low: float = math.log(self.MIN_INTERVAL * self.priority.min())
+        high: float = math.log(self.MAX_INTERVAL * self.priority.max())
+        for _ in range(50):
+            scale: float = math.exp((low + high) / 2)
+            rate: float = (1 / np.clip(scale / self.priority, self.MIN_INTERVAL, self.MAX_INTERVAL)).sum()
+            if rate > target_rate:
+                low = math.log(scale)
+            else:
+                high = math.log(scale)
+        interval: np.ndarray = np.clip(math.exp(high) / self.priority, self.MIN_INTERVAL, self.MAX_INTERVAL)
+        # move the due times of the items whose interval changed along with it
+        self.next_due += interval - self.interval
+        self.interval = interval
+
+    def due(self, time_now: float = None) -> np.ndarray:
+        """rows to poll in this tick. the rows that are the most overdue relative to their interval go first, at most
+        <budget> of them. returned sorted, so the ids are in the same order as in a full refresh"""
+
+        time_now = time.time() if time_now is None else time_now
+        # rows due before the middle of the next tick are closer to this one, polling them late would use less of
+        # the budget than intended
+        overdue: np.ndarray = (time_now + self.tick_time / 2 - self.next_due) / self.interval
+        rows: np.ndarray = np.flatnonzero(overdue >= 0)
+        if len(rows) > self.budget:
+            rows = rows[np.argpartition(overdue[rows], len(rows) - self.budget)[len(rows) - self.budget:]]
+        return np.sort(rows)
+
+    def polled(self, rows: np.ndarray, time_now: float = None) -> None:
+        """to be called with the rows that were polled in a tick"""
+
+        time_now = time.time() if time_now is None else time_now
+        self.next_due[rows] = time_now + self.interval[rows]
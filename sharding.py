@@ -0,0 +1,267 @@
+import atexit
+import multiprocessing
+import os
+import time
+import traceback
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Any
+
+import numpy as np
+
+from flip_engine import FlipBatch
+from item import Flip
+from leaderboard import FlipLeaderboard
+from market_state import MarketState, pack_ladders
+from payload_decoder import ItemPricesTuple, ItemListingsTuple
+
+ArraySpec = dict[str, tuple[str, tuple[int, ...], str]]  # name -> (shared memory block, shape, dtype)
+
+
+class SharedArrays(object):
+    """numpy arrays living in named shared memory blocks, one block per array. the blocks are created by one process
+    and attached to by name in the others, see <spec> and <attach>"""
+
+    def __init__(self):
+        self.blocks: dict[str, SharedMemory] = {}
+        self.arrays: dict[str, np.ndarray] = {}
+
+    def create(self, name: str, shape: tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        # a block can't be empty, so zero-sized arrays still get a byte
+        block: SharedMemory = SharedMemory(create=True, size=max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize))
+        self.blocks[name] = block
+        self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        self.arrays[name][...] = 0
+        return self.arrays[name]
+
+    def spec(self) -> ArraySpec:
+        return {name: (self.blocks[name].name, array.shape, array.dtype.str) for name, array in self.arrays.items()}
+
+    @classmethod
+    def attach(cls, spec: ArraySpec) -> "SharedArrays":
+        shared: SharedArrays = cls()
+        for name, (block_name, shape, dtype) in spec.items():
+            block: SharedMemory = SharedMemory(name=block_name)
+            shared.blocks[name] = block
+            shared.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return shared
+
+    def close(self, unlink: bool = False) -> None:
+        # views onto a block have to be gone before it can be closed
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+        self.blocks.clear()
+
+
+def _inbox_arrays(shared: SharedArrays, n: int, depth: int) -> None:
+    """creates the arrays the latest api data of every row is passed to the shards in"""
+
+    shared.create("inbox.prices", (n, len(ItemPricesTuple._fields)), np.int64)
+    shared.create("inbox.prices_present", (n,), np.bool_)
+    shared.create("inbox.buy_ladder", (n, depth, 3), np.int32)
+    shared.create("inbox.buy_depth", (n,), np.int16)
+    shared.create("inbox.sell_ladder", (n, depth, 3), np.int32)
+    shared.create("inbox.sell_depth", (n,), np.int16)
+    shared.create("inbox.listings_present", (n,), np.bool_)
+
+
+def _candidates(leaderboard: FlipLeaderboard, start: int) -> tuple[np.ndarray, dict[str, np.ndarray]]:
+    """the (global) rows and flips of every item that is in the local top-k of a ranking key"""
+
+    rows: np.ndarray = np.unique(np.concatenate([leaderboard.ranking(key)[0] for key in leaderboard.RANKING_KEYS]))
+    return rows + start, {field: getattr(leaderboard.flip_batch, field)[rows] for field in FlipBatch.FIELDS}
+
+
+def _shard_worker(connection: Connection, spec: ArraySpec, start: int, stop: int,
+                  params: list[tuple[int, float, int]], k: int) -> None:
+    """main loop of a shard process. owns the rows start:stop of the shared MarketState and scores them on request"""
+
+    shared: SharedArrays = SharedArrays.attach(spec)
+    full_state: MarketState = MarketState.__new__(MarketState)
+    for name, array in shared.arrays.items():
+        if name.startswith("state."):
+            setattr(full_state, name[len("state."):], array)
+    full_state.names = [""] * len(full_state.ids)  # names aren't needed for scoring
+    full_state.id_to_index = {}
+    state: MarketState = full_state.view(start, stop)
+    inbox: dict[str, np.ndarray] = {name[len("inbox."):]: array[start:stop] for name, array in shared.arrays.items()
+                                    if name.startswith("inbox.")}
+    leaderboard: FlipLeaderboard = FlipLeaderboard(state, params, k)
+    connection.send(("ready", None))
+
+    while True:
+        command, time_now = connection.recv()
+        try:
+            if command == "stop":
+                break
+            elif command == "refresh":
+                rows: np.ndarray = np.flatnonzero(inbox["prices_present"])
+                changed_prices: np.ndarray = state.update_packed_prices(rows, inbox["prices"][rows], time_now)
+                rows = np.flatnonzero(inbox["listings_present"])
+                changed_listings: np.ndarray = state.update_packed_listings(
+                    rows, inbox["buy_ladder"][rows], inbox["buy_depth"][rows], inbox["sell_ladder"][rows],
+                    inbox["sell_depth"][rows], time_now)
+                changed_rows: np.ndarray = np.union1d(changed_prices, changed_listings)
+                leaderboard.update(changed_rows)
+                connection.send(("done", (changed_rows + start, *_candidates(leaderboard, start))))
+            elif command == "rescore":
+                leaderboard.rescore()
+                connection.send(("done", (np.empty(0, dtype=np.int64), *_candidates(leaderboard, start))))
+        except Exception:
+            connection.send(("error", traceback.format_exc()))
+    del state, full_state, inbox, leaderboard
+    shared.close()
+
+
+class ShardPool(object):
+    """scores a MarketState on several long-lived worker processes. the arrays of the state are moved into shared
+    memory and every worker owns a contiguous slice of its rows, updating and re-scoring only those. per refresh the
+    fresh api data is packed into shared memory as well, so nothing but a few control messages and the local top-k
+    flips of each shard are pickled. the state object passed in stays usable in this process (e.g. for checkpoints and
+    snapshots) and reflects the updates of the workers once <refresh> returns.
+    <ranking>, <top> and <flips> work like the ones of FlipLeaderboard, but the rows they refer to are rows of
+    <flip_batch>, which only holds the merged top-k candidates of the shards"""
+
+    RANKING_KEYS: tuple[str, ...] = FlipLeaderboard.RANKING_KEYS
+
+    def __init__(self, state: MarketState, params: list[tuple[int, float, int]], n_shards: int = None, k: int = 500):
+        self.state: MarketState = state
+        self.params: list[tuple[int, float, int]] = params
+        self.k: int = k
+        n_shards = min(os.cpu_count() if n_shards is None else n_shards, max(1, len(state)))
+
+        self.shared: SharedArrays = SharedArrays()
+        for name, value in list(state.__dict__.items()):
+            if isinstance(value, np.ndarray):
+                setattr(state, name, self.shared.create("state." + name, value.shape, value.dtype))
+                getattr(state, name)[...] = value
+        _inbox_arrays(self.shared, len(state), state.LADDER_DEPTH)
+        self.inbox: dict[str, np.ndarray] = {name[len("inbox."):]: array for name, array in self.shared.arrays.items()
+                                             if name.startswith("inbox.")}
+
+        bounds: list[int] = np.linspace(0, len(state), n_shards + 1).astype(int).tolist()
+        context = multiprocessing.get_context("spawn")
+        self.connections: list[Connection] = []
+        self.processes: list[multiprocessing.Process] = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            parent_connection, child_connection = context.Pipe()
+            process = context.Process(target=_shard_worker, daemon=True, name=f"shard-{start}-{stop}",
+                                      args=(child_connection, self.shared.spec(), start, stop, params, k))
+            process.start()
+            self.connections.append(parent_connection)
+            self.processes.append(process)
+        self._collect()
+        atexit.register(self.close)
+
+        self.flip_batch: Optional[FlipBatch] = None
+        self._rankings: dict[str, Optional[tuple[np.ndarray, np.ndarray]]] = {}
+        self.rescore()
+
+    def __len__(self) -> int:
+        return len(self.processes)
+
+    def _collect(self) -> list[Any]:
+        """waits for the reply of every shard. if any of them failed, the replies of the others are still read before
+        raising, so no stale reply is left in a pipe to be taken for the reply to the next command"""
+
+        replies: list[Any] = []
+        errors: list[str] = []
+        for connection in self.connections:
+            status, reply = connection.recv()
+            if status == "error":
+                errors.append(reply)
+            else:
+                replies.append(reply)
+        if len(errors) > 0:
+            raise RuntimeError(f"{len(errors)}/{len(self.connections)} shards failed:\n" + "\n".join(errors))
+        return replies
+
+    def _broadcast(self, command: str, time_now: float = None) -> np.ndarray:
+        """runs <command> on every shard, merges their candidates and returns the rows that changed"""
+
+        for connection in self.connections:
+            connection.send((command, time_now))
+        replies: list[tuple[np.ndarray, np.ndarray, dict[str, np.ndarray]]] = self._collect()
+        rows: np.ndarray = np.concatenate([candidate_rows for _, candidate_rows, _ in replies])
+        self.flip_batch = FlipBatch(self.state.ids[rows], rows, self.params,
+                                    **{field: np.concatenate([fields[field] for _, _, fields in replies])
+                                       for field in FlipBatch.FIELDS})
+        self._rankings = {key: None for key in self.RANKING_KEYS}
+        return np.concatenate([changed_rows for changed_rows, _, _ in replies])
+
+    def stage_prices(self, prices_list: list[Optional[ItemPricesTuple]]) -> None:
+        """packs <prices_list> into shared memory for the next <flush>. can be called several times per refresh, e.g.
+        for every chunk as it arrives"""
+
+        prices_list, rows = self.state._rows_of(prices_list)
+        self.inbox["prices_present"][rows] = True
+        self.inbox["prices"][rows] = np.array(prices_list, dtype=np.int64).reshape(len(rows), -1)
+
+    def stage_listings(self, listings_list: list[Optional[ItemListingsTuple]]) -> None:
+        """same as <stage_prices> for listings"""
+
+        listings_list, rows = self.state._rows_of(listings_list)
+        self.inbox["listings_present"][rows] = True
+        for side in ("buy", "sell"):
+            ladders, depths = pack_ladders([getattr(item_listings, side + "s") for item_listings in listings_list],
+                                           self.state.LADDER_DEPTH)
+            self.inbox[side + "_ladder"][rows] = ladders
+            self.inbox[side + "_depth"][rows] = depths
+
+    def flush(self, time_now: float = None) -> np.ndarray:
+        """updates every shard with the staged data and re-scores them. the whole refresh uses a single point in
+        time, so every shard weighs it the same. returns the rows whose prices or listings changed"""
+
+        time_now = time.time() if time_now is None else time_now
+        changed_rows: np.ndarray = self._broadcast("refresh", time_now)
+        self.inbox["prices_present"][:] = False
+        self.inbox["listings_present"][:] = False
+        return changed_rows
+
+    def refresh(self, prices_list: list[Optional[ItemPricesTuple]], listings_list: list[Optional[ItemListingsTuple]],
+                time_now: float = None) -> np.ndarray:
+        """see MarketState.update_prices and update_listings, <stage_prices>, <stage_listings> and <flush> in one go"""
+
+        self.stage_prices(prices_list)
+        self.stage_listings(listings_list)
+        return self.flush(time_now)
+
+    def rescore(self) -> None:
+        """re-scores every item on every shard, see FlipLeaderboard.rescore"""
+
+        self._broadcast("rescore")
+
+    def ranking(self, key: str = "expected_profit") -> tuple[np.ndarray, np.ndarray]:
+        """returns (rows, params) index arrays into <flip_batch> of the best flip of the top-k items according to
+        <key>, best first"""
+
+        if self._rankings[key] is None:
+            self._rankings[key] = self.flip_batch.top_k(self.k, key)
+        return self._rankings[key]
+
+    def top(self, k: int = None, key: str = "expected_profit") -> list[Flip]:
+        rows, params = self.ranking(key)
+        return [self.flip_batch.flip(row, param) for row, param in zip(rows[:k].tolist(), params[:k].tolist())]
+
+    def flips(self, row: int) -> tuple[Flip]:
+        return self.flip_batch.flips(row)
+
+    def close(self) -> None:
+        """stops the workers and moves the state back out of shared memory"""
+
+        if len(self.processes) == 0:
+            return
+        for connection in self.connections:
+            connection.send(("stop", None))
+        for process in self.processes:
+            process.join()
+        for name, value in list(self.state.__dict__.items()):
+            if isinstance(value, np.ndarray):
+                setattr(self.state, name, value.copy())
+        self.inbox.clear()
+        self.shared.close(unlink=True)
+        self.connections.clear()
+        self.processes.clear()
@@ -0,0 +1,65 @@
+import requests
+
+from api_handler import ApiHandler
+from benchmark import FixtureAdapter, Fixtures
+from request_engine import RequestEngine
+
+FIXTURES: Fixtures = Fixtures.synthetic(50)
+UNKNOWN_IDS: list[int] = [10 ** 9 + i for i in range(3)]
+
+
+class CountingAdapter(FixtureAdapter):
+    def __init__(self, fixtures: Fixtures):
+        super().__init__(fixtures)
+        self.requested_ids: list[int] = []
+
+    def send(self, request, **kwargs) -> requests.Response:
+        response: requests.Response = super().send(request, **kwargs)
+        self.requested_ids += [int(item_id) for item_id in request.url.split("ids=")[1].split("&")[0].split("%2C")]
+        return response
+
+
+def fixture_api() -> tuple[ApiHandler, CountingAdapter]:
+    adapter: CountingAdapter = CountingAdapter(FIXTURES)
+    session: requests.Session = requests.Session()
+    session.mount("http://fixtures/", adapter)
+    return ApiHandler("http://fixtures/", RequestEngine(requests_per_minute=10 ** 6, session=session)), adapter
+
+
+def test_invalid_ids_of_a_partial_response_are_blocked_for_a_while(monkeypatch):
+    api, adapter = fixture_api()
+    id_list: list[int] = FIXTURES.ids[:5] + UNKNOWN_IDS
+    prices = api.get_item_prices_tuples_by_id_list(id_list)
+    assert [item_prices is None for item_prices in prices] == [False] * 5 + [True] * 3
+    assert set(api.invalid_ids[api.base_url + "commerce/prices"]) == set(UNKNOWN_IDS)
+
+    adapter.requested_ids = []
+    assert api.get_item_prices_tuples_by_id_list(id_list) == prices
+    assert adapter.requested_ids == FIXTURES.ids[:5]
+
+    # once the block ran out, the ids are requested again
+    monkeypatch.setattr(ApiHandler, "INVALID_ID_TTL", -1.0)
+    api.invalid_ids.clear()
+    api.get_item_prices_tuples_by_id_list(UNKNOWN_IDS)
+    assert len(api.invalid_ids[api.base_url + "commerce/prices"]) == 3
+    adapter.requested_ids = []
+    api.get_item_prices_tuples_by_id_list(id_list)
+    assert sorted(adapter.requested_ids) == sorted(id_list)
+
+
+def test_all_invalid_chunk_is_blocked():
+    api, adapter = fixture_api()
+    assert api.get_item_listings_tuples_by_id_list(UNKNOWN_IDS) == [None] * 3
+    assert set(api.invalid_ids[api.base_url + "commerce/listings"]) == set(UNKNOWN_IDS)
+    adapter.requested_ids = []
+    api.get_item_listings_tuples_by_id_list(UNKNOWN_IDS)
+    assert adapter.requested_ids == []
+
+
+def test_listed_ids_are_unblocked():
+    api, adapter = fixture_api()
+    api.get_item_prices_tuples_by_id_list(UNKNOWN_IDS)
+    api.forget_invalid_ids(UNKNOWN_IDS[:1])
+    adapter.requested_ids = []
+    api.get_item_prices_tuples_by_id_list(UNKNOWN_IDS)
+    assert adapter.requested_ids == UNKNOWN_IDS[:1]
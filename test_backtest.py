@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from backtest import Backtest
+from db import TimeSeriesStore
+from market_state import MarketState
+
+START: int = 1_700_000_000
+
+
+def write_store(directory: str, n: int = 50, ticks: int = 20) -> TimeSeriesStore:
+    """a full snapshot of <n> items, followed by <ticks> ticks in which only a few of them change, like main writes"""
+
+    store: TimeSeriesStore = TimeSeriesStore(directory)
+    state: MarketState = MarketState(list(range(1, n + 1)))
+    state.buy_price[:] = 100
+    state.sell_price[:] = 150
+    state.demand[:] = 1000
+    state.supply[:] = 1000
+    store.append_state(state, tick=START)
+    for i in range(1, ticks + 1):
+        rows: np.ndarray = np.array([i % n, (i * 7) % n])
+        state.buy_price[rows] += 1
+        store.append_state(state, rows, START + 300 * i)
+    return store
+
+
+def test_start_tick_keeps_the_whole_universe(tmp_path):
+    store: TimeSeriesStore = write_store(str(tmp_path))
+    params: list[tuple[int, float, int]] = [(0, 0.5, 2_000_000)]
+    full: Backtest = Backtest(store, params, warmup=0)
+    full.run()
+    late: Backtest = Backtest(store, params, warmup=0)
+    late.run(START + 300 * 10)
+    assert len(late.state) == len(full.state) == 50
+    # seeded from the latest records before the start, both replays end up with the same prices
+    assert np.array_equal(late.state.buy_price, full.state.buy_price)
+
+
+def test_no_ticks_selected(tmp_path):
+    params: list[tuple[int, float, int]] = [(0, 0.5, 2_000_000)]
+    with pytest.raises(ValueError):
+        Backtest(TimeSeriesStore(str(tmp_path / "empty")), params).run()
+    with pytest.raises(ValueError):
+        Backtest(write_store(str(tmp_path / "full")), params).run(START + 10 ** 6)
@@ -0,0 +1,23 @@
+import numpy as np
+
+from checkpoint import load_checkpoint, write_checkpoint
+from market_state import MarketState
+
+
+def test_round_trip(tmp_path):
+    rng: np.random.Generator = np.random.default_rng(0)
+    state: MarketState = MarketState([3, 5, 8])
+    state.names = ["a", "b", "c"]
+    for name, value in state.__dict__.items():
+        if isinstance(value, np.ndarray) and name not in ("ids", "stats_period"):
+            value[...] = rng.integers(0, 1000, size=value.shape)
+    # the ladders are only kept up to their depth
+    state.buy_depth[:] = state.sell_depth[:] = MarketState.LADDER_DEPTH
+
+    path: str = str(tmp_path / "checkpoint.npz")
+    write_checkpoint(state, path)
+    restored: MarketState = load_checkpoint(path)
+    assert restored.names == state.names
+    for name, value in state.__dict__.items():
+        if isinstance(value, np.ndarray):
+            assert np.array_equal(getattr(restored, name), value), name
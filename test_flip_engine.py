@@ -0,0 +1,44 @@
+import numpy as np
+
+from flip_engine import FlipBatch, evaluate_flips
+from item import Item
+from market_state import MarketState
+
+PARAMS: list[tuple[int, float, int]] = [(col, out_bid_p, budget) for col in range(len(MarketState.STATS_PERIOD))
+                                        for out_bid_p in (0.2, 0.5) for budget in (10_000, 2_000_000)]
+
+
+def random_state(n: int = 500) -> MarketState:
+    """prices and stats spread wide enough to cover every branch of Item._get_flip"""
+
+    rng: np.random.Generator = np.random.default_rng(0)
+    state: MarketState = MarketState(list(range(1, n + 1)))
+    state.buy_price[:] = rng.integers(1, 5000, n)
+    state.sell_price[:] = state.buy_price + rng.integers(-100, 3000, n)
+    state.vendor_value[:] = np.where(rng.random(n) < 0.2, rng.integers(0, 3000, n), 0)
+    shape: tuple[int, int] = (n, len(state.stats_period))
+    state.buys[:] = np.where(rng.random(shape) < 0.2, 0, rng.random(shape) * 200)
+    state.sells[:] = np.where(rng.random(shape) < 0.2, 0, rng.random(shape) * 200)
+    state.buy_price_delta[:] = rng.normal(0, 2, shape)
+    state.sell_price_delta[:] = rng.normal(0, 2, shape)
+    return state
+
+
+def test_evaluate_flips_matches_get_flip():
+    state: MarketState = random_state()
+    batch: FlipBatch = evaluate_flips(state, PARAMS)
+    assert (batch.expected_profit > 0).any() and (batch.expected_profit == 0).any()
+    for row in range(len(state)):
+        expected = Item(state, row).get_flips(PARAMS)
+        for j, flip in enumerate(batch.flips(row)):
+            assert [getattr(flip, name) for name in flip.__slots__] \
+                == [getattr(expected[j], name) for name in flip.__slots__], (row, PARAMS[j])
+
+
+def test_evaluate_flips_of_some_rows():
+    state: MarketState = random_state()
+    rows: np.ndarray = np.array([3, 10, 250])
+    batch: FlipBatch = evaluate_flips(state, PARAMS, rows)
+    full: FlipBatch = evaluate_flips(state, PARAMS)
+    assert batch.ids.tolist() == state.ids[rows].tolist()
+    assert np.array_equal(batch.expected_profit, full.expected_profit[rows])
@@ -0,0 +1,91 @@
+import random
+
+import numpy as np
+import pytest
+
+from ladder_diff import BUYS, SELLS, diff_ladders
+from market_state import pack_ladders
+
+DEPTH: int = 10
+
+
+def merge_walk(old: list[tuple[int, int, int]], new: list[tuple[int, int, int]], side: int) -> int:
+    """the two-pointer walk of the original Item._update_listings, on (unit_price, quantity, listings) levels"""
+
+    removed: int = 0
+    i: int = 0
+    j: int = 0
+    while i < len(new) and j < len(old):
+        if new[i] == old[j]:
+            break
+        elif side * new[i][0] > side * old[j][0]:
+            i += 1
+        elif new[i][0] == old[j][0]:
+            removed += max(0, old[j][1] - new[i][1])
+            i += 1
+            j += 1
+        else:
+            removed += old[j][1]
+            j += 1
+    return removed
+
+
+def random_ladder(rng: random.Random, side: int) -> list[tuple[int, int, int]]:
+    price: int = rng.randint(20, 60)
+    ladder: list[tuple[int, int, int]] = []
+    for _ in range(rng.randint(0, DEPTH)):
+        ladder.append((price, rng.randint(1, 30), rng.randint(1, 4)))
+        price -= side * rng.randint(1, 3)
+        if price <= 0:
+            break
+    return ladder
+
+
+def mutate(rng: random.Random, ladder: list[tuple[int, int, int]], side: int) -> list[tuple[int, int, int]]:
+    """fills from the top, partial fills, cancels, new best levels and added quantity, each at random"""
+
+    ladder = list(ladder)
+    if rng.random() < 0.3 and ladder:
+        ladder = ladder[rng.randint(1, len(ladder)):]
+    if rng.random() < 0.5 and ladder:
+        i: int = rng.randrange(len(ladder))
+        price, quantity, listings = ladder[i]
+        ladder[i] = (price, max(1, quantity - rng.randint(0, quantity)), max(1, listings - rng.randint(0, 1)))
+    if rng.random() < 0.3 and ladder:
+        del ladder[rng.randrange(len(ladder))]
+    if rng.random() < 0.4:
+        top: int = (ladder[0][0] if ladder else 40) + side * rng.randint(1, 3)
+        if top > 0:
+            ladder.insert(0, (top, rng.randint(1, 30), rng.randint(1, 3)))
+    if rng.random() < 0.2:
+        ladder = [(price, quantity + rng.randint(0, 5), listings) for price, quantity, listings in ladder]
+    return ladder[:DEPTH]
+
+
+def pack(ladders: list[list[tuple[int, int, int]]]) -> tuple[np.ndarray, np.ndarray]:
+    return pack_ladders(ladders, DEPTH)
+
+
+@pytest.mark.parametrize("side", [BUYS, SELLS])
+def test_removed_matches_the_merge_walk(side):
+    rng: random.Random = random.Random(side)
+    old: list[list[tuple[int, int, int]]] = [random_ladder(rng, side) for _ in range(5000)]
+    new: list[list[tuple[int, int, int]]] = [mutate(rng, ladder, side) for ladder in old]
+    diff = diff_ladders(*pack(old), *pack(new), side)
+    assert diff.removed.tolist() == [merge_walk(a, b, side) for a, b in zip(old, new)]
+    assert (diff.filled >= 0).all() and (diff.cancelled >= 0).all()
+    assert np.array_equal(diff.filled + diff.cancelled, diff.removed)
+
+
+def test_only_levels_up_to_the_first_survivor_are_filled():
+    old: list[tuple[int, int, int]] = [(100, 5, 1), (99, 3, 1), (98, 4, 2)]
+    new: list[tuple[int, int, int]] = [(100, 2, 1), (98, 1, 1)]
+    diff = diff_ladders(*pack([old]), *pack([new]), BUYS)
+    assert (diff.removed[0], diff.filled[0], diff.cancelled[0]) == (9, 3, 6)
+
+
+def test_relisted_level_is_cancelled():
+    old: list[tuple[int, int, int]] = [(100, 5, 1), (99, 3, 1)]
+    new: list[tuple[int, int, int]] = [(101, 5, 1), (99, 3, 1)]
+    diff = diff_ladders(*pack([old]), *pack([new]), BUYS)
+    assert (diff.removed[0], diff.filled[0], diff.cancelled[0]) == (5, 0, 5)
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from flip_engine import FlipBatch
+from item import SharedTradingStats
+from optimizer import LISTING_SIZE, FlipPlan, optimize
+
+
+def random_batch(n: int = 2000, n_params: int = 3, seed: int = 0) -> FlipBatch:
+    rng: np.random.Generator = np.random.default_rng(seed)
+    fields: dict[str, np.ndarray] = {field: rng.integers(1, 1000, size=(n, n_params)) for field in FlipBatch.FIELDS}
+    fields["quantity"] = rng.integers(0, 3000, size=(n, n_params))
+    fields["expected_pph"] = rng.integers(-100, 5000, size=(n, n_params))
+    return FlipBatch(np.arange(1, n + 1), np.arange(n), [(j, 0.5, 2_000_000) for j in range(n_params)], **fields)
+
+
+@pytest.mark.parametrize("budget, listing_slots", [(2_000_000, 100), (50_000, 100), (10 ** 9, 7), (0, 100)])
+def test_plan_respects_the_constraints(budget, listing_slots):
+    flips: FlipBatch = random_batch()
+    plan: FlipPlan = optimize(flips, budget, listing_slots)
+    assert plan.capital.sum() <= budget
+    assert plan.listings.sum() <= listing_slots
+    # at most one flip per item, never more than the flip itself or the listings of a single item allow
+    assert len(np.unique(plan.rows)) == len(plan)
+    assert (plan.quantity > 0).all()
+    assert (plan.quantity <= flips.quantity[plan.rows, plan.params]).all()
+    assert (plan.quantity <= SharedTradingStats.MAX_LISTINGS * LISTING_SIZE).all()
+    assert (flips.expected_pph[plan.rows, plan.params] > 0).all()
+    assert plan.expected_pph.sum() <= plan.upper_bound + 1e-6
+
+
+def test_plan_takes_the_best_flip_of_an_item():
+    flips: FlipBatch = random_batch(n=1, n_params=3)
+    flips.quantity[:] = 10
+    flips.buy_price[:] = 100
+    flips.expected_sell_price[:] = 200
+    flips.expected_pph[0] = [100, 300, 200]
+    plan: FlipPlan = optimize(flips, 10 ** 6, 10)
+    assert plan.params.tolist() == [1]
+    assert plan.flip(0).quantity == 10
@@ -0,0 +1,59 @@
+import json
+
+import pytest
+
+import payload_decoder
+from benchmark import Fixtures
+from payload_decoder import ItemListingsTuple, ItemPricesTuple, decode_listings, decode_prices
+
+FIXTURES: Fixtures = Fixtures.synthetic(200)
+PRICES: list[dict] = list(FIXTURES.ticks[0][0].values())
+LISTINGS: list[dict] = list(FIXTURES.ticks[0][1].values())
+
+
+def reversed_keys(obj):
+    if isinstance(obj, dict):
+        return {key: reversed_keys(value) for key, value in reversed(obj.items())}
+    if isinstance(obj, list):
+        return [reversed_keys(value) for value in obj]
+    return obj
+
+
+def wire_format(payloads: list[dict]) -> bytes:
+    # the live api indents its responses with two spaces
+    return json.dumps(payloads, indent=2).encode("utf-8")
+
+
+@pytest.fixture
+def no_fallback(monkeypatch):
+    """makes the json fallback of the decoders fail, so only the fast path can pass"""
+
+    def fallback(*args, **kwargs):
+        raise AssertionError("fell back onto json.loads")
+
+    monkeypatch.setattr(payload_decoder.ItemPricesTuple, "from_json", fallback)
+    monkeypatch.setattr(payload_decoder.ItemListingsTuple, "from_json", fallback)
+
+
+@pytest.mark.parametrize("transform", [lambda obj: obj, reversed_keys])
+def test_fast_path_decodes_wire_format(transform, no_fallback):
+    prices_body: bytes = wire_format(transform(PRICES))
+    listings_body: bytes = wire_format(transform(LISTINGS))
+    assert decode_prices(prices_body) == [ItemPricesTuple(p["id"], p["buys"]["quantity"], p["buys"]["unit_price"],
+                                                          p["sells"]["quantity"], p["sells"]["unit_price"])
+                                          for p in PRICES]
+    assert decode_listings(listings_body, 10) == [
+        ItemListingsTuple(listings["id"],
+                          *(tuple((level["unit_price"], level["quantity"], level["listings"])
+                                  for level in listings[side][:10]) for side in ("buys", "sells")))
+        for listings in LISTINGS]
+
+
+def test_fixtures_serve_wire_format():
+    assert FIXTURES.respond("/v2/commerce/prices", [1, 2], 0) == wire_format(PRICES[:2])
+
+
+def test_unexpected_payload_falls_back():
+    body: bytes = json.dumps([{"id": 1, "buys": {"quantity": 1, "unit_price": 2, "extra": 3},
+                               "sells": {"quantity": 4, "unit_price": 5}}]).encode()
+    assert decode_prices(body) == [ItemPricesTuple(1, 1, 2, 4, 5)]
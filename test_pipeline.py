@@ -0,0 +1,33 @@
+import numpy as np
+import requests
+
+from api_handler import ApiHandler
+from benchmark import FixtureAdapter, Fixtures
+from pipeline import RefreshPipeline
+from request_engine import RequestEngine
+
+FIXTURES: Fixtures = Fixtures.synthetic(450)
+UNKNOWN_IDS: list[int] = [10 ** 9 + i for i in range(3)]
+
+
+def fixture_api() -> ApiHandler:
+    session: requests.Session = requests.Session()
+    session.mount("http://fixtures/", FixtureAdapter(FIXTURES))
+    return ApiHandler("http://fixtures/", RequestEngine(requests_per_minute=10 ** 6, session=session))
+
+
+def test_every_requested_id_is_received():
+    received: dict[str, list] = {"prices": [], "listings": []}
+    pipeline: RefreshPipeline = RefreshPipeline(fixture_api(), lambda prices, _: received["prices"].extend(prices),
+                                                lambda listings, _: received["listings"].extend(listings))
+    id_list: list[int] = FIXTURES.ids + UNKNOWN_IDS
+    listing_ids: list[int] = FIXTURES.ids[::3] + UNKNOWN_IDS
+    for _ in range(2):
+        # the second tick doesn't request the unknown ids, they still come back as None
+        received = {"prices": [], "listings": []}
+        changed_rows: np.ndarray = pipeline.run_tick(id_list, 0.0, listing_ids)
+        assert pipeline.received == len(id_list) + len(listing_ids)
+        assert len(received["prices"]) == len(id_list) and len(received["listings"]) == len(listing_ids)
+        assert sum(prices is None for prices in received["prices"]) == len(UNKNOWN_IDS)
+        assert len(pipeline.failed_ids) == 0
+        assert len(changed_rows) == 0
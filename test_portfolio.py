@@ -0,0 +1,89 @@
+import datetime
+
+import numpy as np
+
+from item import Flip
+from market_state import MarketState
+from payload_decoder import ItemListingsTuple
+from portfolio import Portfolio, _capital_at_risk
+from trading_post import TradingPost
+from transactions import BuyOrder, SellOrder, Transaction
+
+IDS: list[int] = [1, 2, 3, 4]
+
+
+def setup() -> tuple[MarketState, TradingPost, Portfolio]:
+    state: MarketState = MarketState(IDS)
+    state.buy_price[:] = 100
+    state.sell_price[:] = 130
+    tp: TradingPost = TradingPost(coins=10 ** 6)
+    tp.load_listings([ItemListingsTuple(item_id, ((100, 10, 1),), ((130, 10, 1),)) for item_id in IDS])
+    return state, tp, Portfolio(state, 10_000)
+
+
+def check_risk(portfolio: Portfolio) -> None:
+    assert portfolio.capital_at_risk == sum(_capital_at_risk(transaction) for transaction in portfolio.by_age)
+
+
+def test_transaction_lifecycle():
+    state, tp, portfolio = setup()
+    buy_order: BuyOrder = BuyOrder(5, 101)
+    order_id, _ = tp.buy(1, buy_order)
+    transaction: Transaction = portfolio.open(1, buy_order, order_id)
+    assert portfolio.capital_at_risk == 505 and portfolio.budget_left == 10_000 - 505
+    assert portfolio.by_status["buying"] == {transaction}
+
+    portfolio.apply(tp.tick({1: 3}, {}))
+    assert transaction.held == 3 and transaction.status == "mixed"
+    check_risk(portfolio)
+
+    sell_order: SellOrder = SellOrder(3, 101, 129)
+    order_id, fills = tp.sell(1, sell_order)
+    portfolio.list_for_sale(transaction, sell_order, order_id)
+    portfolio.apply(fills)
+    portfolio.apply(tp.tick({1: 10}, {1: 3}))
+    # the rest of the buy order was filled, the first sell order sold out
+    assert transaction.status == "selling" and transaction.held == 2 and transaction.sell_order.quantity == 0
+    check_risk(portfolio)
+
+    sell_order = SellOrder(2, 101, 129)
+    order_id, fills = tp.sell(1, sell_order)
+    portfolio.list_for_sale(transaction, sell_order, order_id)
+    portfolio.apply(fills)
+    portfolio.apply(tp.tick({}, {1: 2}))
+    assert transaction.status == "completed" and len(portfolio) == 0
+    assert portfolio.capital_at_risk == 0 and portfolio.completed == 1
+    assert portfolio.realized_profit == transaction.profit == 5 * int(0.9 * 129 - 7 - 101)
+    assert portfolio.by_item == {} and portfolio.by_order == {}
+
+
+def test_cancel_buy_completes_an_unfilled_transaction():
+    _, tp, portfolio = setup()
+    buy_order: BuyOrder = BuyOrder(5, 101)
+    order_id, _ = tp.buy(2, buy_order)
+    transaction: Transaction = portfolio.open(2, buy_order, order_id)
+    tp.cancel(order_id)
+    portfolio.cancel_buy(transaction)
+    assert transaction.status == "completed" and portfolio.capital_at_risk == 0
+
+
+def test_stale_orders_and_age():
+    state, tp, portfolio = setup()
+    transactions: list[Transaction] = []
+    for item_id in IDS:
+        buy_order: BuyOrder = BuyOrder(1, 101)
+        transactions.append(portfolio.open(item_id, buy_order, tp.buy(item_id, buy_order)[0]))
+    state.buy_price[[0, 2]] = 105
+    outbid, undercut = portfolio.stale_orders(np.array([0, 1]))
+    # only the rows looked at count, row 2 was outbid as well
+    assert outbid == [transactions[0]] and undercut == []
+    assert list(portfolio.older_than(datetime.timedelta(hours=1))) == []
+    assert list(portfolio.older_than(datetime.timedelta(0), datetime.datetime.now() + datetime.timedelta(seconds=1))) \
+        == transactions
+
+
+def test_can_afford_includes_the_listing_fee():
+    _, _, portfolio = setup()
+    # 10 * (950 + ceil(0.05 * 1000)) = 10_000
+    assert portfolio.can_afford(Flip(1, 0, 10, 950, 1000, 0, 0, 0))
+    assert not portfolio.can_afford(Flip(1, 0, 10, 951, 1000, 0, 0, 0))
@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from market_state import MarketState
+from query import PERIOD_FIELDS, ItemIndex
+
+N: int = 500
+
+
+def random_state(rng: np.random.Generator) -> MarketState:
+    state: MarketState = MarketState(list(range(1, N + 1)))
+    state.names = [f"{rng.choice(['Mithril', 'mithril', 'Orichalcum', 'Rune'])} {i}" for i in range(N)]
+    randomize(state, np.arange(N), rng)
+    return state
+
+
+def randomize(state: MarketState, rows: np.ndarray, rng: np.random.Generator) -> None:
+    # few distinct values, so there are plenty of ties
+    state.buy_price[rows] = rng.integers(0, 50, len(rows))
+    state.sell_price[rows] = state.buy_price[rows] + rng.integers(0, 20, len(rows))
+    state.supply[rows] = rng.integers(0, 1000, len(rows))
+    state.demand[rows] = rng.integers(0, 1000, len(rows))
+    for field in PERIOD_FIELDS:
+        getattr(state, field)[rows] = rng.random((len(rows), len(state.stats_period))) * 10
+
+
+def brute_force(values: np.ndarray, low, high) -> np.ndarray:
+    keep: np.ndarray = np.ones(len(values), dtype=bool)
+    if low is not None:
+        keep &= values >= low
+    if high is not None:
+        keep &= values <= high
+    return np.flatnonzero(keep)
+
+
+def check_ranges(index: ItemIndex, rng: np.random.Generator) -> None:
+    for key in index.keys():
+        values: np.ndarray = index._values(key)
+        assert np.all(np.diff(index.indexes[key].values) >= 0)
+        assert np.array_equal(index.indexes[key].values, values[index.indexes[key].rows])
+        for low, high in ((None, None), (None, 25), (10, None), (10, 25), (25, 10), *rng.random((5, 2)) * 50):
+            rows: np.ndarray = index.range(key, low, high)
+            assert np.array_equal(np.sort(rows), brute_force(values, low, high))
+            assert np.all(np.diff(values[rows]) >= 0)
+
+
+def test_range_and_update():
+    rng: np.random.Generator = np.random.default_rng(0)
+    state: MarketState = random_state(rng)
+    index: ItemIndex = ItemIndex(state)
+    check_ranges(index, rng)
+    for size in (1, 10, N // 2, N):
+        # rows may repeat, the way the polled rows of several refreshes are passed in at once
+        rows: np.ndarray = rng.integers(0, N, size)
+        randomize(state, rows, rng)
+        index.update(rows)
+        check_ranges(index, rng)
+
+
+def test_where():
+    rng: np.random.Generator = np.random.default_rng(1)
+    state: MarketState = random_state(rng)
+    index: ItemIndex = ItemIndex(state)
+    assert np.array_equal(index.where(), np.arange(N))
+    rows: np.ndarray = index.where(col=1, sell_price=(10, 40), spread=(5, None), sells=(None, 5))
+    expected: np.ndarray = np.flatnonzero((state.sell_price >= 10) & (state.sell_price <= 40)
+                                          & (state.sell_price - state.buy_price >= 5) & (state.sells[:, 1] <= 5))
+    assert np.array_equal(np.sort(rows), expected)
+    with pytest.raises(ValueError):
+        index.where(buys=(1, None))
+
+
+def test_prefix():
+    rng: np.random.Generator = np.random.default_rng(2)
+    state: MarketState = random_state(rng)
+    index: ItemIndex = ItemIndex(state)
+    rows: np.ndarray = index.prefix("MITHRIL ")
+    assert sorted(rows.tolist()) == [row for row, name in enumerate(state.names) if name.lower().startswith("mithril ")]
+    assert [state.names[row].lower() for row in rows] == sorted(state.names[row].lower() for row in rows)
+    assert len(index.prefix("")) == N and len(index.prefix("ectoplasm")) == 0
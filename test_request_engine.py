@@ -0,0 +1,88 @@
+import asyncio
+import time
+from typing import Optional
+
+import pytest
+import requests
+
+from benchmark import Fixtures, start_fixture_server
+from rate_limit import TokenBucket
+from request_engine import RequestEngine
+from retry import Backoff, CircuitBreaker
+
+FIXTURES: Fixtures = Fixtures.synthetic(10)
+
+
+@pytest.fixture
+def server():
+    """(url of the prices of the fixtures on a local fixture server, faults to answer the next requests with)"""
+
+    faults: list[tuple[int, dict[str, str]]] = []
+    fixture_server, _ = start_fixture_server(FIXTURES, faults)
+    yield f"http://127.0.0.1:{fixture_server.server_port}/commerce/prices", faults
+    fixture_server.shutdown()
+    fixture_server.server_close()
+
+
+def fetch(engine: RequestEngine, url: str) -> Optional[requests.Response]:
+    async def run():
+        return await engine.fetch(url, {"ids": ",".join(map(str, FIXTURES.ids))}, engine.semaphore())
+    return asyncio.run(run())
+
+
+def test_fetches_the_fixtures(server):
+    url, _ = server
+    engine: RequestEngine = RequestEngine(requests_per_minute=10 ** 6)
+    responses: list[Optional[requests.Response]] = engine.run_all(url, [{"ids": str(item_id)}
+                                                                         for item_id in FIXTURES.ids])
+    assert [response.content for response in responses] == [FIXTURES.respond("/commerce/prices", [item_id], 0)
+                                                              for item_id in FIXTURES.ids]
+
+
+def test_429_penalizes_the_bucket(server):
+    url, faults = server
+    faults.append((429, {"Retry-After": "1"}))
+    engine: RequestEngine = RequestEngine(requests_per_minute=10 ** 6)
+    start: float = time.monotonic()
+    response: Optional[requests.Response] = fetch(engine, url)
+    assert response is not None and response.status_code == 200
+    # the retry waited for the bucket, which handed out no tokens for the Retry-After seconds
+    assert engine.bucket.blocked_until >= start + 1
+    assert time.monotonic() - start >= 1
+    assert engine.breaker.state == "closed" and engine.breaker.failures == 0
+
+
+def test_retries_are_bounded_by_max_retry_time(server):
+    url, faults = server
+    faults.extend([(503, {})] * 100)
+    engine: RequestEngine = RequestEngine(requests_per_minute=10 ** 6, max_retry_count=100, max_retry_time=0.5)
+    engine.backoff = Backoff(base=0.05, cap=0.1)
+    start: float = time.monotonic()
+    assert fetch(engine, url) is None
+    assert time.monotonic() - start < 1.0
+    assert len(faults) > 0
+
+
+def test_breaker_opens_and_closes(server):
+    url, faults = server
+    faults.extend([(503, {})] * 2)
+    engine: RequestEngine = RequestEngine(requests_per_minute=10 ** 6, max_retry_count=2)
+    engine.backoff = Backoff(base=0.01, cap=0.01)
+    engine.breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2)
+    assert fetch(engine, url) is None
+    assert engine.breaker.state == "open"
+    # the server would answer now, but the open circuit doesn't even ask it
+    assert fetch(engine, url) is None
+    time.sleep(0.25)
+    assert engine.breaker.state == "half_open"
+    response: Optional[requests.Response] = fetch(engine, url)
+    assert response is not None and response.status_code == 200
+    assert engine.breaker.state == "closed"
+
+
+def test_bucket_paces_after_a_burst():
+    bucket: TokenBucket = TokenBucket(rate=10, capacity=3)
+    assert [bucket.try_acquire() for _ in range(3)] == [0.0] * 3
+    assert bucket.try_acquire() == pytest.approx(0.1, abs=0.01)
+    bucket.penalize(5)
+    assert bucket.try_acquire() == pytest.approx(5, abs=0.01)
@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+import requests
+
+from request_engine import RequestEngine
+from retry import CircuitBreaker
+
+
+class FakeSession(requests.Session):
+    """answers every request with the next of <status_codes>, repeating the last one"""
+
+    def __init__(self, status_codes: list[int], headers: dict[str, str] = None):
+        super().__init__()
+        self.status_codes: list[int] = status_codes
+        self.headers_of_response: dict[str, str] = {} if headers is None else headers
+        self.sent: int = 0
+
+    def get(self, url, **kwargs) -> requests.Response:
+        response: requests.Response = requests.Response()
+        response.status_code = self.status_codes[min(self.sent, len(self.status_codes) - 1)]
+        response.headers.update(self.headers_of_response)
+        response._content = b"[]"
+        self.sent += 1
+        return response
+
+
+def fetch(engine: RequestEngine) -> requests.Response:
+    async def run():
+        return await engine.fetch("http://api/commerce/prices", {}, engine.semaphore())
+    return asyncio.run(run())
+
+
+def half_open_engine(session: FakeSession, **kwargs) -> RequestEngine:
+    engine: RequestEngine = RequestEngine(session=session, requests_per_minute=10 ** 6, **kwargs)
+    engine.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    engine.breaker.record_failure()
+    time.sleep(0.06)
+    assert engine.breaker.state == "half_open"
+    return engine
+
+
+def test_429_probe_does_not_keep_the_circuit_open():
+    session: FakeSession = FakeSession([429, 200], {"retry-after": "0"})
+    engine: RequestEngine = half_open_engine(session)
+    response: requests.Response = fetch(engine)
+    assert response is not None and response.status_code == 200
+    assert engine.breaker.state == "closed"
+
+
+def test_429_probe_settles_the_probe_when_giving_up():
+    session: FakeSession = FakeSession([429], {"retry-after": "5"})
+    engine: RequestEngine = half_open_engine(session, max_retry_time=1.0)
+    assert fetch(engine) is None
+    assert not engine.breaker.probing
+    assert engine.breaker.state == "half_open"
+
+
+def test_429s_are_bounded_by_max_retry_time():
+    session: FakeSession = FakeSession([429], {"retry-after": "5"})
+    engine: RequestEngine = RequestEngine(session=session, requests_per_minute=10 ** 6, max_retry_time=1.0)
+    start: float = time.monotonic()
+    assert fetch(engine) is None
+    assert time.monotonic() - start < 1.0
+    assert session.sent == 1
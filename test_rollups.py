@@ -0,0 +1,81 @@
+import numpy as np
+
+from api_handler import ApiHandler
+from benchmark import Fixtures
+from market_state import MarketState
+from payload_decoder import decode_listings, decode_prices
+from rollups import BAR_DTYPE, Rollups
+
+N: int = 50
+RESOLUTIONS: dict[int, int] = {60: 5, 600: 3}
+
+
+def reference(refreshes: list[tuple[float, np.ndarray, np.ndarray]], row: int, resolution: int,
+              slots: int) -> list[tuple]:
+    """the bars of <row> straight from every (time, rows, values) refresh: a bar is kept as long as no later bar of the
+    row falls into its slot"""
+
+    bars: dict[int, list[int]] = {}
+    for time_now, rows, values in refreshes:
+        if row not in rows:
+            continue
+        buy, sell, sold, bought = values[row].tolist()
+        bar: int = int(time_now // resolution)
+        if bar not in bars:
+            bars[bar] = [buy, buy, buy, buy, sell, sell, sell, sell, 0, 0]
+        record: list[int] = bars[bar]
+        record[1], record[2], record[3] = max(record[1], buy), min(record[2], buy), buy
+        record[5], record[6], record[7] = max(record[5], sell), min(record[6], sell), sell
+        record[8] += sold
+        record[9] += bought
+    return [(bar * resolution, *record) for bar, record in sorted(bars.items())
+            if not any(later > bar and later % slots == bar % slots for later in bars)]
+
+
+def test_fold_matches_the_reference():
+    rng: np.random.Generator = np.random.default_rng(0)
+    state: MarketState = MarketState(list(range(1, N + 1)))
+    rollups: Rollups = Rollups(state, RESOLUTIONS)
+    refreshes: list[tuple[float, np.ndarray, np.ndarray]] = []
+    time_now: float = 1_700_000_000.0
+    for _ in range(300):
+        time_now += rng.integers(1, 40)
+        rows: np.ndarray = np.unique(rng.integers(0, N, rng.integers(1, N)))
+        values: np.ndarray = rng.integers(1, 1000, (N, 4))
+        state.buy_price[rows], state.sell_price[rows], state.last_sold[rows], state.last_bought[rows] = \
+            values[rows].T
+        rollups.fold(rows, time_now)
+        refreshes.append((time_now, rows, values))
+
+    for resolution, slots in RESOLUTIONS.items():
+        for row in range(N):
+            bars: np.ndarray = rollups.bars(int(state.ids[row]), resolution)
+            assert bars.dtype == BAR_DTYPE and len(bars) <= slots
+            assert bars.tolist() == reference(refreshes, row, resolution, slots)
+
+    bars = rollups.bars(1, 60)
+    start, end = int(bars["start"][1]), int(bars["start"][-1])
+    assert rollups.bars(1, 60, start, end).tolist() == bars[1:-1].tolist()
+
+
+def test_extend():
+    fixtures: Fixtures = Fixtures.synthetic(20)
+    items: dict[int, dict] = {item["id"]: item for item in fixtures.items}
+
+    def api_data(ids: list[int]) -> tuple[list, list, list]:
+        return [items[item_id] for item_id in ids], decode_prices(fixtures.respond("/v2/commerce/prices", ids, 0)), \
+            decode_listings(fixtures.respond("/v2/commerce/listings", ids, 0), ApiHandler.LISTING_CUTOFF)
+
+    state: MarketState = MarketState.from_api(*api_data(fixtures.ids[:10]))
+    rollups: Rollups = Rollups(state, RESOLUTIONS)
+    rollups.fold(np.arange(10), 600.0)
+    before: np.ndarray = rollups.bars(fixtures.ids[0], 600)
+
+    extended: MarketState = state.extended(*api_data(fixtures.ids[10:]))
+    rollups.extend(extended)
+    assert rollups.state is extended
+    assert rollups.bars(fixtures.ids[0], 600).tolist() == before.tolist()
+    assert len(rollups.bars(fixtures.ids[15], 600)) == 0
+    rollups.fold(np.arange(20), 660.0)
+    bars: np.ndarray = rollups.bars(fixtures.ids[15], 60)
+    assert len(bars) == 1 and bars["buy_close"][0] == extended.buy_price[15]
@@ -0,0 +1,11 @@
+import numpy as np
+
+from market_state import MarketState
+from scheduler import RefreshScheduler
+
+
+def test_empty_state_has_nothing_due():
+    scheduler: RefreshScheduler = RefreshScheduler(MarketState([]))
+    scheduler.reprioritize(np.empty(0))
+    assert scheduler.budget == 0
+    assert len(scheduler.due(0.0)) == 0
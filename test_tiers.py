@@ -0,0 +1,30 @@
+import numpy as np
+
+from api_handler import ApiHandler
+from benchmark import Fixtures
+from market_state import MarketState
+from payload_decoder import decode_listings, decode_prices
+from tiers import LISTINGS, PRICES, TieredUniverse
+
+FIXTURES: Fixtures = Fixtures.synthetic(150)
+ITEMS: dict[int, dict] = {item["id"]: item for item in FIXTURES.items}
+
+
+def api_data(ids: list[int]) -> tuple[list, list, list]:
+    return [ITEMS[item_id] for item_id in ids], decode_prices(FIXTURES.respond("/v2/commerce/prices", ids, 0)), \
+        decode_listings(FIXTURES.respond("/v2/commerce/listings", ids, 0), ApiHandler.LISTING_CUTOFF)
+
+
+def test_extend_keeps_the_tiers_of_the_existing_rows():
+    state: MarketState = MarketState.from_api(*api_data(FIXTURES.ids[:100]))
+    universe: TieredUniverse = TieredUniverse(state)
+    universe.tier[:] = np.where(np.arange(100) < 10, LISTINGS, PRICES)
+    universe.failed[:10] = 2
+
+    extended: MarketState = state.extended(*api_data(FIXTURES.ids[100:]))
+    universe.extend(extended)
+    assert universe.state is extended
+    assert (universe.tier[:100] == np.where(np.arange(100) < 10, LISTINGS, PRICES)).all()
+    assert (universe.failed[:10] == 2).all() and (universe.failed[10:] == 0).all()
+    # the new rows are screened like in a fresh universe
+    assert (universe.tier[100:] == TieredUniverse(extended).tier[100:]).all()
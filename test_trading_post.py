@@ -0,0 +1,82 @@
+import pytest
+
+from payload_decoder import ItemListingsTuple, ItemPricesTuple
+from trading_post import Fill, TradingPost, TradingPostError
+from transactions import BuyOrder, SellOrder
+
+
+def trading_post(coins: int = 100_000, items: dict[int, int] = None) -> TradingPost:
+    tp: TradingPost = TradingPost(coins, items)
+    tp.load_listings([ItemListingsTuple(1, ((100, 5, 1), (99, 10, 2)), ((110, 3, 1), (112, 4, 2)))])
+    return tp
+
+
+def test_best_buy_order_is_filled_first():
+    tp: TradingPost = trading_post()
+    order_id, fills = tp.buy(1, BuyOrder(4, 101))
+    assert fills == [] and tp.coins == 100_000 - 404
+    assert tp.get_item_prices_tuples_by_id_list([1, 2]) == [ItemPricesTuple(1, 19, 101, 7, 110), None]
+    assert tp.tick({1: 3}, {}) == [Fill(order_id, 1, "buys", 3, 101, 0)]
+    assert tp.tick({1: 3}, {}) == [Fill(order_id, 1, "buys", 1, 101, 0)]
+    assert tp.items == {1: 4} and order_id not in tp.orders
+    assert tp.get_item_listings_tuples_by_id_list([1])[0].buys == ((100, 3, 1), (99, 10, 2))
+
+
+def test_own_order_queues_behind_the_level():
+    tp: TradingPost = trading_post()
+    order_id, _ = tp.buy(1, BuyOrder(2, 100))
+    assert tp.tick({1: 5}, {}) == []
+    assert tp.tick({1: 1}, {}) == [Fill(order_id, 1, "buys", 1, 100, 0)]
+
+
+def test_crossing_sell_order_is_matched_right_away():
+    tp: TradingPost = trading_post(items={1: 2})
+    order_id, fills = tp.sell(1, SellOrder(2, 90, 99))
+    # matched at the price of the buy order, the listing fee of 5 per unit is paid at the listing price
+    assert fills == [Fill(order_id, 1, "sells", 2, 100, 2 * (90 - 5 - 90))]
+    assert tp.coins == 100_000 - 2 * 5 + 2 * 90
+    assert tp.items == {1: 0} and order_id not in tp.orders
+
+
+def test_crossing_buy_order_takes_the_cheapest_listings():
+    tp: TradingPost = trading_post()
+    order_id, fills = tp.buy(1, BuyOrder(5, 115))
+    assert [(fill.amount, fill.unit_price) for fill in fills] == [(3, 110), (2, 112)]
+    # paid upfront at 115, the difference to the prices matched is refunded
+    assert tp.coins == 100_000 - 3 * 110 - 2 * 112
+    assert tp.items == {1: 5}
+
+
+def test_relist_and_cancel():
+    tp: TradingPost = trading_post(items={1: 2})
+    order_id, _ = tp.sell(1, SellOrder(2, 90, 111))
+    coins: int = tp.coins
+    assert tp.relist(order_id, 109) == []
+    assert tp.coins == coins - 2 * 6
+    assert tp.get_item_listings_tuples_by_id_list([1])[0].sells[0] == (109, 2, 1)
+    tp.cancel(order_id)
+    assert tp.items == {1: 2}
+    assert tp.get_item_listings_tuples_by_id_list([1])[0].sells == ((110, 3, 1), (112, 4, 2))
+
+
+@pytest.mark.parametrize("side, price, coins", [("buys", 102, 0), ("buys", 100, 10 ** 6), ("sells", 112, 10 ** 6),
+                                                ("sells", 105, 0)])
+def test_failed_relist_leaves_the_order(side, price, coins):
+    tp: TradingPost = trading_post(coins=10 ** 6, items={1: 2})
+    order_id, _ = tp.buy(1, BuyOrder(2, 101)) if side == "buys" else tp.sell(1, SellOrder(2, 90, 111))
+    tp.coins = coins
+    listings: ItemListingsTuple = tp.get_item_listings_tuples_by_id_list([1])[0]
+    with pytest.raises(TradingPostError):
+        tp.relist(order_id, price)
+    assert tp.coins == coins
+    assert tp.get_item_listings_tuples_by_id_list([1])[0] == listings
+    assert tp.orders[order_id][2].listing_price == (101 if side == "buys" else 111)
+
+
+def test_orders_need_coins_and_items():
+    tp: TradingPost = trading_post(coins=100, items={1: 1})
+    with pytest.raises(TradingPostError):
+        tp.buy(1, BuyOrder(2, 101))
+    with pytest.raises(TradingPostError):
+        tp.sell(1, SellOrder(2, 90, 111))
+    assert tp.coins == 100 and tp.items == {1: 1} and tp.orders == {}
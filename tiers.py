@@ -0,0 +1,92 @@
+import numpy as np
+
+from market_state import MarketState
+
+PRICES: int = 0  # only the prices are polled
+LISTINGS: int = 1  # the listings are polled along with the prices
+
+
+def unit_margin(state: MarketState, rows: np.ndarray = None) -> np.ndarray:
+    """profit per unit of the best flip the current prices of <rows> allow: buying at one above the highest buy order
+    and selling at one below the lowest sell listing, neither below the price vendoring pays as much as (see
+    Item._get_flip)"""
+
+    rows = slice(None) if rows is None else rows
+    min_price: np.ndarray = np.ceil(state.vendor_value[rows] / 0.85)
+    buy_at: np.ndarray = np.maximum(min_price, state.buy_price[rows] + 1)
+    sell_at: np.ndarray = np.maximum(min_price, state.sell_price[rows] - 1)
+    return np.trunc(sell_at * 0.85 - buy_at)
+
+
+class TieredUniverse(object):
+    """splits the items of a MarketState into two tiers. the prices of every item are polled as scheduled, but the
+    listings only of the items in the LISTINGS tier. an item is in it if it passes the screens of its latest prices:
+    there are at least <min_demand> items in buy orders and <min_supply> items in sell listings, and flipping it at the
+    current prices makes at least <min_margin> coins and <min_roi> of the buy price per unit. an item is promoted as
+    soon as it passes and only demoted after failing <demote_after> screens in a row, so items at the edge don't keep
+    switching.
+    the listings stats of an item in the PRICES tier decay with every poll of its prices, as if nothing was filled,
+    and its ladders are dropped when it is promoted, so the fills of its first listings update aren't inferred from
+    outdated ladders"""
+
+    MIN_DEMAND: int = 1
+    MIN_SUPPLY: int = 1
+    MIN_MARGIN: int = 1
+    MIN_ROI: float = 0.02
+    DEMOTE_AFTER: int = 3
+
+    def __init__(self, state: MarketState, min_demand: int = None, min_supply: int = None, min_margin: int = None,
+                 min_roi: float = None, demote_after: int = None):
+        self.state: MarketState = state
+        self.min_demand: int = self.MIN_DEMAND if min_demand is None else min_demand
+        self.min_supply: int = self.MIN_SUPPLY if min_supply is None else min_supply
+        self.min_margin: int = self.MIN_MARGIN if min_margin is None else min_margin
+        self.min_roi: float = self.MIN_ROI if min_roi is None else min_roi
+        self.demote_after: int = self.DEMOTE_AFTER if demote_after is None else demote_after
+        self.failed: np.ndarray = np.zeros(len(state), dtype=np.int32)  # screens failed in a row
+        rows: np.ndarray = np.arange(len(state))
+        self.tier: np.ndarray = np.where(self.passes(rows), LISTINGS, PRICES).astype(np.int8)
+
+    def extend(self, state: MarketState) -> None:
+        """follows the state to <state>, a MarketState.extended version of it. the new rows are screened like in the
+        constructor, the others keep their tier and their failed screens"""
+
+        rows: np.ndarray = np.arange(len(self.tier), len(state))
+        self.state = state
+        self.failed = np.concatenate([self.failed, np.zeros(len(rows), dtype=np.int32)])
+        self.tier = np.concatenate([self.tier, np.where(self.passes(rows), LISTINGS, PRICES).astype(np.int8)])
+
+    def passes(self, rows: np.ndarray) -> np.ndarray:
+        """whether each of <rows> passes the liquidity and margin screens with its current prices"""
+
+        state: MarketState = self.state
+        margin: np.ndarray = unit_margin(state, rows)
+        buy_at: np.ndarray = np.maximum(1, state.buy_price[rows] + 1)
+        return (state.demand[rows] >= self.min_demand) & (state.supply[rows] >= self.min_supply) \
+            & (margin >= self.min_margin) & (margin >= self.min_roi * buy_at)
+
+    def listing_rows(self, rows: np.ndarray) -> np.ndarray:
+        """those of <rows> whose listings are to be polled"""
+
+        return rows[self.tier[rows] == LISTINGS]
+
+    def update(self, rows: np.ndarray, listed_rows: np.ndarray, time_now: float) -> np.ndarray:
+        """to be called after every tick with the <rows> that were polled and the <listed_rows> among them whose
+        listings were polled as well. decays the listings stats of the others, screens all of them again and moves
+        them between the tiers. returns the promoted rows, their ladders were dropped"""
+
+        state: MarketState = self.state
+        state.decay_listings(np.setdiff1d(rows, listed_rows, assume_unique=True), time_now)
+
+        passed: np.ndarray = self.passes(rows)
+        self.failed[rows] = np.where(passed, 0, self.failed[rows] + 1)
+        promoted: np.ndarray = rows[passed & (self.tier[rows] == PRICES)]
+        demoted: np.ndarray = rows[(self.failed[rows] >= self.demote_after) & (self.tier[rows] == LISTINGS)]
+        self.tier[promoted] = LISTINGS
+        self.tier[demoted] = PRICES
+        state.clear_listings(promoted)
+        return promoted
+
+    def __str__(self) -> str:
+        listed: int = int((self.tier == LISTINGS).sum())
+        return f"listings polled for {listed}/{len(self.tier)} items"
@@ -1,3 +1,348 @@
-class TradingPost:
-    pass
+import bisect
+import itertools
+import random
+import time
+from collections import deque
+from math import ceil, floor
+from typing import NamedTuple, Optional, Union
 
+from api_handler import ApiHandler, ItemListingsJson, ItemPricesJson
+from payload_decoder import ItemListingsTuple, ItemPricesTuple, ListingLevel
+from transactions import BuyOrder, SellOrder
+
+LISTING_FEE: float = 0.05  # paid per unit when a sell order is listed (or relisted), see SellOrder.relist
+EXCHANGE_FEE: float = 0.1  # taken from the price of every unit sold, see SellOrder.fill
+
+
+class Fill(NamedTuple):
+    """a (partial) fill of one of our orders"""
+
+    order_id: int
+    item_id: int
+    side: str  # "buys" or "sells"
+    amount: int
+    unit_price: int  # price the amount was traded at
+    profit: int  # as returned by SellOrder.fill, 0 for buy orders
+
+
+class _Level(object):
+    """a single price level of a book. the quantity listed by everyone else is only known in aggregate, our own orders
+    are queued behind it in the order they were placed"""
+
+    __slots__ = ("unit_price", "quantity", "listings", "order_ids", "own_quantity")
+
+    def __init__(self, unit_price: int):
+        self.unit_price: int = unit_price
+        self.quantity: int = 0  # listed by others
+        self.listings: int = 0  # listed by others
+        self.order_ids: deque[int] = deque()
+        self.own_quantity: int = 0
+
+    def is_empty(self) -> bool:
+        return self.quantity == 0 and len(self.order_ids) == 0
+
+
+class _BookSide(object):
+    """the buy or sell side of the book of an item. levels are kept sorted by key = sign * unit_price, so the best
+    level is always the last one and can be looked at and removed in O(1)"""
+
+    __slots__ = ("sign", "keys", "levels")
+
+    def __init__(self, sign: int):
+        self.sign: int = sign  # 1 for buys (highest price is best), -1 for sells (lowest price is best)
+        self.keys: list[int] = []
+        self.levels: dict[int, _Level] = {}  # unit_price -> level
+
+    def best(self) -> Optional[_Level]:
+        return self.levels[self.sign * self.keys[-1]] if len(self.keys) > 0 else None
+
+    def level(self, unit_price: int) -> _Level:
+        """the level at <unit_price>, created if it doesn't exist yet"""
+
+        level: Optional[_Level] = self.levels.get(unit_price)
+        if level is None:
+            level = self.levels[unit_price] = _Level(unit_price)
+            bisect.insort(self.keys, self.sign * unit_price)
+        return level
+
+    def discard_if_empty(self, level: _Level) -> None:
+        if level.is_empty():
+            del self.levels[level.unit_price]
+            index: int = bisect.bisect_left(self.keys, self.sign * level.unit_price)
+            del self.keys[index]
+
+    def crosses(self, unit_price: int) -> bool:
+        """whether an incoming order of the opposite side at <unit_price> would be matched with this side"""
+
+        return len(self.keys) > 0 and self.sign * (self.keys[-1] * self.sign - unit_price) >= 0
+
+    def ladder(self, depth: int = None) -> tuple[ListingLevel, ...]:
+        """the levels in the shape of the api, best first"""
+
+        keys: list[int] = self.keys if depth is None else self.keys[-depth:]
+        return tuple((level.unit_price, level.quantity + level.own_quantity, level.listings + len(level.order_ids))
+                     for level in (self.levels[self.sign * key] for key in reversed(keys)))
+
+    def total_quantity(self) -> int:
+        return sum(level.quantity + level.own_quantity for level in self.levels.values())
+
+
+class TradingPostError(Exception):
+    """an order can't be placed or changed, e.g. for lack of coins or items. nothing was changed"""
+
+
+class TradingPost(object):
+    """local simulation of the trading post. every item has a price-sorted order book on both sides, made up of the
+    listings of everyone else (loaded from api data with <load_listings>) and our own orders (<buy>, <sell>). our
+    orders are filled by matching them with the market activity passed to <tick>, which takes the levels best first
+    and, within a level, serves the listings of others before ours. fees and profits are calculated the way
+    SellOrder does: the listing fee is paid when a sell order is listed and the exchange fee is taken from every sale.
+    the books can be read back with the same methods and in the same shape as the ones of ApiHandler, so the rest of
+    the bot can be run against the simulation instead of the api"""
+
+    LISTING_CUTOFF: int = ApiHandler.LISTING_CUTOFF
+
+    def __init__(self, coins: int = 0, items: dict[int, int] = None):
+        self.coins: int = coins  # coins not tied up in buy orders
+        self.items: dict[int, int] = {} if items is None else dict(items)  # item_id -> quantity in our inventory
+        self.books: dict[int, tuple[_BookSide, _BookSide]] = {}  # item_id -> (buys, sells)
+        self.orders: dict[int, tuple[int, str, Union[BuyOrder, SellOrder]]] = {}  # order_id -> (item_id, side, order)
+        self._order_ids: itertools.count = itertools.count()
+
+    def _book(self, item_id: int) -> tuple[_BookSide, _BookSide]:
+        book: Optional[tuple[_BookSide, _BookSide]] = self.books.get(item_id)
+        if book is None:
+            book = self.books[item_id] = (_BookSide(1), _BookSide(-1))
+        return book
+
+    def load_listings(self, listings_list: list[Union[ItemListingsJson, ItemListingsTuple, None]]) -> None:
+        """replaces the listings of everyone else with the ones in <listings_list> (api data, as json or tuples). our
+        own orders stay where they are"""
+
+        for item_listings in listings_list:
+            if item_listings is None:
+                continue
+            if isinstance(item_listings, dict):
+                item_listings = ItemListingsTuple.from_json(item_listings)
+            for side, ladder in zip(self._book(item_listings.id), (item_listings.buys, item_listings.sells)):
+                for level in list(side.levels.values()):
+                    level.quantity = level.listings = 0
+                    side.discard_if_empty(level)
+                for unit_price, quantity, listings in ladder:
+                    level: _Level = side.level(unit_price)
+                    level.quantity, level.listings = quantity, listings
+
+    def _take(self, side: _BookSide, amount: int, limit_price: int = None) \
+            -> tuple[list[tuple[int, int]], list[Fill]]:
+        """takes up to <amount> from the best levels of <side> (down to <limit_price> if provided), filling our orders
+        in there along the way. returns the (unit_price, amount) taken from each level and the fills of our orders"""
+
+        taken: list[tuple[int, int]] = []
+        fills: list[Fill] = []
+        while amount > 0:
+            level: Optional[_Level] = side.best()
+            if level is None or (limit_price is not None and side.sign * (level.unit_price - limit_price) < 0):
+                break
+            level_amount: int = min(level.quantity, amount)
+            level.quantity -= level_amount
+            # whole listings are filled first, so the listings count only drops once their quantity is gone
+            level.listings = min(level.listings, level.quantity)
+            while level_amount < amount and len(level.order_ids) > 0:
+                order_id: int = level.order_ids[0]
+                fill: Fill = self._fill(order_id, min(self.orders[order_id][2].quantity, amount - level_amount),
+                                        level.unit_price)
+                level.own_quantity -= fill.amount
+                level_amount += fill.amount
+                fills.append(fill)
+                if self.orders[order_id][2].quantity == 0:
+                    level.order_ids.popleft()
+                    del self.orders[order_id]
+            side.discard_if_empty(level)
+            taken.append((level.unit_price, level_amount))
+            amount -= level_amount
+        return taken, fills
+
+    def _fill(self, order_id: int, amount: int, unit_price: int) -> Fill:
+        item_id, side, order = self.orders[order_id]
+        if side == "buys":
+            order.fill(amount)
+            # paid upfront at the listing price, matching a cheaper sell listing refunds the difference
+            self.coins += amount * (order.listing_price - unit_price)
+            self.items[item_id] = self.items.get(item_id, 0) + amount
+            return Fill(order_id, item_id, side, amount, unit_price, 0)
+        self.coins += floor(amount * (1 - EXCHANGE_FEE) * unit_price)
+        return Fill(order_id, item_id, side, amount, unit_price, order.fill(amount, unit_price))
+
+    def _place(self, item_id: int, side: str, order: Union[BuyOrder, SellOrder], order_id: int) -> list[Fill]:
+        """matches <order> with the opposite side of the book as far as it crosses it and lists the rest"""
+
+        buys, sells = self._book(item_id)
+        own_side, other_side = (buys, sells) if side == "buys" else (sells, buys)
+        self.orders[order_id] = (item_id, side, order)
+        fills: list[Fill] = []
+        if other_side.crosses(order.listing_price):
+            taken, fills = self._take(other_side, order.quantity, order.listing_price)
+            fills += [self._fill(order_id, amount, unit_price) for unit_price, amount in taken]
+        if order.quantity > 0:
+            level: _Level = own_side.level(order.listing_price)
+            level.order_ids.append(order_id)
+            level.own_quantity += order.quantity
+        else:
+            del self.orders[order_id]
+        return fills
+
+    def buy(self, item_id: int, order: BuyOrder) -> tuple[int, list[Fill]]:
+        """places a buy order, paying for all of it upfront. returns its order id and the fills of the part of it that
+        was matched with sell listings right away"""
+
+        cost: int = order.quantity * order.listing_price
+        if cost > self.coins:
+            raise TradingPostError("not enough coins to place the buy order")
+        self.coins -= cost
+        order_id: int = next(self._order_ids)
+        return order_id, self._place(item_id, "buys", order, order_id)
+
+    def sell(self, item_id: int, order: SellOrder) -> tuple[int, list[Fill]]:
+        """lists a sell order, paying the listing fee. returns its order id and the fills of the part of it that was
+        matched with buy orders right away"""
+
+        if order.quantity > self.items.get(item_id, 0):
+            raise TradingPostError("not enough items to place the sell order")
+        fee: int = ceil(LISTING_FEE * order.listing_price)
+        if order.quantity * fee > self.coins:
+            raise TradingPostError("not enough coins to pay the listing fee")
+        self.items[item_id] -= order.quantity
+        self.coins -= order.quantity * fee
+        order.tax_paid += fee
+        order_id: int = next(self._order_ids)
+        return order_id, self._place(item_id, "sells", order, order_id)
+
+    def _unlist(self, order_id: int) -> tuple[int, str, Union[BuyOrder, SellOrder]]:
+        """takes an order of ours out of its book"""
+
+        item_id, side, order = self.orders[order_id]
+        buys, sells = self.books[item_id]
+        own_side: _BookSide = buys if side == "buys" else sells
+        level: _Level = own_side.levels[order.listing_price]
+        level.order_ids.remove(order_id)
+        level.own_quantity -= order.quantity
+        own_side.discard_if_empty(level)
+        return item_id, side, order
+
+    def cancel(self, order_id: int) -> Union[BuyOrder, SellOrder]:
+        """cancels an order. the coins of the unfilled part of a buy order are refunded, the unsold items of a sell
+        order go back into the inventory (the listing fee is lost)"""
+
+        item_id, side, order = self._unlist(order_id)
+        del self.orders[order_id]
+        if side == "buys":
+            self.coins += order.quantity * order.listing_price
+        else:
+            self.items[item_id] = self.items.get(item_id, 0) + order.quantity
+        return order
+
+    def relist(self, order_id: int, price: int) -> list[Fill]:
+        """moves an order to a better price (see BuyOrder.relist and SellOrder.relist). it goes to the back of the
+        queue of its new level, paying the difference for a buy order and the listing fee at the new price for a sell
+        order. returns the fills of the part of it that was matched right away"""
+
+        item_id, side, order = self.orders[order_id]
+        # checked before the order leaves its book, a relist that isn't allowed leaves the order as it was
+        if (price <= order.listing_price) if side == "buys" else (price >= order.listing_price):
+            raise TradingPostError("a buy order can only be relisted higher" if side == "buys"
+                                   else "a sell order can only be relisted lower")
+        cost: int = order.quantity * (price - order.listing_price) if side == "buys" \
+            else order.quantity * ceil(LISTING_FEE * price)
+        if cost > self.coins:
+            raise TradingPostError("not enough coins to relist the buy order" if side == "buys"
+                                   else "not enough coins to pay the listing fee")
+        self._unlist(order_id)
+        self.coins -= cost
+        order.relist(price)
+        return self._place(item_id, side, order, order_id)
+
+    def tick(self, sold: dict[int, int], bought: dict[int, int]) -> list[Fill]:
+        """applies the trading of everyone else since the last tick: <sold> is the amount per item id sold into buy
+        orders, <bought> the amount bought from sell listings (e.g. the amounts MarketState.filled_amounts sees in the
+        api data, or a random load). returns the fills of our orders"""
+
+        fills: list[Fill] = []
+        for amounts, side_index in ((sold, 0), (bought, 1)):
+            for item_id, amount in amounts.items():
+                book: Optional[tuple[_BookSide, _BookSide]] = self.books.get(item_id)
+                if book is not None and amount > 0:
+                    fills += self._take(book[side_index], amount)[1]
+        return fills
+
+    def get_item_prices_tuples_by_id_list(self, id_list: list[int] = []) -> list[Optional[ItemPricesTuple]]:
+        """see ApiHandler.get_item_prices_tuples_by_id_list. None for ids without a book"""
+
+        prices_list: list[Optional[ItemPricesTuple]] = []
+        for item_id in id_list:
+            book: Optional[tuple[_BookSide, _BookSide]] = self.books.get(item_id)
+            if book is None:
+                prices_list.append(None)
+                continue
+            best_buy, best_sell = book[0].best(), book[1].best()
+            prices_list.append(ItemPricesTuple(item_id, book[0].total_quantity(),
+                                               0 if best_buy is None else best_buy.unit_price,
+                                               book[1].total_quantity(),
+                                               0 if best_sell is None else best_sell.unit_price))
+        return prices_list
+
+    def get_item_prices_by_id_list(self, id_list: list[int] = []) -> list[Optional[ItemPricesJson]]:
+        """see ApiHandler.get_item_prices_by_id_list"""
+
+        return [None if item_prices is None else item_prices.to_json()
+                for item_prices in self.get_item_prices_tuples_by_id_list(id_list)]
+
+    def get_item_listings_tuples_by_id_list(self, id_list: list[int] = []) -> list[Optional[ItemListingsTuple]]:
+        """see ApiHandler.get_item_listings_tuples_by_id_list, only the first LISTING_CUTOFF levels are returned as
+        well"""
+
+        return [None if item_id not in self.books else
+                ItemListingsTuple(item_id, *(side.ladder(self.LISTING_CUTOFF) for side in self.books[item_id]))
+                for item_id in id_list]
+
+    def get_item_listings_by_id_list(self, id_list: list[int] = []) -> list[Optional[ItemListingsJson]]:
+        """see ApiHandler.get_item_listings_by_id_list"""
+
+        return [None if item_listings is None else item_listings.to_json()
+                for item_listings in self.get_item_listings_tuples_by_id_list(id_list)]
+
+
+def main():
+    # load test: thousands of flips on synthetic books, with random activity of everyone else
+    from benchmark import Fixtures
+
+    rng: random.Random = random.Random(0)
+    fixtures: Fixtures = Fixtures.synthetic(20_000)
+    trading_post: TradingPost = TradingPost(coins=10 ** 12)
+    trading_post.load_listings(list(fixtures.ticks[0][1].values()))
+    ids: list[int] = list(trading_post.books)
+    for item_id in rng.sample(ids, 5000):
+        best_buy: Optional[_Level] = trading_post.books[item_id][0].best()
+        trading_post.buy(item_id, BuyOrder(rng.randint(1, 50), 1 if best_buy is None else best_buy.unit_price + 1))
+
+    fill_count: int = 0
+    start: float = time.perf_counter()
+    ticks: int = 100
+    for _ in range(ticks):
+        active: list[int] = rng.sample(ids, 2000)
+        fills: list[Fill] = trading_post.tick({item_id: rng.randint(0, 100) for item_id in active[:1000]},
+                                              {item_id: rng.randint(0, 100) for item_id in active[1000:]})
+        fill_count += len(fills)
+        # list everything that was bought, undercutting the best sell listing
+        for fill in fills:
+            if fill.side == "buys":
+                best_sell: Optional[_Level] = trading_post.books[fill.item_id][1].best()
+                price: int = fill.unit_price * 2 if best_sell is None else max(fill.unit_price + 1,
+                                                                              best_sell.unit_price - 1)
+                trading_post.sell(fill.item_id, SellOrder(fill.amount, fill.unit_price, price))
+    elapsed: float = time.perf_counter() - start
+    print(f"{ticks} ticks in {elapsed:.2f}s ({elapsed / ticks * 1000:.1f}ms per tick), {fill_count} fills, "
+          f"{len(trading_post.orders)} open orders, {trading_post.coins - 10 ** 12} coins")
+
+
+if __name__ == '__main__':
+    main()
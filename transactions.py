@@ -1,5 +1,6 @@
 import datetime
 from math import ceil, floor
+from typing import Optional
 
 
 class BuyOrder:
@@ -32,17 +33,21 @@ class SellOrder:
         self.tax_paid += ceil(0.05 * price)
         self.listing_time = datetime.datetime.now()
 
-    def fill(self, amount: int):
+    def fill(self, amount: int, unit_price: int = None):
+        # <unit_price> is the price the amount actually sold for, if it was matched with a higher buy order
         assert amount <= self.quantity, "apparently sold more than I have :monkaS:"
+        unit_price = self.listing_price if unit_price is None else unit_price
         self.quantity -= amount
-        profit: int = floor(amount * (0.9 * self.listing_price - self.tax_paid - self.buy_price))
+        profit: int = floor(amount * (0.9 * unit_price - self.tax_paid - self.buy_price))
         return profit
 
 
 class Transaction:
-    def __init__(self):
+    def __init__(self, item_id: int, buy_order: BuyOrder):
+        self.item_id: int = item_id
         self.start_time: datetime.datetime = datetime.datetime.now()
         self.status: str = "buying"  # buying, mixed, selling, completed
-        self.buy_order: BuyOrder
-        self.sell_order: SellOrder
-        pass
+        self.buy_order: BuyOrder = buy_order
+        self.sell_order: Optional[SellOrder] = None
+        self.held: int = 0  # bought, but not listed for sale yet
+        self.profit: int = 0  # realized so far, see SellOrder.fill